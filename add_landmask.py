@@ -4,15 +4,34 @@ python add_landmask.py
 Adds a land mask to a raw .dat file stitche from reprojected quads
 
 Usage:
-    python add_landmask.py <grid_name> <stiched_dat_fn> <withland_fn>
+    python add_landmask.py [--max-block-mb N] [--landmask-dir DIR]
+                           [--landmask-fn FN] [--landmask-flavour NAME]
+                           <grid_name> <stiched_dat_fn> <withland_fn>
+    python add_landmask.py [--max-block-mb N] [--landmask-dir DIR]
+                           [--landmask-fn FN] [--landmask-flavour NAME]
+                           --inplace <grid_name> <stiched_dat_fn>
   eg
     python add_landmask.py psn25  ./regions_20211003_nh_3411.dat ./regions_20211003_nh_3411_withland.dat  #noqa
+
+The data and land mask are memory-mapped and processed in blocks of rows,
+so that memory use is bounded by max_block_bytes (--max-block-mb) rather
+than by the size of the grid.  With --inplace, the stitched .dat file is
+overwritten with the landmasked data.
+
+The land mask is --landmask-fn, or else the entry of grid_name in
+landmask_fns, or else <grid_name>_loilid.dat in --landmask-dir, or else in
+$SEAICE_REGIONS_LANDMASK_DIR, or else in default_landmask_dir.  Its values
+are re-encoded by the flavour (loilid, shoredistance or amsru) named in
+its filename, or by --landmask-flavour.
 """
 
 import os
 import sys
 import numpy as np
 
+from grid_defs import get_grid_def, grid_names
+from stage_timer import guess_region_set, timed_stage
+
 # These are in all land mask raw data files
 land_encoding_value = 30
 coast_encoding_value = 31
@@ -24,149 +43,274 @@ iceshelf_encoding_value=34
 discon_encoding_value=35
 offearth_encoding_value=40
 
+# How the values of each flavour of land mask file are re-encoded.
+# The flavour is recognized by its name appearing in the land mask filename,
+# and land mask values not listed keep the region value of the data.
+landmask_flavours = {
+    # For the CDR "shoredistance" masks
+    'shoredistance': {
+        1: land_encoding_value,
+        7: land_encoding_value,
+        2: coast_encoding_value,
+        6: lake_encoding_value,
+    },
+    # For the AMSRU-derived land masks
+    'amsru': {
+        120: land_encoding_value,
+    },
+    # For the land masks we generate from BU-MODIS, ADD, BMG data
+    # landmask ocean (val=50) not re-encoded
+    'loilid': {
+        80: discon_encoding_value,
+        150: land_encoding_value,
+        175: lake_encoding_value,
+        200: landice_encoding_value,
+        220: iceshelf_encoding_value,
+        250: offearth_encoding_value,
+    },
+}
+
+landmask_warnings = {
+    'amsru': 'AMSRU-derived land masks only include land; not lakes or coast',
+}
+
+# Names of the values which must not already be in the data
+reserved_values = {
+    'land': land_encoding_value,
+    'coast': coast_encoding_value,
+    'lake': lake_encoding_value,
+    'landice': landice_encoding_value,
+    'iceshelf': iceshelf_encoding_value,
+    'discon': discon_encoding_value,
+    'offearth': offearth_encoding_value,
+}
+
+# Upper limit of the memory used for the blocks of rows being processed
+default_max_block_bytes = 64 * 1024 * 1024
+block_bytes_per_cell = 4
+
+# Order in which surface mask values win ties when downsampling a withland
+# grid to a coarser resolution (see downsample_regions.py)
+land_precedence = (
+    land_encoding_value,
+    landice_encoding_value,
+    iceshelf_encoding_value,
+    lake_encoding_value,
+    coast_encoding_value,
+    discon_encoding_value,
+    offearth_encoding_value,
+)
+
+# Land masks are read from landmask_dir, which is the environment
+# variable SEAICE_REGIONS_LANDMASK_DIR if it is set
+landmask_dir_envvar = 'SEAICE_REGIONS_LANDMASK_DIR'
+# Our masks calculated from BU-MODIS, ADD, BMG
+default_landmask_dir = '/home/scotts/bumodis_gen/loilid_files'
+
+
+def get_landmask_dir():
+    """Return the directory of the land mask files"""
+    return os.environ.get(landmask_dir_envvar, default_landmask_dir)
+
+
+# Land mask files used in place of the <grid_name>_loilid.dat files of
+# landmask_dir, by grid_name
 landmask_fns = {
+    # Earlier land masks:
     # Derived from NT code
     # 'psn25': './landmask-shoredistance-north.dat',
     # 'pss25': './landmask-shoredistance-south.dat',
 
     # Derived from AMSR_U2 .he5 files
-    #'psn25': './amsru_landmask_n25km.dat',
-    #'pss25': './amsru_landmask_s25km.dat',
-    #'psn12.5': './amsru_landmask_n12.5km.dat',
-    #'pss12.5': './amsru_landmask_s12.5km.dat',
-
-    # Our masks calculated from BU-MODIS, ADD, BMG
-    'psn25': '/home/scotts/bumodis_gen//loilid_files/psn25_loilid.dat',
-    'psn12.5': '/home/scotts/bumodis_gen//loilid_files/psn12.5_loilid.dat',
-    'psn6.25': '/home/scotts/bumodis_gen//loilid_files/psn6.25_loilid.dat',
-    'psn3.125': '/home/scotts/bumodis_gen//loilid_files/psn3.125_loilid.dat',
-
-    'pss25': '/home/scotts/bumodis_gen//loilid_files/pss25_loilid.dat',
-    'pss12.5': '/home/scotts/bumodis_gen//loilid_files/pss12.5_loilid.dat',
-    'pss6.25': '/home/scotts/bumodis_gen//loilid_files/pss6.25_loilid.dat',
-    'pss3.125': '/home/scotts/bumodis_gen//loilid_files/pss3.125_loilid.dat',
-
-    'e2n25': '/home/scotts/bumodis_gen//loilid_files/e2n25_loilid.dat',
-    'e2n12.5': '/home/scotts/bumodis_gen//loilid_files/e2n12.5_loilid.dat',
-    'e2n6.25': '/home/scotts/bumodis_gen//loilid_files/e2n6.25_loilid.dat',
-    'e2n3.125': '/home/scotts/bumodis_gen//loilid_files/e2n3.125_loilid.dat',
-
-    'e2s25': '/home/scotts/bumodis_gen//loilid_files/e2s25_loilid.dat',
-    'e2s12.5': '/home/scotts/bumodis_gen//loilid_files/e2s12.5_loilid.dat',
-    'e2s6.25': '/home/scotts/bumodis_gen//loilid_files/e2s6.25_loilid.dat',
-    'e2s3.125': '/home/scotts/bumodis_gen//loilid_files/e2s3.125_loilid.dat',
-}
-
-binary_shapes = {
-    'psn25': (448, 304),
-    'psn12.5': (896, 608),
-    'psn6.25': (1792, 1216),
-    'psn3.125': (3584, 2432),
-
-    'pss25': (316, 332),
-    'pss12.5': (632, 664),
-    'pss6.25': (1264, 1328),
-    'pss3.125': (2528, 2656),
-
-    'e2n25': (720, 720),
-    'e2n12.5': (1440, 1440),
-    'e2n6.25': (2880, 2880),
-    'e2n3.125': (5760, 5760),
-
-    'e2s25': (720, 720),
-    'e2s12.5': (1440, 1440),
-    'e2s6.25': (2880, 2880),
-    'e2s3.125': (5760, 5760),
+    # 'psn25': './amsru_landmask_n25km.dat',
+    # 'pss25': './amsru_landmask_s25km.dat',
+    # 'psn12.5': './amsru_landmask_n12.5km.dat',
+    # 'pss12.5': './amsru_landmask_s12.5km.dat',
 }
 
-grid_name = sys.argv[1]
-assert grid_name in binary_shapes.keys()
-assert grid_name in landmask_fns.keys()
-
-data_fn = sys.argv[2]
-assert os.path.isfile(data_fn)
 
-ofn = sys.argv[3]
-assert data_fn != ofn
+def get_landmask_fn(grid_name, landmask_dir=None, landmask_fn=None):
+    """Return the land mask file of grid_name
 
-landmask = np.fromfile(landmask_fns[grid_name], dtype=np.uint8).reshape(
-    binary_shapes[grid_name])
+    This is landmask_fn if given, else the entry of landmask_fns, else the
+    loilid file of landmask_dir (see get_landmask_dir)
+    """
+    if landmask_fn is not None:
+        return landmask_fn
+    if grid_name in landmask_fns:
+        return landmask_fns[grid_name]
+    if landmask_dir is None:
+        landmask_dir = get_landmask_dir()
 
-data = np.fromfile(data_fn, dtype=np.uint8).reshape(binary_shapes[grid_name])
+    return os.path.join(landmask_dir, f'{grid_name}_loilid.dat')
 
-try:
-    assert np.all(data != land_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has land value: {land_encoding_value}, {np.sum(np.where(data == land_encoding_value))} times')  # noqa
 
-try:
-    assert np.all(data != coast_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has coast value: {coast_encoding_value}, {np.sum(np.where(data == coast_encoding_value))} times')  # noqa
+# (ydim, xdim) of each grid
+binary_shapes = {
+    grid_name: (get_grid_def(grid_name)['ydim'],
+                get_grid_def(grid_name)['xdim'])
+    for grid_name in grid_names}
 
-try:
-    assert np.all(data != lake_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has lake value: {lake_encoding_value}, {np.sum(np.where(data == lake_encoding_value))} times')  # noqa
 
-try:
-    assert np.all(data != landice_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has landice value: {landice_encoding_value}, {np.sum(np.where(data == landice_encoding_value))} times')  # noqa
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
 
-try:
-    assert np.all(data != iceshelf_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has iceshelf value: {iceshelf_encoding_value}, {np.sum(np.where(data == iceshelf_encoding_value))} times')  # noqa
 
-try:
-    assert np.all(data != discon_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has discon value: {discon_encoding_value}, {np.sum(np.where(data == discon_encoding_value))} times')  # noqa
+def get_landmask_flavour(landmask_fn, flavour=None):
+    """Return the name of the land mask flavour used by landmask_fn
 
-try:
-    assert np.all(data != offearth_encoding_value)
-except AssertionError:
-    raise SystemExit(f'Data already has offearch value: {offearth_encoding_value}, {np.sum(np.where(data == offearth_encoding_value))} times')  # noqa
+    A given flavour is only checked, for files whose names do not say it
+    """
+    if flavour is not None:
+        if flavour not in landmask_flavours:
+            raise SystemExit(f'Unknown land mask flavour: {flavour}  (options: {", ".join(landmask_flavours)})')  # noqa
+        return flavour
 
+    for flavour in landmask_flavours.keys():
+        if flavour in landmask_fn:
+            return flavour
+    raise SystemExit(f'Cannot interpet land mask values from: {landmask_fn}')  # noqa
+
+
+def make_landmask_luts(flavour):
+    """Return the 256-entry lookup tables for a land mask flavour
 
-if 'shoredistance' in landmask_fns[grid_name]:
-    # For the CDR "shoredistance" masks
-    is_land = (landmask == 1) | (landmask == 7)
-    is_coast = (landmask == 2)
-    is_lake = (landmask == 6)
-
-    data[is_land] = land_encoding_value
-    data[is_coast] = coast_encoding_value
-    data[is_lake] = lake_encoding_value
-elif 'amsru' in landmask_fns[grid_name]:
-    # For the AMSRU-derived land masks
-    print('WARNING: AMSRU-derived land masks only include land; not lakes or coast')  # noqa
-    is_land = (landmask == 120)
-    # is_coast = (landmask == 2)
-    # is_lake = (landmask == 6)
-
-    data[is_land] = land_encoding_value
-    # data[is_coast] = coast_encoding_value
-    # data[is_lake] = lake_encoding_value
-elif 'loilid' in landmask_fns[grid_name]:
-    # For the land masks we generate from BU-MODIS, ADD, BMG data
-    # landmask ocean (val=50) not re-encoded
-    is_discon = (landmask == 80)
-    is_land = (landmask == 150)
-    is_lake = (landmask == 175)
-    is_landice = (landmask == 200)
-    is_iceshelf = (landmask == 220)
-    is_offearth = (landmask == 250)
-
-    data[is_discon] = discon_encoding_value
-    data[is_land] = land_encoding_value
-    data[is_lake] = lake_encoding_value
-    data[is_landice] = landice_encoding_value
-    data[is_iceshelf] = iceshelf_encoding_value
-    data[is_offearth] = offearth_encoding_value
-else:
-    raise SystemExit(f'Cannot interpet land mask values from: {landmask_fns[grid_name]}')  # noqa
-
-data.tofile(ofn)
-print(f'Wrote landmasked data to: {ofn}')
+    is_surface[v] is True if land mask value v overrides the data,
+    and surface_value[v] is the value it is encoded as
+    """
+    is_surface = np.zeros(256, dtype=bool)
+    surface_value = np.zeros(256, dtype=np.uint8)
+    for landmask_value, value in landmask_flavours[flavour].items():
+        is_surface[landmask_value] = True
+        surface_value[landmask_value] = value
+
+    return is_surface, surface_value
+
+
+def encode_landmask(data, landmask, luts):
+    """Return data with the surface values of landmask encoded"""
+    is_surface, surface_value = luts
+
+    return np.where(
+        np.take(is_surface, landmask), np.take(surface_value, landmask), data)
+
+
+def check_reserved_values(counts):
+    """Exit if a histogram of the data has any of the reserved values"""
+    for name, value in reserved_values.items():
+        if counts[value] > 0:
+            raise SystemExit(f'Data already has {name} value: {value}, {counts[value]} times')  # noqa
+
+
+def add_landmask_array(data, landmask, flavour):
+    """Return a copy of data with the values of a land mask array added"""
+    assert data.shape == landmask.shape
+    check_reserved_values(np.bincount(data.ravel(), minlength=256))
+    if flavour in landmask_warnings:
+        print(f'WARNING: {landmask_warnings[flavour]}')
+
+    return encode_landmask(data, landmask, make_landmask_luts(flavour))
+
+
+def get_block_rows(xdim, max_block_bytes):
+    """Return the number of rows to process at once within the budget"""
+    # Each row of a block is held as a copy of the data, the land mask
+    # rows, one boolean mask and the encoded values
+    return max(1, max_block_bytes // (block_bytes_per_cell * xdim))
+
+
+@timed_stage('add_landmask', grid_id='grid_name',
+             output_fns=lambda args: args['ofn'] or args['data_fn'],
+             region_set=lambda args: guess_region_set(args['data_fn']))
+def add_landmask(
+        grid_name, data_fn, ofn=None, max_block_bytes=default_max_block_bytes,
+        landmask_dir=None, landmask_fn=None, landmask_flavour=None):
+    """Write data_fn to ofn with the land mask values of grid_name added
+
+    If ofn is None, data_fn is overwritten in place.  The land mask is
+    landmask_fn, or else found as get_landmask_fn does, and its flavour is
+    landmask_flavour or else recognized from its filename
+    """
+    assert grid_name in binary_shapes.keys()
+    assert os.path.isfile(data_fn)
+    assert data_fn != ofn
+
+    landmask_fn = get_landmask_fn(grid_name, landmask_dir, landmask_fn)
+    if not os.path.isfile(landmask_fn):
+        raise SystemExit(f'No land mask file: {landmask_fn}  (set {landmask_dir_envvar} or use --landmask-dir)')  # noqa
+    flavour = get_landmask_flavour(landmask_fn, landmask_flavour)
+    luts = make_landmask_luts(flavour)
+    shape = binary_shapes[grid_name]
+    ydim, xdim = shape
+    block_rows = get_block_rows(xdim, max_block_bytes)
+
+    landmask = np.memmap(landmask_fn, dtype=np.uint8, mode='r', shape=shape)
+    data = np.memmap(data_fn, dtype=np.uint8, mode='r', shape=shape)
+
+    # Check all the data before any of it is written, so that a clash
+    # leaves the input untouched, even in place
+    counts = np.zeros(256, dtype=np.int64)
+    for row0 in range(0, ydim, block_rows):
+        counts += np.bincount(
+            data[row0:row0 + block_rows].ravel(), minlength=256)
+    check_reserved_values(counts)
+
+    if flavour in landmask_warnings:
+        print(f'WARNING: {landmask_warnings[flavour]}')
+
+    if ofn is None:
+        ofn = data_fn
+        out = np.memmap(data_fn, dtype=np.uint8, mode='r+', shape=shape)
+    else:
+        out = np.memmap(ofn, dtype=np.uint8, mode='w+', shape=shape)
+
+    for row0 in range(0, ydim, block_rows):
+        row1 = min(row0 + block_rows, ydim)
+        out[row0:row1] = encode_landmask(
+            data[row0:row1], landmask[row0:row1], luts)
+
+    out.flush()
+    del out
+    print(f'Wrote landmasked data to: {ofn}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    max_block_bytes = default_max_block_bytes
+    if '--max-block-mb' in args:
+        idx = args.index('--max-block-mb')
+        max_block_bytes = int(float(args[idx + 1]) * 1024 * 1024)
+        del args[idx:idx + 2]
+
+    landmask_dir = None
+    if '--landmask-dir' in args:
+        idx = args.index('--landmask-dir')
+        landmask_dir = args[idx + 1]
+        del args[idx:idx + 2]
+
+    landmask_fn = None
+    if '--landmask-fn' in args:
+        idx = args.index('--landmask-fn')
+        landmask_fn = args[idx + 1]
+        del args[idx:idx + 2]
+
+    landmask_flavour = None
+    if '--landmask-flavour' in args:
+        idx = args.index('--landmask-flavour')
+        landmask_flavour = args[idx + 1]
+        del args[idx:idx + 2]
+
+    inplace = '--inplace' in args
+    if inplace:
+        args.remove('--inplace')
+
+    try:
+        grid_name = args[0]
+        data_fn = args[1]
+        ofn = None if inplace else args[2]
+    except IndexError:
+        xwm(__doc__)
+
+    add_landmask(grid_name, data_fn, ofn, max_block_bytes=max_block_bytes,
+                 landmask_dir=landmask_dir, landmask_fn=landmask_fn,
+                 landmask_flavour=landmask_flavour)
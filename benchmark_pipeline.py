@@ -0,0 +1,395 @@
+"""
+benchmark_pipeline.py
+
+Time every stage of the region mask pipeline on every grid, offline
+
+The stages are run on synthetic fixtures written to a scratch directory,
+so neither the real vertex files, the land masks, gdal nor a network
+connection are needed:
+
+    vertices   a .csv file of lat/lon box regions for each region set
+               (18 in the north, 5 in each southern set)
+    landmask   a loilid-flavoured <grid_name>_loilid.dat for each grid,
+               with land, lake, land ice, ice shelf and off-earth values
+
+Stages and their targets:
+    csv_to_txt     csv_to_inittxt.csv_to_txt                  (region set)
+    shapefile      gen_shapefile.gen_shapefile                (region set)
+    rasterize      rasterize_regions.rasterize_regions   (region set, grid)
+    stitch_quads   stitch_quads.stitch_quads             (region set, grid)
+                   on quadrant .nc files cut from the rasterized grid
+    landmask       add_landmask.add_landmask             (region set, grid)
+    netcdf         create_regions_nc                                (grid)
+
+Each stage is run in a forked child process, which measures:
+    wall_s        elapsed time (s)
+    peak_rss_mb   peak resident set size of the child (MB), which
+                  includes the interpreter and the modules already imported
+    output_bytes  total size of the stage's output files
+
+With --baseline, the results are compared with those of an earlier run
+(saved with --save-baseline) and the exit status is 1 if any stage is
+slower or larger than the tolerances allow, or if its output size changed.
+
+Usage:
+    python benchmark_pipeline.py [--gridids G [G ...]] [--scratch-dir DIR]
+                                 [--json FN] [--save-baseline FN]
+                                 [--baseline FN] [--time-tolerance F]
+                                 [--rss-tolerance F] [--min-seconds S]
+  eg
+    python benchmark_pipeline.py --save-baseline benchmark_baseline.json
+    python benchmark_pipeline.py --gridids psn25 pss25 --baseline benchmark_baseline.json  # noqa
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import tempfile
+import traceback
+import multiprocessing
+import numpy as np
+import pandas as pd
+from netCDF4 import Dataset
+
+from add_landmask import (
+    add_landmask, default_max_block_bytes, get_landmask_fn)
+from csv_to_inittxt import csv_to_txt
+from gen_shapefile import gen_shapefile
+from grid_defs import get_grid_def, get_xy, grid_names
+from rasterize_regions import rasterize_regions
+from stitch_quads import determine_num_regions, get_grid_info, stitch_quads
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'seaice_region_netcdfs'))
+from cell_area import get_cell_area  # noqa: E402
+from create_seaice_region_netcdfs import create_regions_nc  # noqa: E402
+
+region_sets = ('nh', 'sh_orig', 'sh_RH')
+product_version = 'v1.0'
+
+# Synthetic regions are boxes of (lat bands) x (lon sector edges)
+synthetic_region_boxes = {
+    'nh': ((50., 62., 74., 86.), (-180., -120., -60., 0., 60., 120., 180.)),
+    'sh_orig': ((-78., -55.), (-180., -108., -36., 36., 108., 180.)),
+    'sh_RH': ((-78., -55.), (-180., -100., -20., 40., 110., 180.)),
+}
+vertex_step_deg = 5.
+
+landmask_block_rows = 512
+landmask_ocean_value = 50
+
+default_time_tolerance = 0.25
+default_rss_tolerance = 0.25
+default_min_seconds = 0.05
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def synthetic_vertices(suffix):
+    """Return the .csv DataFrame of the synthetic regions of a region set"""
+    lat_edges, lon_edges = synthetic_region_boxes[suffix]
+    rows = []
+    region_no = 0
+    for lat0, lat1 in zip(lat_edges[:-1], lat_edges[1:]):
+        for lon0, lon1 in zip(lon_edges[:-1], lon_edges[1:]):
+            region_no += 1
+            n_steps = max(int(np.ceil((lon1 - lon0) / vertex_step_deg)), 1)
+            lons = np.linspace(lon0, lon1, n_steps + 1)
+            # Anticlockwise: along the lower edge, then back along the upper
+            ring = [(lat0, lon) for lon in lons] + \
+                [(lat1, lon) for lon in lons[::-1]]
+            for vertex_no, (lat, lon) in enumerate(ring, start=1):
+                rows.append((f'Region {suffix} {region_no}', lat, lon,
+                             region_no, vertex_no))
+
+    return pd.DataFrame(
+        rows, columns=['Region', 'Lat', 'Lon', 'RegionNo', 'VertexNo'])
+
+
+def synthetic_landmask(grid_name):
+    """Return a loilid-flavoured (ydim, xdim) land mask for grid_name
+
+    The pattern depends only on the projected x, y of each cell, so it is
+    the same from run to run and scales with the grid resolution
+    """
+    grid_def = get_grid_def(grid_name)
+    x, y = get_xy(grid_name)
+    landmask = np.full(
+        (grid_def['ydim'], grid_def['xdim']), landmask_ocean_value,
+        dtype=np.uint8)
+
+    for row0 in range(0, grid_def['ydim'], landmask_block_rows):
+        yy = y[row0:row0 + landmask_block_rows, np.newaxis]
+        rho = np.hypot(x[np.newaxis, :], yy)
+        wave = np.sin(x[np.newaxis, :] / 7e5) * np.sin(yy / 9e5)
+        block = landmask[row0:row0 + landmask_block_rows]
+        block[wave > 0.5] = 150  # land
+        block[wave > 0.95] = 175  # lake
+        if grid_def['hem'] == 'sh':
+            block[rho < 2.3e6] = 220  # ice shelf
+            block[rho < 2.0e6] = 200  # land ice
+        block[rho > 12.5e6] = 250  # off earth
+
+    return landmask
+
+
+def write_quads(dat_fn, grid_name, bfn):
+    """Write the four quadrant .nc files that stitch_quads reassembles"""
+    grid_def = get_grid_def(grid_name)
+    grid_info = get_grid_info(grid_name)
+    data = np.fromfile(dat_fn, dtype=np.uint8).reshape(
+        grid_def['ydim'], grid_def['xdim'])
+    xleft = grid_info['xleft']
+    yupper = grid_info['yupper']
+    quads = {
+        'UL': data[:yupper, :xleft],
+        'UR': data[:yupper, xleft:],
+        'LR': data[yupper:, xleft:],
+        'LL': data[yupper:, :xleft],
+    }
+    for quad, quad_data in quads.items():
+        with Dataset(f'{bfn}_{quad}.nc', 'w') as ds:
+            ds.createDimension('y', quad_data.shape[0])
+            ds.createDimension('x', quad_data.shape[1])
+            var = ds.createVariable('Band1', 'u1', ('y', 'x'))
+            # gdalwarp's quadrants are bottom-up
+            var[:] = np.flipud(quad_data)
+
+
+def make_fixtures(scratch_dir, gridids):
+    """Write the synthetic vertex, land mask and cell area files"""
+    fixture_dir = os.path.join(scratch_dir, 'fixtures')
+    landmask_dir = os.path.join(fixture_dir, 'landmasks')
+    os.makedirs(landmask_dir, exist_ok=True)
+
+    csv_fns = {}
+    for suffix in region_sets:
+        csv_fns[suffix] = os.path.join(
+            fixture_dir, f'seaice_regions_{suffix}.csv')
+        synthetic_vertices(suffix).to_csv(csv_fns[suffix], index=False)
+
+    for gridid in gridids:
+        synthetic_landmask(gridid).tofile(
+            get_landmask_fn(gridid, landmask_dir))
+        # Cached here so that the netcdf stage does not time their creation
+        get_cell_area(gridid, os.path.join(scratch_dir, 'cell_areas'))
+
+    return csv_fns, landmask_dir
+
+
+def _run_child(conn, func, args):
+    try:
+        func(*args)
+        conn.send((None, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))
+    except BaseException:
+        conn.send((traceback.format_exc(), None))
+    finally:
+        conn.close()
+
+
+def run_measured(func, *args):
+    """Return the wall time (s) and peak RSS (MB) of func(*args)
+
+    func is run in a forked child, whose peak RSS starts from the
+    parent's current RSS rather than the parent's peak
+    """
+    ctx = multiprocessing.get_context('fork')
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    proc = ctx.Process(target=_run_child, args=(child_conn, func, args))
+    start = time.perf_counter()
+    proc.start()
+    child_conn.close()
+    error, maxrss_kb = parent_conn.recv()
+    proc.join()
+    wall_s = time.perf_counter() - start
+    if error is not None:
+        xwm(f'Stage {func.__name__}{args} failed:\n{error}')
+
+    return wall_s, maxrss_kb / 1024.
+
+
+def measure(results, stage, target, func, args, output_fns):
+    wall_s, peak_rss_mb = run_measured(func, *args)
+    result = {
+        'stage': stage,
+        'target': target,
+        'wall_s': wall_s,
+        'peak_rss_mb': peak_rss_mb,
+        'output_bytes': sum(os.path.getsize(fn) for fn in output_fns),
+    }
+    print(f'  {stage:>12s} {target:>16s} {wall_s:8.3f} s {peak_rss_mb:8.1f} MB')  # noqa
+    results.append(result)
+
+    return result
+
+
+def quiet(func):
+    """Return func with its stdout discarded"""
+    def quiet_func(*args):
+        with open(os.devnull, 'w') as devnull:
+            sys.stdout = devnull
+            func(*args)
+    quiet_func.__name__ = func.__name__
+
+    return quiet_func
+
+
+def benchmark_pipeline(scratch_dir, gridids=grid_names):
+    """Run every stage on the synthetic fixtures; return the results"""
+    print('Writing fixtures')
+    csv_fns, landmask_dir = make_fixtures(scratch_dir, gridids)
+
+    results = []
+    for suffix in region_sets:
+        hem = 'sh' if 'sh' in suffix else 'nh'
+        set_gridids = [
+            gridid for gridid in gridids
+            if get_grid_def(gridid)['hem'] == hem]
+        if not set_gridids:
+            continue
+
+        txt_fn = os.path.join(scratch_dir, f'seaice_regions_{suffix}.txt')
+        shp_fn = os.path.join(scratch_dir, f'seaice_regions_{suffix}.shp')
+        measure(results, 'csv_to_txt', suffix, quiet(csv_to_txt),
+                (csv_fns[suffix], txt_fn), [txt_fn])
+        measure(results, 'shapefile', suffix, quiet(gen_shapefile),
+                (txt_fn, shp_fn, hem == 'nh', hem == 'sh'),
+                [f'{shp_fn[:-4]}.{ext}' for ext in ('shp', 'shx', 'dbf')])
+
+        for gridid in set_gridids:
+            target = f'{suffix}_{gridid}'
+            fields_dir = os.path.join(scratch_dir, f'{gridid[:3]}_fields')
+            os.makedirs(fields_dir, exist_ok=True)
+            dat_fn = os.path.join(
+                fields_dir, f'seaice_regions_{suffix}_{gridid}.dat')
+            withland_fn = f'{dat_fn[:-4]}_withland.dat'
+
+            measure(results, 'rasterize', target, quiet(rasterize_regions),
+                    (shp_fn, gridid, dat_fn), [dat_fn])
+
+            bfn = os.path.join(scratch_dir, f'quads_{target}')
+            write_quads(dat_fn, gridid, bfn)
+            measure(results, 'stitch_quads', target, quiet(stitch_quads),
+                    (bfn, get_grid_info(gridid),
+                     determine_num_regions(bfn, gridid)),
+                    [f'{bfn}.dat'])
+            if not np.array_equal(np.fromfile(f'{bfn}.dat', dtype=np.uint8),
+                                  np.fromfile(dat_fn, dtype=np.uint8)):
+                xwm(f'stitch_quads did not reassemble {target}')
+            for fn in [f'{bfn}_{quad}.nc' for quad in ('UL', 'UR', 'LR', 'LL')] + [f'{bfn}.dat']:  # noqa
+                os.remove(fn)
+
+            measure(results, 'landmask', target, quiet(add_landmask),
+                    (gridid, dat_fn, withland_fn, default_max_block_bytes,
+                     landmask_dir),
+                    [withland_fn])
+
+    for gridid in gridids:
+        nc_fn = os.path.join(scratch_dir, f'{gridid}.nc')
+        measure(results, 'netcdf', gridid, quiet(create_regions_nc),
+                (gridid, nc_fn, product_version,
+                 os.path.join(scratch_dir, f'{gridid[:3]}_fields'),
+                 os.path.join(scratch_dir, 'cell_areas')),
+                [nc_fn])
+
+    return results
+
+
+def compare_to_baseline(
+        results, baseline,
+        time_tolerance=default_time_tolerance,
+        rss_tolerance=default_rss_tolerance,
+        min_seconds=default_min_seconds):
+    """Return a list of messages, one per regression from the baseline
+
+    Times within min_seconds of the baseline are never regressions, so
+    that the fastest stages are not flagged for timer noise
+    """
+    baseline_results = {
+        (r['stage'], r['target']): r for r in baseline['results']}
+    regressions = []
+    for r in results:
+        key = (r['stage'], r['target'])
+        if key not in baseline_results:
+            continue
+        b = baseline_results[key]
+        label = f'{r["stage"]} {r["target"]}'
+        if r['wall_s'] > b['wall_s'] * (1 + time_tolerance) and \
+                r['wall_s'] - b['wall_s'] > min_seconds:
+            regressions.append(f'{label}: wall_s {b["wall_s"]:.3f} -> {r["wall_s"]:.3f}')  # noqa
+        if r['peak_rss_mb'] > b['peak_rss_mb'] * (1 + rss_tolerance):
+            regressions.append(f'{label}: peak_rss_mb {b["peak_rss_mb"]:.1f} -> {r["peak_rss_mb"]:.1f}')  # noqa
+        if r['output_bytes'] != b['output_bytes']:
+            regressions.append(f'{label}: output_bytes {b["output_bytes"]} -> {r["output_bytes"]}')  # noqa
+
+    return regressions
+
+
+def print_results(results):
+    print(f'{"stage":>12s} {"target":>16s} {"wall_s":>9s} {"peak_rss_mb":>12s} {"output_bytes":>13s}')  # noqa
+    for r in results:
+        print(f'{r["stage"]:>12s} {r["target"]:>16s} {r["wall_s"]:9.3f} {r["peak_rss_mb"]:12.1f} {r["output_bytes"]:13d}')  # noqa
+
+
+def write_results(results, ofn):
+    with open(ofn, 'w') as f:
+        json.dump({'platform': sys.platform,
+                   'python': sys.version.split()[0],
+                   'numpy': np.__version__,
+                   'results': results}, f, indent=1)
+    print(f'Wrote: {ofn}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the region mask pipeline on synthetic inputs')
+    parser.add_argument(
+        '--gridids', nargs='+', default=grid_names, choices=grid_names)
+    parser.add_argument(
+        '--scratch-dir', default=None,
+        help='keep the fixtures and outputs here (default: a temporary dir)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument(
+        '--save-baseline', help='write the results as a baseline file')
+    parser.add_argument(
+        '--baseline', help='compare the results with this baseline file')
+    parser.add_argument(
+        '--time-tolerance', type=float, default=default_time_tolerance,
+        help='allowed fractional increase in wall time (default: %(default)s)')  # noqa
+    parser.add_argument(
+        '--rss-tolerance', type=float, default=default_rss_tolerance,
+        help='allowed fractional increase in peak RSS (default: %(default)s)')  # noqa
+    parser.add_argument(
+        '--min-seconds', type=float, default=default_min_seconds,
+        help='ignore wall time increases smaller than this (default: %(default)s)')  # noqa
+    args = parser.parse_args()
+
+    if args.scratch_dir is not None:
+        os.makedirs(args.scratch_dir, exist_ok=True)
+        results = benchmark_pipeline(args.scratch_dir, args.gridids)
+    else:
+        with tempfile.TemporaryDirectory() as scratch_dir:
+            results = benchmark_pipeline(scratch_dir, args.gridids)
+
+    print_results(results)
+    for ofn in (args.json, args.save_baseline):
+        if ofn:
+            write_results(results, ofn)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline(
+            results, baseline, args.time_tolerance, args.rss_tolerance,
+            args.min_seconds)
+        if regressions:
+            print(f'{len(regressions)} regressions from {args.baseline}:')
+            for message in regressions:
+                print(f'  {message}')
+            sys.exit(1)
+        print(f'No regressions from {args.baseline}')
@@ -0,0 +1,196 @@
+"""
+build_cache.py
+
+Content-hash build cache for the stages of the region mask pipeline
+
+Each stage is keyed on the sha256 of the bytes of its input files (eg the
+vertex file, the shapefile, the land mask), its parameters (eg latlon_res,
+attrname, the grid definition) and the source code that implements it.
+After a stage runs, its outputs are copied into the artifact directory,
+named by their own sha256, and a stamp recording the outputs is written
+under the stage's key.  When the key of a stage is found:
+  - outputs whose size and mtime match the stamp are left untouched
+  - missing or modified outputs are restored from the artifact directory
+  - the stage itself is not run
+
+Outputs that a stage rebuilds with identical content are also left
+untouched (see replace_if_changed), so downstream rsync and mtime-based
+consumers see no change.
+
+Usage:
+    python build_cache.py <cache_dir>            # summarize the cache
+    python build_cache.py <cache_dir> --prune    # remove unused artifacts
+"""
+
+import os
+import sys
+import json
+import shutil
+import filecmp
+import hashlib
+import tempfile
+
+default_cache_dir = './.build_cache'
+hash_block_bytes = 1 << 20
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def hash_file(fn):
+    """Return the sha256 hex digest of the bytes of a file"""
+    h = hashlib.sha256()
+    with open(fn, 'rb') as f:
+        for block in iter(lambda: f.read(hash_block_bytes), b''):
+            h.update(block)
+
+    return h.hexdigest()
+
+
+def stage_key(stage, input_fns, params):
+    """Return the cache key of a stage from its inputs and parameters"""
+    h = hashlib.sha256()
+    h.update(stage.encode())
+    for fn in input_fns:
+        h.update(os.path.basename(fn).encode())
+        h.update(hash_file(fn).encode())
+    h.update(json.dumps(params, sort_keys=True, default=str).encode())
+
+    return h.hexdigest()
+
+
+def replace_if_changed(tmp_fn, ofn):
+    """Move tmp_fn to ofn, unless ofn already has the same bytes"""
+    if os.path.isfile(ofn) and filecmp.cmp(tmp_fn, ofn, shallow=False):
+        os.remove(tmp_fn)
+        return False
+    os.replace(tmp_fn, ofn)
+
+    return True
+
+
+def stamp_fn(cache_dir, key):
+    return os.path.join(cache_dir, 'stamps', f'{key}.json')
+
+
+def artifact_fn(cache_dir, digest):
+    return os.path.join(cache_dir, 'artifacts', digest[:2], digest)
+
+
+def output_is_current(ofn, record):
+    """True if ofn still has the size and mtime recorded in the stamp"""
+    try:
+        st = os.stat(ofn)
+    except FileNotFoundError:
+        return False
+
+    return (st.st_size == record['size'] and
+            st.st_mtime_ns == record['mtime_ns'])
+
+
+def restore_outputs(cache_dir, stamp):
+    """Bring the outputs in line with a stamp; False if not possible"""
+    for ofn, record in stamp['outputs'].items():
+        if output_is_current(ofn, record):
+            continue
+        if os.path.isfile(ofn) and hash_file(ofn) == record['sha256']:
+            continue
+
+        cached_fn = artifact_fn(cache_dir, record['sha256'])
+        if not os.path.isfile(cached_fn):
+            return False
+        os.makedirs(os.path.dirname(os.path.abspath(ofn)), exist_ok=True)
+        fd, tmp_fn = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(ofn)),
+            prefix=f'.{os.path.basename(ofn)}.', suffix='.tmp')
+        os.close(fd)
+        shutil.copyfile(cached_fn, tmp_fn)
+        replace_if_changed(tmp_fn, ofn)
+        print(f'  Restored from cache: {ofn}')
+
+    return True
+
+
+def store_outputs(cache_dir, key, stage, output_fns):
+    """Copy the outputs into the artifact directory and write the stamp"""
+    outputs = {}
+    for ofn in output_fns:
+        digest = hash_file(ofn)
+        cached_fn = artifact_fn(cache_dir, digest)
+        if not os.path.isfile(cached_fn):
+            os.makedirs(os.path.dirname(cached_fn), exist_ok=True)
+            tmp_fn = f'{cached_fn}.{os.getpid()}.tmp'
+            shutil.copyfile(ofn, tmp_fn)
+            os.replace(tmp_fn, cached_fn)
+        st = os.stat(ofn)
+        outputs[ofn] = {
+            'sha256': digest,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+        }
+
+    fn = stamp_fn(cache_dir, key)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp_fn = f'{fn}.{os.getpid()}.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump({'stage': stage, 'outputs': outputs}, f, indent=1)
+    os.replace(tmp_fn, fn)
+
+
+def run_cached(
+        cache_dir, stage, func, args, output_fns, input_fns, params):
+    """Run func(*args) unless its outputs are cached under the same key"""
+    key = stage_key(stage, input_fns, params)
+    fn = stamp_fn(cache_dir, key)
+    if os.path.isfile(fn):
+        with open(fn) as f:
+            stamp = json.load(f)
+        if set(stamp['outputs']) == set(output_fns) and \
+                restore_outputs(cache_dir, stamp):
+            print(f'  Up to date: {stage}')
+            return False
+
+    func(*args)
+    store_outputs(cache_dir, key, stage, output_fns)
+
+    return True
+
+
+def prune_artifacts(cache_dir):
+    """Remove artifacts that no stamp refers to"""
+    in_use = set()
+    stamps_dir = os.path.join(cache_dir, 'stamps')
+    for fn in os.listdir(stamps_dir):
+        with open(os.path.join(stamps_dir, fn)) as f:
+            for record in json.load(f)['outputs'].values():
+                in_use.add(record['sha256'])
+
+    n_removed = 0
+    artifacts_dir = os.path.join(cache_dir, 'artifacts')
+    for subdir in os.listdir(artifacts_dir):
+        for digest in os.listdir(os.path.join(artifacts_dir, subdir)):
+            if digest not in in_use:
+                os.remove(os.path.join(artifacts_dir, subdir, digest))
+                n_removed += 1
+
+    return n_removed
+
+
+if __name__ == '__main__':
+    try:
+        cache_dir = sys.argv[1]
+    except IndexError:
+        xwm(__doc__)
+
+    if not os.path.isdir(os.path.join(cache_dir, 'stamps')):
+        xwm(f'No build cache in: {cache_dir}')
+
+    if '--prune' in sys.argv[2:]:
+        print(f'Removed {prune_artifacts(cache_dir)} unused artifacts')
+
+    n_stamps = len(os.listdir(os.path.join(cache_dir, 'stamps')))
+    n_bytes = 0
+    for root, _, fns in os.walk(os.path.join(cache_dir, 'artifacts')):
+        n_bytes += sum(os.path.getsize(os.path.join(root, fn)) for fn in fns)
+    print(f'{cache_dir}: {n_stamps} stage stamps, {n_bytes / 1e6:.1f} MB of artifacts')  # noqa
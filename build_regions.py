@@ -0,0 +1,619 @@
+"""
+build_regions.py
+
+Build the region masks for all region sets, projections and resolutions
+
+The pipeline for each region set is modelled as a dependency graph:
+
+    csv -> txt -> shp -> latlon raster -> grid .dat -> withland .dat
+                                                            -> netCDF
+
+Independent nodes -- eg the 16 grids of the three region sets -- are run
+on a process pool.  The latlon raster is converted once to a .npy file
+that each worker opens read-only with np.memmap, so it is shared through
+the page cache instead of being read and copied by every grid.  Every
+output is written to a temporary name and renamed into place, so an
+interrupted build never leaves a partially-written file behind.
+
+Each node is run through build_cache.run_cached, so nodes whose inputs,
+parameters and code are unchanged are skipped, and outputs that come out
+byte-identical are not rewritten.
+
+Usage:
+    python build_regions.py [--method warp|direct|quadtree] [--pyramid]
+                            [--workers N]
+                            [--fractions N] [--rle] [--cog]
+                            [--outdir DIR] [--landmask-dir DIR]
+                            [--landmask-fn GRID=FN ...]
+                            [--landmask-flavour NAME]
+                            [--cache-dir DIR] [--no-cache]
+                            [--no-nc] [--report FN] [--baseline FN]
+                            [<suffix> ...]
+  eg
+    python build_regions.py nh sh_orig sh_RH
+    python build_regions.py --method direct --workers 8 nh
+
+  suffix is a region set, one of: nh, sh_orig, sh_RH (default: all three)
+  With --pyramid, only the 3.125km grids are rasterized; the coarser grids
+  are derived from them by majority downsampling (downsample_regions.py)
+  Outputs are written as:
+    <outdir>/seaice_regions_<suffix>.{txt,shp,...}
+    <outdir>/<projid>_fields/seaice_regions_<suffix>_<grid_name>.dat
+    <outdir>/<projid>_fields/seaice_regions_<suffix>_<grid_name>_withland.dat
+    <outdir>/<projid>_fields/seaice_regions_<suffix>_<grid_name>_fractions.npz
+      (with --fractions)
+    <outdir>/<projid>_fields/seaice_regions_<suffix>_<grid_name>.rle.npz
+      and _withland.rle.npz (with --rle)
+    <outdir>/NSIDC-0780_SeaIceRegions_<proj>-<H><res>km_v1.0.nc
+    <outdir>/cogs/NSIDC-0780_SeaIceRegions_<proj>-<H><res>km_v1.0_<varname>.tif
+      (with --cog)
+  The build cache defaults to <outdir>/.build_cache
+  --landmask-fn replaces the land mask of one grid (eg
+  psn25=./amsru_landmask_n25km.dat), and may be given for several grids;
+  --landmask-flavour names how their values are re-encoded, if their
+  filenames do not (see add_landmask.py)
+  With --baseline, the .dat files are checked against a baseline file of
+  region_baseline.py after the build, and the changed tiles are reported
+"""
+
+import os
+import sys
+import ast
+import shutil
+import argparse
+import subprocess
+import tempfile
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+
+from grid_defs import get_grid_def, grid_names, grid_resolutions
+from build_cache import run_cached, replace_if_changed
+from region_polygons import get_index_fn
+from stage_timer import timed_stage
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(this_dir, 'seaice_region_netcdfs'))
+
+region_sets = ('nh', 'sh_orig', 'sh_RH')
+
+# Region sets written together into each hemisphere's netCDF files
+nc_region_sets = {
+    'nh': ('nh', ),
+    'sh': ('sh_orig', 'sh_RH'),
+}
+
+latlon_res = 0.01  # latlon resolution, in degrees
+attrname = 'Sea_ID'  # name of the attribute to 'rasterize' from the shapefile
+product_version = 'v1.0'
+
+shp_exts = ('shp', 'shx', 'dbf', 'prj', 'cpg')
+
+finest_gridres = min(grid_resolutions, key=grid_resolutions.get)
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+@contextmanager
+def atomic_output(ofn):
+    """Yield a temporary filename that is renamed to ofn on success
+
+    If ofn already exists with the same content, it is left untouched
+    """
+    odir = os.path.dirname(os.path.abspath(ofn))
+    os.makedirs(odir, exist_ok=True)
+    fd, tmp_fn = tempfile.mkstemp(
+        dir=odir, prefix=f'.{os.path.basename(ofn)}.', suffix='.tmp')
+    os.close(fd)
+    try:
+        yield tmp_fn
+        replace_if_changed(tmp_fn, ofn)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+
+
+def get_projids(suffix):
+    """Return the projids of the grids for this region set"""
+    if 'nh' in suffix:
+        return ('psn', 'e2n')
+    elif 'sh' in suffix:
+        return ('pss', 'e2s')
+    xwm(f'Could not determine hemisphere of region set: {suffix}')
+
+
+def find_source(srcdir, suffix):
+    """Return the name of the .csv (or, if absent, .txt) vertex file"""
+    for subdir in ('', 'intermed'):
+        for ext in ('csv', 'txt'):
+            fn = os.path.join(srcdir, subdir, f'seaice_regions_{suffix}.{ext}')
+            if os.path.isfile(fn):
+                return fn
+    xwm(f'No vertex file (.csv or .txt) found for region set: {suffix}')
+
+
+@timed_stage('csv_to_txt', output_fns='txt_fn')
+def stage_csv_to_txt(csv_fn, txt_fn):
+    from csv_to_inittxt import csv_to_txt
+
+    with atomic_output(txt_fn) as tmp_fn:
+        csv_to_txt(csv_fn, tmp_fn)
+
+
+def stage_txt_to_shp(txt_fn, shp_fn, suffix):
+    from gen_shapefile import gen_shapefile
+
+    # A shapefile is several files; write them all, then move each into place
+    shp_basename = os.path.splitext(os.path.basename(shp_fn))[0]
+    shp_dir = os.path.dirname(os.path.abspath(shp_fn))
+    os.makedirs(shp_dir, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=shp_dir) as tmp_dir:
+        gen_shapefile(
+            txt_fn, os.path.join(tmp_dir, f'{shp_basename}.shp'),
+            'nh' in suffix, 'sh' in suffix)
+        for fn in sorted(os.listdir(tmp_dir)):
+            replace_if_changed(
+                os.path.join(tmp_dir, fn), os.path.join(shp_dir, fn))
+
+
+@timed_stage('gdal_rasterize', output_fns='latlon_fn')
+def stage_shp_to_latlon(shp_fn, latlon_fn, projid):
+    from warp_latlon import read_latlon_raster
+
+    grid_def = get_grid_def(f'{projid}25')
+    layername = os.path.splitext(os.path.basename(shp_fn))[0]
+    with tempfile.TemporaryDirectory(
+            dir=os.path.dirname(os.path.abspath(latlon_fn))) as tmp_dir:
+        nc_latlon_fn = os.path.join(tmp_dir, f'{layername}.nc')
+        subprocess.run([
+            'gdal_rasterize', '-of', 'netCDF',
+            '-tr', f'{latlon_res}', f'{latlon_res}',
+            '-te', '-180', f'{grid_def["lat_min"]}',
+            '180', f'{grid_def["lat_max"]}',
+            '-ot', 'Byte', '-a', attrname, '-l', layername,
+            shp_fn, nc_latlon_fn], check=True)
+        latlon_data, lats, lons = read_latlon_raster(nc_latlon_fn)
+
+    # The raster is saved as .npy so that workers can memory-map it
+    with atomic_output(latlon_fn) as tmp_fn:
+        with open(tmp_fn, 'wb') as f:
+            np.save(f, latlon_data)
+    with atomic_output(latlon_coords_fn(latlon_fn)) as tmp_fn:
+        with open(tmp_fn, 'wb') as f:
+            np.savez(f, lats=lats, lons=lons)
+
+
+def latlon_coords_fn(latlon_fn):
+    return latlon_fn.replace('.npy', '_coords.npz')
+
+
+@timed_stage('warp_latlon', grid_id='grid_name', output_fns='dat_fn')
+def stage_latlon_to_grid(latlon_fn, grid_name, dat_fn):
+    from warp_latlon import warp_latlon_to_grid
+    from stitch_quads import determine_num_regions
+
+    grid_def = get_grid_def(grid_name)
+    latlon_data = np.load(latlon_fn, mmap_mode='r')
+    coords = np.load(latlon_coords_fn(latlon_fn))
+    data = warp_latlon_to_grid(
+        latlon_data, coords['lats'], coords['lons'], grid_def,
+        n_regions=determine_num_regions(dat_fn, grid_name))
+
+    with atomic_output(dat_fn) as tmp_fn:
+        data.tofile(tmp_fn)
+
+
+@timed_stage('rasterize_regions', grid_id='grid_name', output_fns='dat_fn')
+def stage_shp_to_grid(shp_fn, grid_name, dat_fn, quadtree=False):
+    from rasterize_regions import rasterize_regions
+
+    with atomic_output(dat_fn) as tmp_fn:
+        rasterize_regions(
+            shp_fn, grid_name, tmp_fn, attrname=attrname, quadtree=quadtree)
+
+
+@timed_stage('region_fractions', grid_id='grid_name',
+             output_fns='fractions_fn')
+def stage_fractions(shp_fn, grid_name, fractions_fn, supersample):
+    from region_fractions import rasterize_fractions
+
+    with atomic_output(fractions_fn) as tmp_fn:
+        rasterize_fractions(
+            shp_fn, grid_name, tmp_fn, supersample, attrname=attrname)
+
+
+@timed_stage('region_rle', grid_id='grid_name', output_fns='rle_fn')
+def stage_rle(grid_name, dat_fn, rle_fn):
+    from region_rle import encode_dat
+
+    with atomic_output(rle_fn) as tmp_fn:
+        encode_dat(grid_name, dat_fn, tmp_fn)
+
+
+@timed_stage('downsample_regions', grid_id='grid_name', output_fns='dat_fn')
+def stage_downsample(fine_dat_fn, fine_grid_name, grid_name, dat_fn):
+    from downsample_regions import downsample_dat
+
+    with atomic_output(dat_fn) as tmp_fn:
+        downsample_dat(fine_dat_fn, fine_grid_name, grid_name, tmp_fn)
+
+
+def stage_withland(grid_name, dat_fn, withland_fn, landmask_fn,
+                   landmask_flavour=None):
+    from add_landmask import add_landmask
+
+    with atomic_output(withland_fn) as tmp_fn:
+        add_landmask(grid_name, dat_fn, tmp_fn, landmask_fn=landmask_fn,
+                     landmask_flavour=landmask_flavour)
+
+
+def stage_netcdf(grid_name, dat_dir, nc_fn, cog_dir=None):
+    from create_seaice_region_netcdfs import create_regions_nc
+
+    cell_area_dir = os.path.join(
+        os.path.dirname(os.path.abspath(nc_fn)), 'cell_areas')
+    if cog_dir is None:
+        with atomic_output(nc_fn) as tmp_fn:
+            create_regions_nc(
+                grid_name, tmp_fn, product_version, dat_dir=dat_dir,
+                cell_area_dir=cell_area_dir)
+        return
+
+    # The COGs are written with the netCDF file, from its Dataset
+    os.makedirs(cog_dir, exist_ok=True)
+    with atomic_output(nc_fn) as tmp_fn, \
+            tempfile.TemporaryDirectory(dir=cog_dir) as tmp_dir:
+        create_regions_nc(
+            grid_name, tmp_fn, product_version, dat_dir=dat_dir,
+            cell_area_dir=cell_area_dir, cog_dir=tmp_dir)
+        for fn in sorted(os.listdir(tmp_dir)):
+            replace_if_changed(
+                os.path.join(tmp_dir, fn), os.path.join(cog_dir, fn))
+
+
+def code_fn(module_name):
+    """Return the source file of a pipeline module; None if not in the repo"""
+    for subdir in ('', 'seaice_region_netcdfs'):
+        fn = os.path.join(this_dir, subdir, f'{module_name}.py')
+        if os.path.isfile(fn):
+            return fn
+
+    return None
+
+
+def imported_modules(fn):
+    """Return the top-level names of the modules imported in a source file"""
+    with open(fn) as f:
+        tree = ast.parse(f.read(), fn)
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name.split('.')[0] for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and \
+                node.level == 0:
+            names.add(node.module.split('.')[0])
+
+    return names
+
+
+def code_fns(*module_names):
+    """Return the source files of pipeline modules, to hash with their inputs
+
+    The repo modules they import -- also inside functions -- are included,
+    recursively, so that a change to any of them invalidates the node
+    """
+    fns = set()
+    pending = list(module_names)
+    seen = set()
+    while pending:
+        module_name = pending.pop()
+        if module_name in seen:
+            continue
+        seen.add(module_name)
+
+        fn = code_fn(module_name)
+        if fn is None:
+            if module_name in module_names:
+                xwm(f'No source file for module: {module_name}')
+            continue
+        fns.add(fn)
+        pending.extend(imported_modules(fn))
+
+    return sorted(fns)
+
+
+def build_dag(
+        suffixes, outdir, srcdir='.', method='warp', with_nc=True,
+        cache_dir=None, pyramid=False, landmask_dir=None, fractions=0,
+        rle=False, cog=False, landmask_fns=None, landmask_flavour=None):
+    """Return the dependency graph as {node: (func, args, deps)}
+
+    landmask_fns are land mask files by grid_name, in place of those of
+    add_landmask.get_landmask_fn, and landmask_flavour is their flavour
+    if their names do not say it
+    """
+    from add_landmask import get_landmask_fn
+
+    nodes = {}
+
+    def add_node(name, func, args, deps, output_fns, input_fns, params):
+        if cache_dir is None:
+            nodes[name] = (func, args, deps)
+        else:
+            nodes[name] = (
+                run_cached,
+                (cache_dir, name, func, args, output_fns, input_fns, params),
+                deps)
+
+    grid_outputs = {}
+    for suffix in suffixes:
+        layername = f'seaice_regions_{suffix}'
+        src_fn = find_source(srcdir, suffix)
+        txt_fn = os.path.join(outdir, f'{layername}.txt')
+        shp_fn = os.path.join(outdir, f'{layername}.shp')
+        shp_fns = [
+            os.path.join(outdir, f'{layername}.{ext}') for ext in shp_exts]
+        shp_fns.append(get_index_fn(shp_fn))
+
+        if src_fn.endswith('.csv'):
+            add_node(
+                txt_fn, stage_csv_to_txt, (src_fn, txt_fn), (),
+                [txt_fn], [src_fn] + code_fns('csv_to_inittxt'), {})
+            shp_deps = (txt_fn, )
+        else:
+            txt_fn = src_fn
+            shp_deps = ()
+        add_node(
+            shp_fn, stage_txt_to_shp, (txt_fn, shp_fn, suffix), shp_deps,
+            shp_fns, [txt_fn] + code_fns('gen_shapefile'), {'suffix': suffix})
+
+        projids = get_projids(suffix)
+        if method == 'warp':
+            latlon_fn = os.path.join(outdir, f'{layername}_latlon.npy')
+            latlon_def = get_grid_def(f'{projids[0]}25')
+            add_node(
+                latlon_fn, stage_shp_to_latlon,
+                (shp_fn, latlon_fn, projids[0]), (shp_fn, ),
+                [latlon_fn, latlon_coords_fn(latlon_fn)],
+                shp_fns[:4] + code_fns('warp_latlon'),
+                {
+                    'latlon_res': latlon_res,
+                    'attrname': attrname,
+                    'lat_min': latlon_def['lat_min'],
+                    'lat_max': latlon_def['lat_max'],
+                })
+
+        for projid in projids:
+            dat_dir = os.path.join(outdir, f'{projid}_fields')
+            fine_grid_name = f'{projid}{finest_gridres}'
+            fine_dat_fn = os.path.join(
+                dat_dir, f'{layername}_{fine_grid_name}.dat')
+            for gridres in grid_resolutions.keys():
+                grid_name = f'{projid}{gridres}'
+                grid_def = get_grid_def(grid_name)
+                dat_fn = os.path.join(dat_dir, f'{layername}_{grid_name}.dat')
+                withland_fn = dat_fn.replace('.dat', '_withland.dat')
+
+                if pyramid and grid_name != fine_grid_name:
+                    add_node(
+                        dat_fn, stage_downsample,
+                        (fine_dat_fn, fine_grid_name, grid_name, dat_fn),
+                        (fine_dat_fn, ),
+                        [dat_fn],
+                        [fine_dat_fn] + code_fns('downsample_regions'),
+                        {'grid_def': grid_def})
+                elif method == 'warp':
+                    add_node(
+                        dat_fn, stage_latlon_to_grid,
+                        (latlon_fn, grid_name, dat_fn), (latlon_fn, ),
+                        [dat_fn],
+                        [latlon_fn, latlon_coords_fn(latlon_fn)] +
+                        code_fns('warp_latlon', 'stitch_quads'),
+                        {'grid_def': grid_def})
+                elif method in ('direct', 'quadtree'):
+                    # Both give the same grid, so share the cache params
+                    add_node(
+                        dat_fn, stage_shp_to_grid,
+                        (shp_fn, grid_name, dat_fn, method == 'quadtree'),
+                        (shp_fn, ),
+                        [dat_fn],
+                        shp_fns[:4] + code_fns('rasterize_regions'),
+                        {'grid_def': grid_def, 'attrname': attrname})
+                else:
+                    xwm(f'method not recognized: {method}')
+
+                # landmask_flavour is only of the landmask_fns files
+                grid_flavour = None
+                if grid_name in (landmask_fns or {}):
+                    grid_flavour = landmask_flavour
+                landmask_fn = get_landmask_fn(
+                    grid_name, landmask_dir,
+                    (landmask_fns or {}).get(grid_name))
+                add_node(
+                    withland_fn, stage_withland,
+                    (grid_name, dat_fn, withland_fn, landmask_fn,
+                     grid_flavour), (dat_fn, ),
+                    [withland_fn],
+                    [dat_fn, landmask_fn] + code_fns('add_landmask'),
+                    {'grid_name': grid_name, 'landmask_flavour': grid_flavour})
+                grid_outputs.setdefault(grid_name, []).extend(
+                    (dat_fn, withland_fn))
+
+                if rle:
+                    for fn in (dat_fn, withland_fn):
+                        rle_fn = fn.replace('.dat', '.rle.npz')
+                        add_node(
+                            rle_fn, stage_rle, (grid_name, fn, rle_fn), (fn, ),
+                            [rle_fn], [fn] + code_fns('region_rle'),
+                            {'grid_name': grid_name})
+
+                if fractions:
+                    fractions_fn = dat_fn.replace('.dat', '_fractions.npz')
+                    add_node(
+                        fractions_fn, stage_fractions,
+                        (shp_fn, grid_name, fractions_fn, fractions),
+                        (shp_fn, ),
+                        [fractions_fn],
+                        shp_fns[:4] + code_fns('region_fractions'),
+                        {'grid_def': grid_def, 'attrname': attrname,
+                         'supersample': fractions})
+
+    if with_nc:
+        from create_seaice_region_netcdfs import get_nc_fn
+        from create_seaice_region_cogs import get_cog_fns
+
+        cog_dir = os.path.join(outdir, 'cogs') if cog else None
+
+        for grid_name, deps in grid_outputs.items():
+            hem = get_grid_def(grid_name)['hem']
+            if not all(suffix in suffixes for suffix in nc_region_sets[hem]):
+                print(f'Skipping netCDF for {grid_name}: needs region sets {nc_region_sets[hem]}')  # noqa
+                continue
+            nc_basename = os.path.basename(
+                get_nc_fn(grid_name, product_version))
+            nc_fn = os.path.join(outdir, nc_basename)
+            dat_dir = os.path.join(outdir, f'{grid_name[:3]}_fields')
+            nc_output_fns = [nc_fn]
+            nc_code_fns = code_fns('create_seaice_region_netcdfs')
+            if cog:
+                nc_output_fns += get_cog_fns(
+                    grid_name, cog_dir, product_version)
+                nc_code_fns = code_fns(
+                    'create_seaice_region_netcdfs',
+                    'create_seaice_region_cogs')
+            add_node(
+                nc_fn, stage_netcdf, (grid_name, dat_dir, nc_fn, cog_dir),
+                tuple(deps), nc_output_fns, list(deps) + nc_code_fns,
+                {'grid_name': grid_name, 'product_version': product_version})
+
+    return nodes
+
+
+def run_dag(nodes, max_workers=None):
+    """Run each node once all of its dependencies have completed"""
+    done = set()
+    running = {}
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while len(done) < len(nodes):
+            for name, (func, args, deps) in nodes.items():
+                if name in done or name in running.values():
+                    continue
+                if all(dep in done for dep in deps):
+                    running[executor.submit(func, *args)] = name
+
+            if not running:
+                xwm(f'Unsatisfiable dependencies for: {sorted(set(nodes) - done)}')  # noqa
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                try:
+                    future.result()
+                except BaseException as e:
+                    for other in running:
+                        other.cancel()
+                    xwm(f'Failed to build {name}: {e!r}')
+                done.add(name)
+                print(f'Built: {name}  ({len(done)}/{len(nodes)})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the sea ice region masks in parallel')
+    parser.add_argument(
+        'suffixes', nargs='*', default=list(region_sets),
+        help='region sets to build (default: all)')
+    parser.add_argument(
+        '--method', choices=('warp', 'direct', 'quadtree'), default='warp',
+        help='grid rasterization method (see gen_regionsmask.sh)')
+    parser.add_argument(
+        '--pyramid', action='store_true',
+        help='derive the coarser grids from the finest by majority '
+             'downsampling')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes (default: all cores)')
+    parser.add_argument('--outdir', default='.', help='output directory')
+    parser.add_argument(
+        '--srcdir', default='.', help='directory with the vertex files')
+    parser.add_argument(
+        '--fractions', type=int, default=0, metavar='N',
+        help='also write the region fractions of the boundary cells, from N x N points per cell (region_fractions.py)')  # noqa
+    parser.add_argument(
+        '--cog', action='store_true',
+        help='also write each netCDF region mask as a Cloud-Optimized GeoTIFF in <outdir>/cogs')  # noqa
+    parser.add_argument(
+        '--rle', action='store_true',
+        help='also write each .dat file run-length encoded (region_rle.py)')
+    parser.add_argument(
+        '--landmask-dir', default=None,
+        help='directory with the <grid_name>_loilid.dat land masks (default: see add_landmask.py)')  # noqa
+    parser.add_argument(
+        '--landmask-fn', action='append', default=[], metavar='GRID=FN',
+        help='land mask file of one grid, in place of its loilid mask; may be repeated')  # noqa
+    parser.add_argument(
+        '--landmask-flavour', default=None,
+        help='land mask flavour of the --landmask-fn files (default: from their names)')  # noqa
+    parser.add_argument(
+        '--cache-dir', default=None,
+        help='build cache directory (default: <outdir>/.build_cache)')
+    parser.add_argument(
+        '--no-cache', dest='use_cache', action='store_false',
+        help='rebuild every node, without reading or writing the cache')
+    parser.add_argument(
+        '--no-nc', dest='with_nc', action='store_false',
+        help='do not create the netCDF files')
+    parser.add_argument(
+        '--report', default=None,
+        help='append the time and memory of each stage to this JSON-lines run report (see stage_timer.py)')  # noqa
+    parser.add_argument(
+        '--baseline', default=None,
+        help='check the .dat files against this baseline file after the build (see region_baseline.py)')  # noqa
+    args = parser.parse_args()
+
+    for suffix in args.suffixes:
+        if suffix not in region_sets:
+            xwm(f'Unknown region set: {suffix}  (options: {region_sets})')
+
+    if args.method == 'warp' and shutil.which('gdal_rasterize') is None:
+        xwm('gdal_rasterize not found; try --method direct')
+
+    if args.report:
+        # Inherited by the worker processes
+        os.environ['SEAICE_REGIONS_REPORT'] = os.path.abspath(args.report)
+
+    landmask_fns = {}
+    for item in args.landmask_fn:
+        grid_name, sep, landmask_fn = item.partition('=')
+        if not sep or grid_name not in grid_names:
+            xwm(f'--landmask-fn must be GRID=FN, with GRID one of {grid_names}: {item}')  # noqa
+        landmask_fns[grid_name] = landmask_fn
+
+    cache_dir = None
+    if args.use_cache:
+        cache_dir = args.cache_dir or os.path.join(args.outdir, '.build_cache')
+
+    nodes = build_dag(
+        args.suffixes, args.outdir, srcdir=args.srcdir,
+        method=args.method, with_nc=args.with_nc, cache_dir=cache_dir,
+        pyramid=args.pyramid, landmask_dir=args.landmask_dir,
+        fractions=args.fractions, rle=args.rle, cog=args.cog,
+        landmask_fns=landmask_fns, landmask_flavour=args.landmask_flavour)
+    run_dag(nodes, max_workers=args.workers)
+
+    print(f'Finished {len(nodes)} build steps')
+
+    if args.baseline:
+        from region_baseline import check_baseline, default_dat_fns
+        from stage_timer import guess_region_set
+
+        dat_fns = [
+            fn for fn in default_dat_fns(args.outdir)
+            if guess_region_set(fn) in args.suffixes]
+        changed = check_baseline(
+            args.baseline, dat_fns, report_missing=True)
+        if changed:
+            xwm(f'Grids that differ: {" ".join(changed)}')
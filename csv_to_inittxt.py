@@ -15,20 +15,9 @@ def xwm(m='exiting in xwm()'):
     raise SystemExit(m)
 
 
-def csv_to_txt(ifn, ofn):
-    """Convert QGIS WKT-CSV output to text file"""
-    print(' ')
-    print(f'Input:  {ifn}')
-    print(f'Output: {ofn}')
-    print(' ')
-
-    # Print everything in the dataset
-    pd.set_option('display.max_rows', None)
-
-    df = pd.read_csv(ifn)
-    print(f'Input\n\n{df.head()}')
-
-    df2 = df[['Region', 'Lat', 'Lon', 'RegionNo', 'VertexNo']]
+def csv_to_vertices(df, verbose=True):
+    """Return the vertex table of the .txt file from the .csv DataFrame"""
+    df2 = df[['Region', 'Lat', 'Lon', 'RegionNo', 'VertexNo']].copy()
 
     # Print unique values of a column
     # print(f'{df2["RegionNo"].unique()}')
@@ -39,11 +28,13 @@ def csv_to_txt(ifn, ofn):
 
     # Remove spaces from region names
     df2['Region'] = df2['Region'].str.replace(' ', '_')
-    print(f'{df2.head()}')
-    print(f'Unique Regions: {df2["Region"].unique()}')
+    if verbose:
+        print(f'{df2.head()}')
+        print(f'Unique Regions: {df2["Region"].unique()}')
 
     # Rename columns
-    print(df2.columns)
+    if verbose:
+        print(df2.columns)
     df2.rename(columns={
         'Region': 'Name',
         'Lat': 'Latitude',
@@ -51,7 +42,26 @@ def csv_to_txt(ifn, ofn):
         'RegionNo': 'Sea_ID',
         'VertexNo': 'Vertex_Index',
     }, inplace=True)
-    print(df2.columns)
+    if verbose:
+        print(df2.columns)
+
+    return df2
+
+
+def csv_to_txt(ifn, ofn):
+    """Convert QGIS WKT-CSV output to text file"""
+    print(' ')
+    print(f'Input:  {ifn}')
+    print(f'Output: {ofn}')
+    print(' ')
+
+    # Print everything in the dataset
+    pd.set_option('display.max_rows', None)
+
+    df = pd.read_csv(ifn)
+    print(f'Input\n\n{df.head()}')
+
+    df2 = csv_to_vertices(df)
 
     df2.to_csv(
         ofn,
@@ -0,0 +1,282 @@
+"""
+distrib_package.py
+
+Build the NSIDC-0780 distribution tree, incrementally
+
+The files of the distribution are declared in distrib_sets: for each
+region set, the vertex .txt and .csv files are copied and renamed, the
+shapefile components are copied into a subdirectory and zipped, and the
+netCDF files of every grid (from seaice_region_netcdfs/gen_all_ncs.sh)
+are copied alongside.  A SHA-256 manifest of every file of the tree is
+written in the format of sha256sum, so that it can be checked with
+sha256sum -c.
+
+Each output is rebuilt only if the sha256 of one of its inputs has
+changed, or if the output itself is missing or modified since it was
+written.  The hashes, with the size and mtime they were computed at, are
+kept in a state file (default: ./.build_cache/distrib_state.json), so
+unchanged inputs are not re-read either.  Outputs that are not rebuilt,
+or that are rebuilt with the same bytes, are not touched, so mirrors see
+only the files that changed.  The zip files are compressed in parallel,
+on a process pool.
+
+Usage:
+    python distrib_package.py [--distrib-dir DIR] [--src-dir DIR]
+                              [--nc-dir DIR] [--state FN] [--workers N]
+                              [--no-nc]
+  eg
+    python distrib_package.py
+    python distrib_package.py --nc-dir ../build --workers 4
+
+  Inputs are read from src_dir (default: .) and nc_dir (default:
+  ./seaice_region_netcdfs); the tree is written to distrib_dir (default:
+  ./nsidc0780_files).  Missing netCDF files are skipped, with a message.
+"""
+
+import os
+import sys
+import json
+import shutil
+import zipfile
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from build_cache import hash_file, output_is_current, replace_if_changed
+from grid_defs import grid_names
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(this_dir, 'seaice_region_netcdfs'))
+
+product_id = 'NSIDC-0780'
+product_version = 'v1.0'
+
+# Distribution label and source layername of each region set
+distrib_sets = (
+    ('NH', 'seaice_regions_nh'),
+    ('SH-NASA', 'intermed/seaice_regions_sh_orig'),
+    ('SH-RH', 'intermed/seaice_regions_sh_RH'),
+)
+vertex_exts = ('txt', 'csv')
+shp_exts = ('cpg', 'dbf', 'prj', 'shp', 'shx')
+
+default_distrib_dir = './nsidc0780_files'
+default_nc_dir = './seaice_region_netcdfs'
+default_state_fn = './.build_cache/distrib_state.json'
+zip_complevel = 9
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_manifest_basename():
+    return f'{product_id}_SeaIceRegions_{product_version}_sha256.txt'
+
+
+def build_entries(src_dir='.', nc_dir=default_nc_dir, with_nc=True):
+    """Return the outputs of the tree, as (kind, relative ofn, members)
+
+    kind is 'copy' (members is [src_fn]) or 'zip' (members is a list of
+    (src_fn, arcname))
+    """
+    entries = []
+    for label, layername in distrib_sets:
+        basename = f'{product_id}_SeaIceRegions_{label}_{product_version}'
+        src_base = os.path.join(src_dir, layername)
+        for ext in vertex_exts:
+            entries.append(
+                ('copy', f'{basename}.{ext}', [f'{src_base}.{ext}']))
+
+        members = []
+        for ext in shp_exts:
+            arcname = f'{basename}.{ext}'
+            entries.append((
+                'copy', os.path.join(basename, arcname),
+                [f'{src_base}.{ext}']))
+            members.append((f'{src_base}.{ext}', arcname))
+        entries.append(('zip', f'{basename}.zip', members))
+
+    if with_nc:
+        from create_seaice_region_netcdfs import get_nc_fn
+
+        for grid_name in grid_names:
+            nc_basename = os.path.basename(
+                get_nc_fn(grid_name, product_version))
+            entries.append(
+                ('copy', nc_basename, [os.path.join(nc_dir, nc_basename)]))
+
+    return entries
+
+
+def read_state(state_fn):
+    try:
+        with open(state_fn) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'inputs': {}, 'outputs': {}}
+
+
+def write_state(state_fn, state):
+    os.makedirs(os.path.dirname(os.path.abspath(state_fn)), exist_ok=True)
+    tmp_fn = f'{state_fn}.{os.getpid()}.tmp'
+    with open(tmp_fn, 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(tmp_fn, state_fn)
+
+
+def input_hash(fn, input_records):
+    """Return the sha256 of fn, reusing the recorded one if fn is unchanged"""
+    key = os.path.abspath(fn)
+    record = input_records.get(key)
+    if record is None or not output_is_current(fn, record):
+        st = os.stat(fn)
+        record = {'sha256': hash_file(fn), 'size': st.st_size,
+                  'mtime_ns': st.st_mtime_ns}
+        input_records[key] = record
+
+    return record['sha256']
+
+
+def temp_fn_for(ofn):
+    fd, tmp_fn = tempfile.mkstemp(
+        dir=os.path.dirname(ofn), prefix=f'.{os.path.basename(ofn)}.',
+        suffix='.tmp')
+    os.close(fd)
+
+    return tmp_fn
+
+
+def copy_file(src_fn, ofn):
+    """Copy src_fn to ofn, with its mtime, as cp -a does"""
+    tmp_fn = temp_fn_for(ofn)
+    shutil.copy2(src_fn, tmp_fn)
+    os.replace(tmp_fn, ofn)
+
+
+def write_zip(ofn, members, complevel=zip_complevel):
+    """Write a zip file of (src_fn, arcname) members
+
+    Return its sha256, and whether the file was replaced
+    """
+    tmp_fn = temp_fn_for(ofn)
+    try:
+        with zipfile.ZipFile(tmp_fn, 'w', zipfile.ZIP_DEFLATED,
+                             compresslevel=complevel) as zf:
+            for src_fn, arcname in members:
+                zf.write(src_fn, arcname)
+        is_replaced = replace_if_changed(tmp_fn, ofn)
+    finally:
+        if os.path.exists(tmp_fn):
+            os.remove(tmp_fn)
+
+    return hash_file(ofn), is_replaced
+
+
+def output_record(ofn, input_hashes, sha256):
+    st = os.stat(ofn)
+
+    return {'inputs': input_hashes, 'sha256': sha256, 'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns}
+
+
+def package(distrib_dir=default_distrib_dir, src_dir='.',
+            nc_dir=default_nc_dir, with_nc=True, max_workers=None,
+            state_fn=default_state_fn):
+    """Bring the distribution tree up to date; return the rebuilt files"""
+    os.makedirs(distrib_dir, exist_ok=True)
+    state = read_state(state_fn)
+    old_outputs = state['outputs']
+    outputs = {}
+    rebuilt = []
+    zips = []
+
+    for kind, rel_fn, members in build_entries(src_dir, nc_dir, with_nc):
+        src_fns = members if kind == 'copy' else [src for src, _ in members]
+        missing = [fn for fn in src_fns if not os.path.isfile(fn)]
+        if missing:
+            if kind == 'copy' and rel_fn.endswith('.nc'):
+                print(f'Skipping {rel_fn}: no {missing[0]}')
+                continue
+            xwm(f'Missing input(s) of {rel_fn}: {missing}')
+
+        input_hashes = [input_hash(fn, state['inputs']) for fn in src_fns]
+        ofn = os.path.join(distrib_dir, rel_fn)
+        record = old_outputs.get(rel_fn)
+        if record is not None and record['inputs'] == input_hashes and \
+                output_is_current(ofn, record):
+            outputs[rel_fn] = record
+            continue
+
+        os.makedirs(os.path.dirname(ofn), exist_ok=True)
+        if kind == 'copy':
+            # A copy already in place is only recorded
+            if not os.path.isfile(ofn) or hash_file(ofn) != input_hashes[0]:
+                copy_file(src_fns[0], ofn)
+                rebuilt.append(rel_fn)
+            outputs[rel_fn] = output_record(ofn, input_hashes, input_hashes[0])
+        else:
+            zips.append((rel_fn, ofn, members, input_hashes))
+
+    if zips:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [executor.submit(write_zip, ofn, members)
+                       for _, ofn, members, _ in zips]
+            for (rel_fn, ofn, _, input_hashes), future in zip(zips, futures):
+                sha256, is_replaced = future.result()
+                outputs[rel_fn] = output_record(ofn, input_hashes, sha256)
+                if is_replaced:
+                    rebuilt.append(rel_fn)
+
+    for rel_fn in rebuilt:
+        print(f'Updated: {os.path.join(distrib_dir, rel_fn)}')
+
+    # The manifest is rewritten only when a line of it changes
+    manifest_fn = os.path.join(distrib_dir, get_manifest_basename())
+    lines = ''.join(
+        f'{outputs[rel_fn]["sha256"]}  {rel_fn}\n'
+        for rel_fn in sorted(outputs))
+    try:
+        with open(manifest_fn) as f:
+            is_current = f.read() == lines
+    except FileNotFoundError:
+        is_current = False
+    if not is_current:
+        tmp_fn = temp_fn_for(manifest_fn)
+        with open(tmp_fn, 'w') as f:
+            f.write(lines)
+        os.replace(tmp_fn, manifest_fn)
+        print(f'Wrote: {manifest_fn}')
+
+    state['outputs'] = outputs
+    write_state(state_fn, state)
+    print(f'{len(rebuilt)} of {len(outputs)} files updated in: {distrib_dir}')
+
+    return rebuilt
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Build the NSIDC-0780 distribution tree incrementally')
+    parser.add_argument(
+        '--distrib-dir', default=default_distrib_dir,
+        help='distribution directory (default: ./nsidc0780_files)')
+    parser.add_argument(
+        '--src-dir', default='.',
+        help='directory with the .txt, .csv and shapefiles')
+    parser.add_argument(
+        '--nc-dir', default=default_nc_dir,
+        help='directory with the netCDF files (default: ./seaice_region_netcdfs)')  # noqa
+    parser.add_argument(
+        '--state', default=default_state_fn,
+        help='file of the recorded hashes (default: ./.build_cache/distrib_state.json)')  # noqa
+    parser.add_argument(
+        '--no-nc', dest='with_nc', action='store_false',
+        help='do not add the netCDF files')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes for the zip files')
+    args = parser.parse_args()
+
+    package(args.distrib_dir, args.src_dir, args.nc_dir, args.with_nc,
+            args.workers, args.state)
@@ -0,0 +1,162 @@
+"""
+downsample_regions.py
+
+Derive coarser-resolution region grids from the finest grid
+
+The grids of a projection family share their extents, and each resolution
+is an exact integer multiple of the others (eg psn3.125 is psn25 x 8), so
+a coarse cell is exactly a block of fine cells.  Each coarse cell is given
+the most common (majority) value of its block of fine cells.  Ties are
+broken deterministically: values listed in 'precedence' win, in the order
+listed, over all other values, which are ordered from lowest to highest.
+
+Because every coarse grid is derived from the same fine grid, the
+resolutions are guaranteed to nest.
+
+Usage:
+    python downsample_regions.py [--withland] <fine_dat_fn> <coarse_grid_name> [...]  # noqa
+  eg
+    python downsample_regions.py seaice_regions_nh_psn3.125.dat psn6.25 psn12.5 psn25  # noqa
+
+  The fine grid_name is parsed from fine_dat_fn, and each output name is
+  fine_dat_fn with the fine grid_name replaced by the coarse one.
+  With --withland, the surface mask values take precedence in ties,
+  in the order given by add_landmask.land_precedence
+"""
+
+import os
+import sys
+import numpy as np
+
+from grid_defs import get_grid_def, grid_names
+
+# Memory budget of the count table of one block of coarse rows
+default_max_block_bytes = 64 * 2**20
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_factor(fine_grid_name, coarse_grid_name):
+    """Return the integer block size between two grids of one projection"""
+    fine = get_grid_def(fine_grid_name)
+    coarse = get_grid_def(coarse_grid_name)
+    if fine['projid'] != coarse['projid']:
+        xwm(f'Grids are not of the same projection: {fine_grid_name} {coarse_grid_name}')  # noqa
+    if coarse['res'] % fine['res'] != 0:
+        xwm(f'{coarse_grid_name} is not a multiple of {fine_grid_name}')
+
+    factor = coarse['res'] // fine['res']
+    assert fine['ydim'] == coarse['ydim'] * factor
+    assert fine['xdim'] == coarse['xdim'] * factor
+
+    return factor
+
+
+def value_order(values, precedence=()):
+    """Return values sorted from the highest to the lowest tie precedence"""
+    values = [int(v) for v in values]
+    first = [v for v in precedence if v in values]
+
+    return first + sorted(v for v in values if v not in first)
+
+
+def majority_downsample(data, factor, precedence=(),
+                        max_block_bytes=default_max_block_bytes):
+    """Return the block-majority downsampling of a 2D uint8 array
+
+    The coarse rows are counted a block at a time, so that the count
+    table stays within max_block_bytes
+    """
+    ydim, xdim = data.shape
+    if ydim % factor or xdim % factor:
+        xwm(f'Shape {data.shape} is not a multiple of {factor}')
+    coarse_ydim = ydim // factor
+    coarse_xdim = xdim // factor
+
+    # Columns of counts are the present values, in tie precedence order;
+    # bincount converts to intp, so the values are found a block at a time
+    value_counts = np.zeros(256, dtype=np.int64)
+    count_rows = max(1, max_block_bytes // (8 * xdim))
+    for row0 in range(0, ydim, count_rows):
+        value_counts += np.bincount(
+            data[row0:row0 + count_rows].ravel(), minlength=256)
+    present = np.flatnonzero(value_counts)
+    ordered = np.array(value_order(present, precedence), dtype=np.uint8)
+    column = np.zeros(256, dtype=np.intp)
+    column[ordered] = np.arange(len(ordered))
+
+    n_values = len(ordered)
+    # Per coarse cell: the uint16 counts, and the intp table offset, the
+    # two intp temporaries of a pass and the intp argmax
+    bytes_per_row = coarse_xdim * (2 * n_values + 32)
+    block_rows = max(1, min(coarse_ydim, max_block_bytes // bytes_per_row))
+    block_base = np.arange(
+        0, block_rows * coarse_xdim * n_values, n_values).reshape(
+            block_rows, coarse_xdim)
+
+    coarse_data = np.empty((coarse_ydim, coarse_xdim), dtype=np.uint8)
+    for row0 in range(0, coarse_ydim, block_rows):
+        row1 = min(row0 + block_rows, coarse_ydim)
+        block = data[row0 * factor:row1 * factor]
+        base = block_base[:row1 - row0]
+        counts = np.zeros(base.size * n_values, dtype=np.uint16)
+        # Each pass adds one fine cell to every block, so no index repeats
+        for i in range(factor):
+            for j in range(factor):
+                counts[base + column[block[i::factor, j::factor]]] += 1
+
+        # argmax returns the first maximum, ie the highest precedence value
+        best = counts.reshape(-1, n_values).argmax(axis=1)
+        coarse_data[row0:row1] = ordered[best].reshape(base.shape)
+
+    return coarse_data
+
+
+def downsample_dat(fine_dat_fn, fine_grid_name, coarse_grid_name, ofn,
+                   precedence=()):
+    """Write the majority downsampling of a .dat file onto a coarser grid"""
+    fine = get_grid_def(fine_grid_name)
+    factor = get_factor(fine_grid_name, coarse_grid_name)
+    data = np.fromfile(fine_dat_fn, dtype=np.uint8).reshape(
+        fine['ydim'], fine['xdim'])
+
+    coarse_data = majority_downsample(data, factor, precedence)
+    coarse_data.tofile(ofn)
+    print(f'  Wrote {coarse_grid_name} data to: {ofn}')
+
+    return ofn
+
+
+def parse_grid_name(fn):
+    """Return the grid_name within a filename, longest match first"""
+    basename = os.path.basename(fn)
+    for grid_name in sorted(grid_names, key=len, reverse=True):
+        if f'_{grid_name}' in basename:
+            return grid_name
+    xwm(f'Could not find a grid_name in: {fn}')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    precedence = ()
+    if '--withland' in args:
+        from add_landmask import land_precedence
+        args.remove('--withland')
+        precedence = land_precedence
+
+    try:
+        fine_dat_fn = args[0]
+        coarse_grid_names = args[1:]
+        assert len(coarse_grid_names) > 0
+    except (IndexError, AssertionError):
+        xwm(__doc__)
+
+    fine_grid_name = parse_grid_name(fine_dat_fn)
+    for coarse_grid_name in coarse_grid_names:
+        ofn = fine_dat_fn.replace(
+            f'_{fine_grid_name}', f'_{coarse_grid_name}')
+        assert ofn != fine_dat_fn
+        downsample_dat(
+            fine_dat_fn, fine_grid_name, coarse_grid_name, ofn, precedence)
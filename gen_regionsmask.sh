@@ -5,11 +5,16 @@ set -e
 # gen_arctic_regions_psn12.5.sh <grid_name>
 
 # Usage:
-#  ./gen_arctic_regions_psn12.5.sh <shp_latlon_fn> psn25
+#  ./gen_arctic_regions_psn12.5.sh <shp_latlon_fn> psn25 [<method>]
 # eg
 #  ./gen_arctic_regions_psn12.5.sh regions_20211003 psn25
 
 # shp_latlon_fn is the shapefile of the regions in latlon projection (epsg 4326)
+# method is one of:
+#   gdal    (default) rasterize to latlon, warp four quadrants and stitch them
+#   warp    rasterize to latlon, then warp the whole grid in one pass (warp_latlon.py)
+#   direct  rasterize the polygons directly onto the grid (rasterize_regions.py)
+#   quadtree  as direct, refining only the blocks that region edges cross
 
 # latlon_res=0.05       # latlon resolution, in degrees
 latlon_res=0.01       # latlon resolution, in degrees
@@ -33,6 +38,8 @@ echo "shpfname:  ${shp_latlon_fn}"
 # the 'layername' is the basename of the shapefile
 layername=${shp_latlon_fn/%.shp}
 echo "layername: ${layername}"
+# the region set is the suffix of the layername, e.g. "nh" or "sh_RH"
+region_set=${layername##*seaice_regions_}
 
 # Parse the grid_name
 grid_name="$2"
@@ -45,93 +52,86 @@ if [ -z "$grid_name" ]; then
   exit
 fi
 
-# Parse grid_name for projid and gridres
-projid=${grid_name:0:3}
-gridres=${grid_name#"$projid"}
-if [ "$projid" == "psn" ]; then
-  echo "projid: ${projid}"
-  hem=nh
-  epsgcode=3411
-  t_left=-3850000
-  t_right=3750000
-  t_top=5850000
-  t_bottom=-5350000
-  lat_min=30
-  lat_max=90
-elif [ "$projid" == "pss" ]; then
-  echo "projid: ${projid}"
-  hem=sh
-  epsgcode=3412
-  t_left=-3950000
-  t_right=3950000
-  t_top=4350000
-  t_bottom=-3950000
-  lat_min=-90
-  lat_max=-30
-elif [ "$projid" == "e2n" ]; then
-  echo "projid: ${projid}"
-  hem=nh
-  epsgcode=6931
-  t_left=-9000000
-  t_right=9000000
-  t_top=9000000
-  t_bottom=-9000000
-  lat_min=30
-  lat_max=90
-elif [ "$projid" == "e2s" ]; then
-  echo "projid: ${projid}"
-  hem=sh
-  epsgcode=6932
-  t_left=-9000000
-  t_right=9000000
-  t_top=9000000
-  t_bottom=-9000000
-  lat_min=-90
-  lat_max=-30
-else
-  echo "projid not recognized: ${projid}"
-  exit 1
-fi
-
+# Look up the grid geometry in the grid registry, grid_defs.py
+# This sets projid, gridres, grid_res, hem, epsgcode, t_left, t_right,
+# t_top, t_bottom, lat_min and lat_max
 # Note:
 #   gridres is a string, e.g. "25" or "3.125"
 #   grid_res is an integer, e.g.  25000 or 3125
-if [ "$gridres" == "25" ]; then
-  grid_res=25000
-elif [ "$gridres" == "12.5" ]; then
-  grid_res=12500
-elif [ "$gridres" == "6.25" ]; then
-  grid_res=6250
-elif [ "$gridres" == "3.125" ]; then
-  grid_res=3125
-else
-  echo "Grid_res not recognized: ${gridres}"
-  exit
+grid_vars="$(python grid_defs.py --shell ${grid_name})"
+eval "${grid_vars}"
+echo "projid: ${projid}"
+
+# With SEAICE_REGIONS_REPORT set, time a command as one stage of the run
+# report (see stage_timer.py); the Python steps record their own stages
+#   timed <stage> <output_fn> <command> [<arg> ...]
+timed() {
+  local stage=$1
+  local output_fn=$2
+  shift 2
+  if [ -n "${SEAICE_REGIONS_REPORT}" ]; then
+    python stage_timer.py run --stage ${stage} --grid-id ${grid_name} --region-set ${region_set} --output ${output_fn} -- "$@"
+  else
+    "$@"
+  fi
+}
+
+# Parse the rasterization method
+method="${3:-gdal}"
+if [ "$method" != "gdal" ] && [ "$method" != "warp" ] && [ "$method" != "direct" ] && [ "$method" != "quadtree" ]; then
+  echo "method not recognized: ${method}"
+  exit 1
 fi
 
 echo "Creating grid for:"
 echo "  grid_name: ${grid_name}"
 echo "  projid:    ${projid}"
 echo "  grid_res:  ${grid_res}"
+echo "  method:    ${method}"
+
+nc_reproj_basename=./${layername}_${grid_name}
+
+if [ "$method" == "direct" ] || [ "$method" == "quadtree" ]; then
+  # No latlon raster, quadrants or stitching needed
+  quadtree_flag=""
+  if [ "$method" == "quadtree" ]; then
+    quadtree_flag="--quadtree"
+  fi
+  echo "Calling rasterize_regions.py with: ${quadtree_flag} ${shp_latlon_fn} ${grid_name}"
+  timed rasterize_regions ${nc_reproj_basename}.dat python rasterize_regions.py ${quadtree_flag} ${shp_latlon_fn} ${grid_name} ${nc_reproj_basename}.dat
+else
 
 # We will create netCDF versions of the translated data
 #  Note: we could also create tif versions if we wanted to
 nc_latlon_fn=./${layername}.nc
 
+# The latlon raster is reused only if it was made from the same shapefile
+# contents and rasterization parameters; its key is stored alongside it
+latlon_key_fn=${nc_latlon_fn}.key
+latlon_key="$(cat ${layername}.shp ${layername}.shx ${layername}.dbf | sha256sum | cut -d' ' -f1) ${latlon_res} ${lat_min} ${lat_max} ${attrname}"
+
 # Rasterize the LatLon region map into 1/10th degree grid
-if [ ! -f ${nc_latlon_fn} ]; then
-  echo "Creating netCDF latlon version of translated data: ${nc_latlon_fn}"
-  gdal_rasterize -tr $latlon_res $latlon_res -te -180 ${lat_min} 180 ${lat_max} -ot Byte -a ${attrname} -l ${layername} ${shp_latlon_fn} ${nc_latlon_fn}
-else
+if [ -f ${nc_latlon_fn} ] && [ -f ${latlon_key_fn} ] && [ "$(cat ${latlon_key_fn})" == "${latlon_key}" ]; then
   echo "Using existing: ${nc_latlon_fn}"
+else
+  echo "Creating netCDF latlon version of translated data: ${nc_latlon_fn}"
+  # gdal_rasterize would burn into an existing file rather than replace it
+  rm -f ${nc_latlon_fn} ${latlon_key_fn}
+  timed gdal_rasterize ${nc_latlon_fn} gdal_rasterize -tr $latlon_res $latlon_res -te -180 ${lat_min} 180 ${lat_max} -ot Byte -a ${attrname} -l ${layername} ${shp_latlon_fn} ${nc_latlon_fn}
+  echo "${latlon_key}" > ${latlon_key_fn}
 fi
 
+if [ "$method" == "warp" ]; then
+  # Inverse-project every grid cell at once; no quadrants to stitch
+  echo "Calling warp_latlon.py with: ${nc_latlon_fn} ${grid_name}"
+  timed warp_latlon ${nc_reproj_basename}.dat python warp_latlon.py ${nc_latlon_fn} ${grid_name} ${nc_reproj_basename}.dat
+else
+
 # Now, create four quadrants of the North polar projection
 # Note: we can't do this initially because gdal can't handle polar projections
 
 # Arctic
 # Create four quadrants that can be patched together into one
-nc_reproj_basename=./${layername}_${grid_name}
 nc_reproj_UL=${nc_reproj_basename}_UL.nc
 nc_reproj_UR=${nc_reproj_basename}_UR.nc
 nc_reproj_LR=${nc_reproj_basename}_LR.nc
@@ -144,16 +144,16 @@ echo "UL fn: ${nc_reproj_UL}"
 #   -te -3850000 -5350000 3750000 5850000
 
 # UL extents are: left 0 0 top
-gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te $t_left 0 0 $t_top -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_UL}
+timed gdalwarp_UL ${nc_reproj_UL} gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te $t_left 0 0 $t_top -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_UL}
 
 # UR extents are: 0 0 right top
-gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te 0 0 $t_right $t_top -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_UR}
+timed gdalwarp_UR ${nc_reproj_UR} gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te 0 0 $t_right $t_top -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_UR}
 
 # LR extents are: 0 bottom right 0
-gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te 0 $t_bottom $t_right 0 -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_LR}
+timed gdalwarp_LR ${nc_reproj_LR} gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te 0 $t_bottom $t_right 0 -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_LR}
 
 # LL extents are: left bottom 0 0
-gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te $t_left $t_bottom 0 0 -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_LL}
+timed gdalwarp_LL ${nc_reproj_LL} gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te $t_left $t_bottom 0 0 -overwrite -dstnodata 0 -r near ${nc_latlon_fn} ${nc_reproj_LL}
 
 # Stitch together the four quadrants into one, using Python
 # Note: the python code assumes the quadrants are:
@@ -162,6 +162,8 @@ gdalwarp -of netcdf -t_srs EPSG:${epsgcode} -tr ${grid_res} ${grid_res} -te $t_l
 #   and extensions of UL UR LR LL
 echo "Calling stitch_quads.py with: ${nc_reproj_basename} ${grid_name}"
 python stitch_quads.py ${nc_reproj_basename} ${grid_name}
+fi
+fi
 
 # Remove temporary files after stitching them together
 # rm temp_[LU][LR].dat
@@ -7,54 +7,123 @@ Usage:
     python gen_shapefile.py regions_apr22.txt regions_apr22.shp
 
 You should be able to load the resulting shapefile(s) into QGIS
+
+The spatial index of the polygons is also written, as regions_apr22_index.npz
+(see region_polygons.py)
 """
 
+import numpy as np
 import pandas as pd
 import geopandas as gpd
-from shapely.geometry import Polygon
-from fiona.crs import from_epsg
+import shapely
+import os
 import sys
 
+from region_polygons import build_index, get_index_fn
+from stage_timer import timed_stage
+
+# Exclusion list: "overarching" sea_names
+excluded = (
+    'Pacific_Ocean,_western_part',
+    'Pacific_Ocean,_eastern_part',
+    'North_Pacific_Ocean,_western_part',
+    'North_Pacific_Ocean,_eastern_part',
+    'North_Atlantic_Ocean',
+    'Atlantic_Ocean',
+    'Arctic_Ocean,_western_part',
+    'Arctic_Ocean,_eastern_part',
+    'Indian_Ocean',
+    'Eastern_Basin',
+    'Mediterranean_Region',
+)
+
 
 def xwm(m='exiting in xwm()'):
     raise SystemExit(m)
 
 
-def get_coords(df_sea, nh_only=False, sh_only=False):
-    """Return a list of the coordinates for this sea"""
-    coords = []
+def sort_vertices(df_txt):
+    """Return the vertices grouped by sea, in Vertex_Index order
 
-    for rec in range(1, len(df_sea) + 1):
-        try:
-            lat = float(df_sea[df_sea['Vertex_Index'] == rec]['Latitude'])
-            lon = float(df_sea[df_sea['Vertex_Index'] == rec]['Longitude'])
-        except TypeError:
-            print('Error converting Latitude or Longitude')
-            this_sea = df_sea[df_sea['Vertex_Index'] == rec]
-            print(f'{this_sea}')
-            xwm()
+    Seas keep the order in which they first appear in the file, which is
+    the order in which their polygons are later rasterized.  The vertices
+    of each sea must be numbered 1..n.
+    """
+    df = df_txt[['Name', 'Latitude', 'Longitude', 'Sea_ID', 'Vertex_Index']]
+    sea_order = pd.Categorical(
+        df['Name'], categories=pd.unique(df['Name']), ordered=True)
+    df = df.assign(sea_code=sea_order.codes).sort_values(
+        ['sea_code', 'Vertex_Index'], kind='stable')
 
-        coord = (lon, lat)
-        coords.append(coord)
+    expected = df.groupby('sea_code').cumcount().to_numpy() + 1
+    is_misnumbered = df['Vertex_Index'].to_numpy() != expected
+    if np.any(is_misnumbered):
+        print('Vertex_Index values are not 1..n for:')
+        print(f'{df[is_misnumbered]}')
+        xwm()
+
+    try:
+        df = df.astype({'Latitude': np.float64, 'Longitude': np.float64})
+    except (TypeError, ValueError):
+        print('Error converting Latitude or Longitude')
+        xwm()
+
+    return df.reset_index(drop=True)
 
-    if nh_only:
-        for coord in coords:
-            lon, lat = coord
-            if lat > 0:
-                return coords
-        return None
 
+def select_seas(df, nh_only=False, sh_only=False):
+    """Return a boolean per vertex: whether its sea is to be kept
+
+    Excluded (overarching) seas are dropped, as are -- with nh_only or
+    sh_only -- seas with no vertex in that hemisphere
+    """
+    is_kept = ~df['Name'].isin(excluded).to_numpy()
+    for sea_name in df.loc[~is_kept, 'Name'].unique():
+        print(f'Excluding (list): {sea_name}')
+
+    is_in_hem = np.ones(len(df), dtype=bool)
+    if nh_only:
+        is_in_hem = (df.groupby('sea_code')['Latitude'].transform('max') > 0).to_numpy()  # noqa
     elif sh_only:
-        for coord in coords:
-            lon, lat = coord
-            if lat < 0:
-                return coords
-        return None
+        is_in_hem = (df.groupby('sea_code')['Latitude'].transform('min') < 0).to_numpy()  # noqa
+    for sea_name in df.loc[is_kept & ~is_in_hem, 'Name'].unique():
+        print(f'Excluding (coords): {sea_name}')
+
+    return is_kept & is_in_hem
+
+
+def build_regions_gdf(df_txt, is_nh, is_sh):
+    """Return a GeoDataFrame with one polygon per sea"""
+    df = sort_vertices(df_txt)
+    df = df[select_seas(df, nh_only=is_nh, sh_only=is_sh)]
+
+    # Consecutive codes 0..n-1 for the polygons that are kept
+    poly_idx = np.unique(df['sea_code'].to_numpy(), return_inverse=True)[1]
+    coords = df[['Longitude', 'Latitude']].to_numpy()
+    polys = shapely.polygons(shapely.linearrings(coords, indices=poly_idx))
+
+    df_first = df.drop_duplicates('sea_code')
+    gdf = gpd.GeoDataFrame(
+        {
+            'Region': df_first['Name'].to_numpy(),
+            # Sea_ID has always been written as a float field
+            'Sea_ID': df_first['Sea_ID'].to_numpy(dtype=np.float64),
+        },
+        geometry=polys,
+        crs='epsg:4326',
+    )
+
+    return gdf
 
-    else:
-        return coords
 
+def shapefile_output_fns(args):
+    layername = os.path.splitext(args['ofn'])[0]
 
+    return [f'{layername}.{ext}' for ext in ('shp', 'shx', 'dbf')] + [
+        get_index_fn(args['ofn'])]
+
+
+@timed_stage('gen_shapefile', output_fns=shapefile_output_fns)
 def gen_shapefile(ifn, ofn, is_nh, is_sh):
     """ """
     print(f'ifn: {ifn}')
@@ -72,50 +141,8 @@ def gen_shapefile(ifn, ofn, is_nh, is_sh):
     print(f'Number of unique sea names: {len(sea_names)}')
     print(' ')
 
-    # Start the GeoDataFrame
-    gdf = gpd.GeoDataFrame(crs='epsg:4326')
-    gdf['geometry'] = None
-
-    # Exclusion list: "overarching" sea_names
-    excluded = (
-        'Pacific_Ocean,_western_part',
-        'Pacific_Ocean,_eastern_part',
-        'North_Pacific_Ocean,_western_part',
-        'North_Pacific_Ocean,_eastern_part',
-        'North_Atlantic_Ocean',
-        'Atlantic_Ocean',
-        'Arctic_Ocean,_western_part',
-        'Arctic_Ocean,_eastern_part',
-        'Indian_Ocean',
-        'Eastern_Basin',
-        'Mediterranean_Region',
-    )
-
     # Build a coordinates polygon for each Sea
-    gdf_index = 0
-    for sea_name in sea_names:
-        if sea_name in excluded:
-            print(f'Excluding (list): {sea_name}')
-            continue
-
-        df_sea = df_txt[df_txt['Name'] == sea_name]
-        # print(f'df[{sea_name}]:')
-        # print(f'{df_sea}')
-        coords = get_coords(df_sea, nh_only=is_nh, sh_only=is_sh)
-        if coords is None:
-            print(f'Excluding (coords): {sea_name}')
-            continue
-
-        poly = Polygon(coords)
-
-        gdf.loc[gdf_index, 'geometry'] = poly
-        gdf.loc[gdf_index, 'Region'] = sea_name
-        gdf.loc[gdf_index, 'Sea_ID'] = df_sea.iloc[0]['Sea_ID']
-
-        gdf_index += 1
-
-    # Set the CRS
-    # gdf.crs = from_epsg(4326)
+    gdf = build_regions_gdf(df_txt, is_nh, is_sh)
 
     # Check...
     print(gdf.info())
@@ -124,7 +151,10 @@ def gen_shapefile(ifn, ofn, is_nh, is_sh):
     # Write the output
     gdf.to_file(ofn)
     print(f'Wrote: {ofn}')
-    print(f'Total Seas: {gdf_index}')
+    print(f'Total Seas: {len(gdf)}')
+
+    # ...and its spatial index, for exact lookups (region_polygons.py)
+    build_index(ofn, gdf=gdf)
     print(' ')
 
 
@@ -0,0 +1,313 @@
+"""
+grid_defs.py
+
+Definitions of the polar grids onto which the region masks are rasterized
+
+A grid_name is a projid ('psn', 'pss', 'e2n', 'e2s') followed by the
+grid resolution in km ('25', '12.5', '6.25', '3.125'), eg 'psn12.5'
+
+This is the one registry of the grid geometry: the other modules and
+gen_regionsmask.sh (via --shell) take the extents, resolutions and shapes
+from here.  The cell-center x, y and lat, lon of each grid are computed
+on demand; lat, lon are cached as float32 .npy files in geoloc_dir and
+read back as memory maps.
+
+Usage:
+    python grid_defs.py <grid_name>             # print the grid definition
+    python grid_defs.py --shell <grid_name>     # as shell variables
+    python grid_defs.py --latlon <grid_name> [<geoloc_dir>]
+                                                # cache the lat, lon arrays
+"""
+
+import os
+import sys
+import numpy as np
+
+
+# Projected extents (meters) are the outer edges of the grid
+proj_defs = {
+    'psn': {
+        'hem': 'nh',
+        'epsgcode': 3411,
+        'xleft': -3850000,
+        'xright': 3750000,
+        'yup': 5850000,
+        'ydown': -5350000,
+        'lat_min': 30,
+        'lat_max': 90, },
+    'pss': {
+        'hem': 'sh',
+        'epsgcode': 3412,
+        'xleft': -3950000,
+        'xright': 3950000,
+        'yup': 4350000,
+        'ydown': -3950000,
+        'lat_min': -90,
+        'lat_max': -30, },
+    'e2n': {
+        'hem': 'nh',
+        'epsgcode': 6931,
+        'xleft': -9000000,
+        'xright': 9000000,
+        'yup': 9000000,
+        'ydown': -9000000,
+        'lat_min': 30,
+        'lat_max': 90, },
+    'e2s': {
+        'hem': 'sh',
+        'epsgcode': 6932,
+        'xleft': -9000000,
+        'xright': 9000000,
+        'yup': 9000000,
+        'ydown': -9000000,
+        'lat_min': -90,
+        'lat_max': -30, },
+}
+
+# gridres is a string, eg '25' or '3.125'; grid_res is in meters
+grid_resolutions = {
+    '25': 25000,
+    '12.5': 12500,
+    '6.25': 6250,
+    '3.125': 3125,
+}
+
+# Ellipsoids as (semi-major axis, eccentricity)
+hughes1980 = (6378273., 0.081816153)
+wgs84 = (6378137., 0.0818191908426215)
+
+# Projection parameters by EPSG code
+projections = {
+    3411: {
+        'proj': 'stere', 'ellps': hughes1980, 'north': True,
+        'lat_ts': 70., 'lon_0': -45., },
+    3412: {
+        'proj': 'stere', 'ellps': hughes1980, 'north': False,
+        'lat_ts': 70., 'lon_0': 0., },
+    6931: {
+        'proj': 'laea', 'ellps': wgs84, 'north': True,
+        'lon_0': 0., },
+    6932: {
+        'proj': 'laea', 'ellps': wgs84, 'north': False,
+        'lon_0': 0., },
+}
+
+default_geoloc_dir = './geolocation'
+geoloc_block_rows = 256
+
+grid_names = [
+    f'{projid}{gridres}'
+    for projid in proj_defs.keys()
+    for gridres in grid_resolutions.keys()
+]
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_grid_def(grid_name):
+    """Return a dict describing the geometry of this grid"""
+    projid = grid_name[:3]
+    gridres = grid_name[3:]
+    try:
+        grid_def = dict(proj_defs[projid])
+    except KeyError:
+        xwm(f'projid not recognized: {projid}')
+    try:
+        grid_res = grid_resolutions[gridres]
+    except KeyError:
+        xwm(f'Grid_res not recognized: {gridres}')
+
+    grid_def['grid_name'] = grid_name
+    grid_def['projid'] = projid
+    grid_def['res'] = grid_res
+    grid_def['xdim'] = (grid_def['xright'] - grid_def['xleft']) // grid_res
+    grid_def['ydim'] = (grid_def['yup'] - grid_def['ydown']) // grid_res
+
+    return grid_def
+
+
+def get_xy(grid_name):
+    """Return the projected x and y (m) of the cell centers of a grid
+
+    y runs from the top (max y) row down, as in the .dat files
+    """
+    grid_def = get_grid_def(grid_name)
+    res = grid_def['res']
+    x = grid_def['xleft'] + res / 2 + res * np.arange(grid_def['xdim'])
+    y = grid_def['yup'] - res / 2 - res * np.arange(grid_def['ydim'])
+
+    return x, y
+
+
+def stere_t_params(e, lat_ts):
+    """Return t_c and m_c of the polar stereographic at latitude lat_ts"""
+    phi_c = np.radians(lat_ts)
+    esin_c = e * np.sin(phi_c)
+    t_c = np.tan(np.pi / 4 - phi_c / 2) / \
+        ((1 - esin_c) / (1 + esin_c)) ** (e / 2)
+    m_c = np.cos(phi_c) / np.sqrt(1 - esin_c ** 2)
+
+    return t_c, m_c
+
+
+def laea_q(e, sinphi):
+    """Return q of Snyder eqn 3-12"""
+    esinphi = e * sinphi
+    return (1 - e ** 2) * (
+        sinphi / (1 - esinphi ** 2)
+        - np.log((1 - esinphi) / (1 + esinphi)) / (2 * e))
+
+
+def forward_project(epsgcode, lat, lon):
+    """Return the projected x, y (meters) of arrays of lat, lon (degrees)
+
+    Follows Snyder (1987), Map Projections: A Working Manual,
+    eqns 21-33 to 21-36 (stere) and 24-1 to 24-19 (laea), for the polar
+    aspects of the ellipsoidal projections
+    """
+    params = projections[epsgcode]
+    a, e = params['ellps']
+
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    # The south polar aspects are the north polar ones, mirrored
+    sign = 1. if params['north'] else -1.
+    phi = np.radians(sign * lat)
+    dlam = np.radians(lon - params['lon_0'])
+    sinphi = np.sin(phi)
+    esinphi = e * sinphi
+
+    if params['proj'] == 'stere':
+        t_c, m_c = stere_t_params(e, params['lat_ts'])
+        # t**2, using tan(pi/4 - phi/2)**2 = (1 - sin(phi)) / (1 + sin(phi))
+        t_sq = (1 - sinphi) / (1 + sinphi) * \
+            ((1 + esinphi) / (1 - esinphi)) ** e
+        rho = (a * m_c / t_c) * np.sqrt(t_sq)
+    elif params['proj'] == 'laea':
+        rho = a * np.sqrt(np.maximum(laea_q(e, 1.) - laea_q(e, sinphi), 0))
+    else:
+        xwm(f'Unknown projection: {params["proj"]}')
+
+    x = rho * np.sin(dlam)
+    y = -sign * rho * np.cos(dlam)
+
+    return x, y
+
+
+def inverse_project(epsgcode, x, y):
+    """Return the lat, lon (degrees) of arrays of projected x, y (meters)
+
+    The inverse of forward_project: Snyder eqns 21-37 to 21-39 and 7-9
+    (stere), and 24-28 to 24-30 with the authalic latitude series 3-18
+    (laea).  Points beyond the edge of the earth (laea) are NaN
+    """
+    params = projections[epsgcode]
+    a, e = params['ellps']
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    sign = 1. if params['north'] else -1.
+    rho = np.hypot(x, y)
+
+    if params['proj'] == 'stere':
+        t_c, m_c = stere_t_params(e, params['lat_ts'])
+        t = rho * t_c / (a * m_c)
+        phi = np.pi / 2 - 2 * np.arctan(t)
+        for _ in range(8):
+            esinphi = e * np.sin(phi)
+            phi = np.pi / 2 - 2 * np.arctan(
+                t * ((1 - esinphi) / (1 + esinphi)) ** (e / 2))
+    elif params['proj'] == 'laea':
+        q_p = laea_q(e, 1.)
+        with np.errstate(invalid='ignore'):
+            beta = np.arcsin(1 - rho ** 2 / (a * a * q_p))
+        e2 = e * e
+        phi = beta \
+            + (e2 / 3 + 31 * e2 ** 2 / 180 + 517 * e2 ** 3 / 5040) \
+            * np.sin(2 * beta) \
+            + (23 * e2 ** 2 / 360 + 251 * e2 ** 3 / 3780) * np.sin(4 * beta) \
+            + (761 * e2 ** 3 / 45360) * np.sin(6 * beta)
+    else:
+        xwm(f'Unknown projection: {params["proj"]}')
+
+    lat = sign * np.degrees(phi)
+    lon = params['lon_0'] + np.degrees(np.arctan2(x, -sign * y))
+    lon = (lon + 180.) % 360. - 180.
+    lon = np.where(np.isnan(lat), np.nan, lon)
+
+    return lat, lon
+
+
+def geoloc_fns(grid_name, geoloc_dir=default_geoloc_dir):
+    """Return the names of the cached lat and lon files of a grid"""
+    return (os.path.join(geoloc_dir, f'{grid_name}_lat.npy'),
+            os.path.join(geoloc_dir, f'{grid_name}_lon.npy'))
+
+
+def get_latlon(grid_name, geoloc_dir=default_geoloc_dir):
+    """Return the (ydim, xdim) cell-center lat and lon arrays of a grid
+
+    They are computed and cached on first use; after that, they are
+    read-only memory maps of the cached float32 .npy files
+    """
+    lat_fn, lon_fn = geoloc_fns(grid_name, geoloc_dir)
+    if not (os.path.isfile(lat_fn) and os.path.isfile(lon_fn)):
+        grid_def = get_grid_def(grid_name)
+        shape = (grid_def['ydim'], grid_def['xdim'])
+        x, y = get_xy(grid_name)
+        os.makedirs(geoloc_dir, exist_ok=True)
+
+        tmp_fns = [f'{fn}.{os.getpid()}.tmp.npy' for fn in (lat_fn, lon_fn)]
+        lat = np.lib.format.open_memmap(
+            tmp_fns[0], mode='w+', dtype=np.float32, shape=shape)
+        lon = np.lib.format.open_memmap(
+            tmp_fns[1], mode='w+', dtype=np.float32, shape=shape)
+        for row0 in range(0, shape[0], geoloc_block_rows):
+            rows = y[row0:row0 + geoloc_block_rows]
+            lat[row0:row0 + len(rows)], lon[row0:row0 + len(rows)] = \
+                inverse_project(grid_def['epsgcode'],
+                                x[np.newaxis, :], rows[:, np.newaxis])
+        lat.flush()
+        lon.flush()
+        del lat, lon
+        os.replace(tmp_fns[0], lat_fn)
+        os.replace(tmp_fns[1], lon_fn)
+        print(f'  Cached lat, lon of {grid_name} in: {geoloc_dir}')
+
+    return np.load(lat_fn, mmap_mode='r'), np.load(lon_fn, mmap_mode='r')
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    try:
+        if args[0] in ('--shell', '--latlon'):
+            option = args.pop(0)
+        else:
+            option = None
+        grid_name = args[0]
+    except IndexError:
+        xwm(f'Possible grid names: {" ".join(grid_names)}')
+
+    grid_def = get_grid_def(grid_name)
+    if option == '--shell':
+        # Variable names as used by gen_regionsmask.sh
+        print(f'projid={grid_def["projid"]}')
+        print(f'gridres={grid_name[3:]}')
+        print(f'grid_res={grid_def["res"]}')
+        print(f'hem={grid_def["hem"]}')
+        print(f'epsgcode={grid_def["epsgcode"]}')
+        print(f't_left={grid_def["xleft"]}')
+        print(f't_right={grid_def["xright"]}')
+        print(f't_top={grid_def["yup"]}')
+        print(f't_bottom={grid_def["ydown"]}')
+        print(f'lat_min={grid_def["lat_min"]}')
+        print(f'lat_max={grid_def["lat_max"]}')
+    elif option == '--latlon':
+        geoloc_dir = args[1] if len(args) > 1 else default_geoloc_dir
+        lat, lon = get_latlon(grid_name, geoloc_dir)
+        print(f'{grid_name}: lat {np.nanmin(lat):.3f} to {np.nanmax(lat):.3f}, lon {np.nanmin(lon):.3f} to {np.nanmax(lon):.3f}')  # noqa
+    else:
+        for key, value in grid_def.items():
+            print(f'{key}: {value}')
@@ -0,0 +1,245 @@
+"""
+region_baseline.py
+
+Golden-output regression check of the region .dat grids
+
+A baseline file records, for each .dat and _withland.dat grid:
+
+    sha256        hash of the whole file
+    tile_hashes   (ntiles_y, ntiles_x) hash of each tile_size x tile_size
+                  tile (the first 8 bytes of its sha256, as uint64)
+    histogram     sparse count of each value in each tile, as the arrays
+                  hist_tile, hist_value and hist_count
+
+keyed by the .dat basename, eg seaice_regions_nh_e2n3.125_withland.  A
+check compares the grids against the baseline: a grid whose file hash is
+unchanged is only read once, to hash it, and is not tiled or counted;
+otherwise only the tiles whose hash changed are reported, each with the
+change in the pixel count of every value in the tile, and the total
+change of each value in the grid.
+
+The baseline is a compressed .npz file of about 100 KB for the three
+region sets.
+
+Usage:
+    python region_baseline.py save <baseline_fn> [<dat_fn> ...]
+    python region_baseline.py check <baseline_fn> [<dat_fn> ...]
+  eg
+    python region_baseline.py save region_baseline.npz
+    python region_baseline.py check region_baseline.npz ./psn_fields/seaice_regions_nh_*.dat  # noqa
+
+  With no dat_fn, all of ./*_fields/seaice_regions_*.dat are used, and
+  check also reports the grids of the baseline that are missing; with
+  dat_fn, only those grids are checked.  check exits with a message
+  listing the changed, new and missing grids, if any.
+"""
+
+import os
+import sys
+import glob
+import hashlib
+import numpy as np
+
+from build_cache import hash_file
+from grid_defs import get_grid_def
+from downsample_regions import parse_grid_name
+from stage_timer import guess_region_set
+
+default_tile_size = 256
+key_separator = '/'
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_key(dat_fn):
+    return os.path.splitext(os.path.basename(dat_fn))[0]
+
+
+def read_dat(dat_fn):
+    grid_def = get_grid_def(parse_grid_name(dat_fn))
+    shape = (grid_def['ydim'], grid_def['xdim'])
+    data = np.fromfile(dat_fn, dtype=np.uint8)
+    if data.size != shape[0] * shape[1]:
+        xwm(f'{dat_fn} has {data.size} bytes, not the {shape} of its grid')
+
+    return data.reshape(shape)
+
+
+def iter_tiles(data, tile_size):
+    """Yield the row, col and contiguous data of each tile of a 2D array"""
+    ydim, xdim = data.shape
+    for row, i in enumerate(range(0, ydim, tile_size)):
+        for col, j in enumerate(range(0, xdim, tile_size)):
+            yield row, col, np.ascontiguousarray(
+                data[i:i + tile_size, j:j + tile_size])
+
+
+def summarize(data, tile_size=default_tile_size):
+    """Return the tile hashes and sparse tile histograms of a 2D array"""
+    ntiles_y = -(-data.shape[0] // tile_size)
+    ntiles_x = -(-data.shape[1] // tile_size)
+    tile_hashes = np.zeros((ntiles_y, ntiles_x), dtype=np.uint64)
+    hist_tile = []
+    hist_value = []
+    hist_count = []
+    for row, col, tile in iter_tiles(data, tile_size):
+        tile_hashes[row, col] = np.frombuffer(
+            hashlib.sha256(tile.data).digest()[:8], dtype=np.uint64)[0]
+        counts = np.bincount(tile.ravel(), minlength=256)
+        values = np.flatnonzero(counts)
+        hist_tile.append(np.full(len(values), row * ntiles_x + col))
+        hist_value.append(values)
+        hist_count.append(counts[values])
+
+    return {
+        'tile_hashes': tile_hashes,
+        'hist_tile': np.concatenate(hist_tile).astype(np.uint32),
+        'hist_value': np.concatenate(hist_value).astype(np.uint8),
+        'hist_count': np.concatenate(hist_count).astype(np.uint32),
+    }
+
+
+def tile_histograms(summary):
+    """Return the (ntiles, 256) value counts of each tile of a summary"""
+    hists = np.zeros((summary['tile_hashes'].size, 256), dtype=np.int64)
+    hists[summary['hist_tile'], summary['hist_value']] = summary['hist_count']
+
+    return hists
+
+
+def save_baseline(ofn, dat_fns, tile_size=default_tile_size):
+    """Write the baseline of the .dat files to ofn"""
+    arrays = {'tile_size': np.array(tile_size)}
+    for dat_fn in dat_fns:
+        key = get_key(dat_fn)
+        arrays[f'{key}{key_separator}sha256'] = np.array(hash_file(dat_fn))
+        for name, array in summarize(read_dat(dat_fn), tile_size).items():
+            arrays[f'{key}{key_separator}{name}'] = array
+
+    # Through a file object, so that no .npz is appended to ofn
+    with open(ofn, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    print(f'Wrote baseline of {len(dat_fns)} grids to: {ofn}')
+
+    return ofn
+
+
+def load_baseline(fn):
+    """Return the tile_size and {key: {name: array}} of a baseline file"""
+    baseline = {}
+    with np.load(fn) as npz:
+        tile_size = int(npz['tile_size'])
+        for name in npz.files:
+            if key_separator in name:
+                key, field = name.split(key_separator)
+                baseline.setdefault(key, {})[field] = npz[name]
+
+    return tile_size, baseline
+
+
+def format_counts(diff):
+    """Return eg '5 +120, 30 -120' for the nonzero entries of a count diff"""
+    return ', '.join(
+        f'{value} {diff[value]:+d}' for value in np.flatnonzero(diff))
+
+
+def compare_grid(dat_fn, expected, tile_size):
+    """Return the report lines of the changed tiles of a grid; [] if none"""
+    if str(expected['sha256']) == hash_file(dat_fn):
+        return []
+
+    data = read_dat(dat_fn)
+    summary = summarize(data, tile_size)
+    if summary['tile_hashes'].shape != expected['tile_hashes'].shape:
+        return [f'  tile grid is {summary["tile_hashes"].shape}, not {expected["tile_hashes"].shape}']  # noqa
+
+    changed = np.flatnonzero(
+        summary['tile_hashes'] != expected['tile_hashes'])
+    diffs = tile_histograms(summary)[changed] - \
+        tile_histograms(expected)[changed]
+    ntiles_x = summary['tile_hashes'].shape[1]
+
+    lines = [f'  {len(changed)} of {summary["tile_hashes"].size} tiles changed']  # noqa
+    for tile, diff in zip(changed, diffs):
+        i, j = divmod(int(tile), ntiles_x)
+        i *= tile_size
+        j *= tile_size
+        counts = format_counts(diff) or 'same counts, values moved'
+        lines.append(
+            f'  rows {i}:{i + tile_size} cols {j}:{j + tile_size}: {counts}')
+    total = format_counts(diffs.sum(axis=0))
+    lines.append(f'  total: {total or "same counts, values moved"}')
+
+    return lines
+
+
+def check_baseline(baseline_fn, dat_fns, report_missing=False):
+    """Print the changes of the .dat files from the baseline
+
+    With report_missing, the dat_fns are taken to be all the grids of
+    their region sets, and the other grids of those region sets in the
+    baseline are reported as missing.  Return the keys of the changed,
+    new and missing grids
+    """
+    tile_size, baseline = load_baseline(baseline_fn)
+    changed = []
+    new = []
+    missing = []
+    keys = set()
+    for dat_fn in dat_fns:
+        key = get_key(dat_fn)
+        keys.add(key)
+        if key not in baseline:
+            print(f'{key}: not in the baseline')
+            new.append(key)
+            continue
+
+        lines = compare_grid(dat_fn, baseline[key], tile_size)
+        if lines:
+            print(f'{key}: changed')
+            print('\n'.join(lines))
+            changed.append(key)
+
+    if report_missing:
+        # Only the grids of the region sets that were checked can be missing
+        region_sets = {guess_region_set(key) for key in keys}
+        for key in sorted(set(baseline) - keys):
+            if guess_region_set(key) in region_sets:
+                print(f'{key}: missing')
+                missing.append(key)
+
+    print(f'{len(keys)} grids checked against {baseline_fn}: '
+          f'{len(changed)} changed, {len(new)} new, {len(missing)} missing')
+
+    return changed + new + missing
+
+
+def default_dat_fns(dat_dir='.'):
+    return sorted(glob.glob(
+        os.path.join(dat_dir, '*_fields', 'seaice_regions_*.dat')))
+
+
+if __name__ == '__main__':
+    try:
+        command = sys.argv[1]
+        baseline_fn = sys.argv[2]
+    except IndexError:
+        xwm(__doc__)
+
+    dat_fns = sys.argv[3:]
+    is_all = not dat_fns
+    if is_all:
+        dat_fns = default_dat_fns()
+    if not dat_fns:
+        xwm('No .dat files')
+
+    if command == 'save':
+        save_baseline(baseline_fn, dat_fns)
+    elif command == 'check':
+        changed = check_baseline(baseline_fn, dat_fns, report_missing=is_all)
+        if changed:
+            xwm(f'Grids that differ: {" ".join(changed)}')
+    else:
+        xwm(f'Unknown command: {command}  (options: save, check)')
@@ -0,0 +1,235 @@
+"""
+region_fractions.py
+
+Fraction of each grid cell covered by each region, for boundary cells
+
+The region grids give each cell the region at one sample point, so the
+cells along region boundaries and coasts are assigned all-or-nothing.
+Here each cell is supersampled with n x n points (the cell centers of a
+grid n times finer) and the points are tested against the projected
+polygons, with later polygons overwriting earlier ones as in
+rasterize_regions.py.
+
+Only the boundary cells -- those whose points do not all fall in the
+same polygons -- are supersampled point by point.  They are found from
+the scanline spans of the finer grid, reduced to a count per cell, so the
+finer grid is never held in memory.  The result is stored as sparse
+triples, one per (boundary cell, region value) with a non-zero fraction:
+
+    cell       flat index (row * xdim + col) of the cell in the grid
+    region     region value, or 0 for no region
+    fraction   fraction of the cell's points in that region
+
+The fractions of each boundary cell sum to 1.  Every other cell is
+wholly in the region of its value in the region grid.
+
+Usage:
+    python region_fractions.py [--supersample N] <shp_latlon_fn> <grid_name> [<ofn>]  # noqa
+  eg
+    python region_fractions.py seaice_regions_nh.shp psn25
+
+  ofn defaults to <layername>_<grid_name>_fractions.npz
+"""
+
+import os
+import sys
+import numpy as np
+import geopandas as gpd
+
+from grid_defs import get_grid_def
+from rasterize_regions import (
+    cells_inside, crossing_keys, project_polygons, rings_to_spans)
+from stitch_quads import determine_num_regions
+
+default_supersample = 8
+# Boundary cells are supersampled this many at a time
+block_cells = 65536
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_fine_grid_def(grid_def, supersample):
+    """Return the grid_def of the grid supersample times finer"""
+    fine_grid_def = dict(grid_def)
+    fine_grid_def['res'] = grid_def['res'] / supersample
+    fine_grid_def['xdim'] = grid_def['xdim'] * supersample
+    fine_grid_def['ydim'] = grid_def['ydim'] * supersample
+
+    return fine_grid_def
+
+
+def count_covered_points(rings, grid_def, supersample):
+    """Return the (ydim, xdim) number of points of each cell inside rings"""
+    n = supersample
+    ydim = grid_def['ydim']
+    xdim = grid_def['xdim']
+    span_rows, col_start, col_end = rings_to_spans(
+        rings, get_fine_grid_def(grid_def, n))
+    is_span = col_end > col_start
+    rows = span_rows[is_span] // n
+    col_start = col_start[is_span]
+    col_end = col_end[is_span]
+
+    # Cells first..last hold the span's points; all but the end cells
+    # are covered across the whole width of the cell
+    first = col_start // n
+    last = (col_end - 1) // n
+    counts = np.zeros((ydim, xdim + 1), dtype=np.int32)
+    np.add.at(counts, (rows, first + 1), n)
+    np.add.at(counts, (rows, np.maximum(last, first + 1)), -n)
+    np.cumsum(counts, axis=1, out=counts)
+
+    is_one_cell = first == last
+    np.add.at(counts, (rows[is_one_cell], first[is_one_cell]),
+              (col_end - col_start)[is_one_cell])
+    spans = ~is_one_cell
+    np.add.at(counts, (rows[spans], first[spans]),
+              ((first + 1) * n - col_start)[spans])
+    np.add.at(counts, (rows[spans], last[spans]),
+              (col_end - last * n)[spans])
+
+    return counts[:, :xdim]
+
+
+def find_boundary_cells(projected, grid_def, supersample):
+    """Return the flat indexes of the cells partly covered by a polygon"""
+    n_points = supersample * supersample
+    is_boundary = np.zeros((grid_def['ydim'], grid_def['xdim']), dtype=bool)
+    for _, rings in projected:
+        counts = count_covered_points(rings, grid_def, supersample)
+        is_boundary |= (counts > 0) & (counts < n_points)
+
+    return np.flatnonzero(is_boundary)
+
+
+def label_points(projected_keys, point_rows, point_cols, xdim):
+    """Return the region value of each fine cell; later polygons overwrite"""
+    labels = np.zeros(len(point_rows), dtype=np.uint8)
+    for value, keys in projected_keys:
+        labels[cells_inside(keys, point_rows, point_cols, xdim)] = value
+
+    return labels
+
+
+def region_fractions(projected, grid_def, supersample=default_supersample,
+                     n_regions=None):
+    """Return the cell, region and fraction arrays of the boundary cells"""
+    n = supersample
+    n_points = n * n
+    xdim = grid_def['xdim']
+    fine_grid_def = get_fine_grid_def(grid_def, n)
+
+    boundary = find_boundary_cells(projected, grid_def, n)
+    projected_keys = [
+        (value, crossing_keys(rings, fine_grid_def))
+        for value, rings in projected]
+
+    # Offsets of the points of a cell, in fine rows and columns
+    sub_rows, sub_cols = np.divmod(np.arange(n_points), n)
+
+    cells = []
+    regions = []
+    fractions = []
+    for block0 in range(0, len(boundary), block_cells):
+        block = boundary[block0:block0 + block_cells]
+        rows, cols = np.divmod(block, xdim)
+        point_rows = (rows[:, np.newaxis] * n + sub_rows).ravel()
+        point_cols = (cols[:, np.newaxis] * n + sub_cols).ravel()
+        labels = label_points(
+            projected_keys, point_rows, point_cols, fine_grid_def['xdim'])
+        if n_regions is not None:
+            # Limit to number of regions, as stitch_quads does
+            labels[labels > n_regions] = 0
+
+        # Count the points of each (cell, region) pair of the block
+        pair = np.repeat(np.arange(len(block)), n_points) * 256 + labels
+        pair, count = np.unique(pair, return_counts=True)
+        cells.append(block[pair // 256])
+        regions.append((pair % 256).astype(np.uint8))
+        fractions.append((count / n_points).astype(np.float32))
+
+    if not cells:
+        return (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint8),
+                np.zeros(0, dtype=np.float32))
+
+    return np.concatenate(cells), np.concatenate(regions), \
+        np.concatenate(fractions)
+
+
+def save_fractions(ofn, grid_name, supersample, cell, region, fraction):
+    """Write the triples, with their grid and supersampling, to a .npz"""
+    # Through a file object, so that no .npz is appended to ofn
+    with open(ofn, 'wb') as f:
+        np.savez_compressed(
+            f, grid_name=grid_name, supersample=supersample,
+            cell=cell, region=region, fraction=fraction)
+
+
+def load_fractions(fn):
+    """Return a dict of the arrays of a fractions .npz file"""
+    with np.load(fn) as npz:
+        fractions = {key: npz[key] for key in npz.files}
+    fractions['grid_name'] = str(fractions['grid_name'])
+    fractions['supersample'] = int(fractions['supersample'])
+
+    return fractions
+
+
+def region_fraction_grid(fractions, region_grid, value):
+    """Return the (ydim, xdim) fraction of each cell in region value
+
+    region_grid is the region (or withland) grid the fractions refine
+    """
+    grid = (region_grid == value).astype(np.float32)
+    flat = grid.ravel()
+    flat[fractions['cell']] = 0
+    is_value = fractions['region'] == value
+    flat[fractions['cell'][is_value]] = fractions['fraction'][is_value]
+
+    return grid
+
+
+def rasterize_fractions(
+        shp_latlon_fn, grid_name, ofn=None, supersample=default_supersample,
+        attrname='Sea_ID', max_step_deg=0.01):
+    """Compute the boundary-cell fractions of a latlon shapefile"""
+    layername = os.path.splitext(shp_latlon_fn)[0]
+    if ofn is None:
+        ofn = f'{layername}_{grid_name}_fractions.npz'
+
+    grid_def = get_grid_def(grid_name)
+    gdf = gpd.read_file(shp_latlon_fn)
+    projected = project_polygons(
+        gdf, grid_def, attrname=attrname, max_step_deg=max_step_deg)
+    cell, region, fraction = region_fractions(
+        projected, grid_def, supersample,
+        n_regions=determine_num_regions(layername, grid_name))
+
+    save_fractions(ofn, grid_name, supersample, cell, region, fraction)
+    print(f'  Wrote {len(np.unique(cell))} boundary cells to: {ofn}')
+
+    return ofn
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    supersample = default_supersample
+    if '--supersample' in args:
+        idx = args.index('--supersample')
+        supersample = int(args[idx + 1])
+        del args[idx:idx + 2]
+
+    try:
+        shp_latlon_fn = args[0]
+        grid_name = args[1]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        ofn = args[2]
+    except IndexError:
+        ofn = None
+
+    rasterize_fractions(shp_latlon_fn, grid_name, ofn, supersample)
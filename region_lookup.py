@@ -0,0 +1,223 @@
+"""
+region_lookup.py
+
+Bulk lookup of sea ice regions for arrays of lat/lon points
+
+A RegionIndex is built from one of the netCDF files written by
+create_seaice_region_netcdfs.create_regions_nc.  Points are projected
+onto the file's grid with a vectorized forward projection (NumPy
+versions of the EPSG 3411/3412 polar stereographic and EPSG 6931/6932
+EASE-Grid 2.0 projections, in grid_defs), and the region and surface
+mask values are read from the grid cell containing each point.
+
+Variants are the region sets in the files:
+    'nh'    sea_ice_region, sea_ice_region_surface_mask
+    'NASA'  sea_ice_region_NASA, sea_ice_region_NASA_surface_mask
+    'RH'    sea_ice_region_RH, sea_ice_region_RH_surface_mask
+
+Points off the grid are given fill_value (255) for both.
+
+The projection is done in float64, a chunk of points at a time, at about
+100 ns per point: about 10 million points per second on one core.  This
+does not meet the target of tens of millions of points per second.
+
+Usage:
+    python region_lookup.py <nc_fn> <variant> <ifn> <ofn> [<lat_col> <lon_col>]
+  eg
+    python region_lookup.py NSIDC-0780_SeaIceRegions_PS-N25km_v1.0.nc nh buoys.csv buoys_regions.csv  # noqa
+
+  ifn/ofn are .csv or .parquet files; they are processed in chunks, and
+  the output has the input columns plus 'region' and 'surface'
+"""
+
+import os
+import sys
+import numpy as np
+from netCDF4 import Dataset
+
+from grid_defs import forward_project
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'seaice_region_netcdfs'))
+
+fill_value = 255
+
+variant_varnames = {
+    'nh': ('sea_ice_region', 'sea_ice_region_surface_mask'),
+    'NASA': ('sea_ice_region_NASA', 'sea_ice_region_NASA_surface_mask'),
+    'RH': ('sea_ice_region_RH', 'sea_ice_region_RH_surface_mask'),
+}
+
+default_chunksize = 1_000_000
+cache_chunksize = 1 << 16
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+class RegionIndex:
+    """Sea ice region lookup on one grid and region set"""
+
+    def __init__(self, nc_fn, variant=None):
+        ds = Dataset(nc_fn, 'r')
+        ds.set_auto_maskandscale(False)
+
+        if variant is None:
+            variant = 'nh' if 'sea_ice_region' in ds.variables else 'NASA'
+        try:
+            region_varname, surface_varname = variant_varnames[variant]
+        except KeyError:
+            xwm(f'Unknown variant: {variant}  (options: {list(variant_varnames)})')  # noqa
+        if region_varname not in ds.variables:
+            xwm(f'No variant {variant} ({region_varname}) in {nc_fn}')
+
+        self.nc_fn = nc_fn
+        self.variant = variant
+        self.epsgcode = int(ds.geospatial_bounds_crs.split(':')[-1])
+        self.region_flag_meanings = \
+            ds.variables[region_varname].flag_meanings.split()
+        self.region_flag_values = np.array(
+            ds.variables[region_varname].flag_values)
+
+        x = np.array(ds.variables['x'][:], dtype=np.float64)
+        y = np.array(ds.variables['y'][:], dtype=np.float64)
+        self.res = x[1] - x[0]
+        self.xdim = len(x)
+        self.ydim = len(y)
+        self.x_left = x[0] - self.res / 2
+        self.y_top = y[0] + self.res / 2
+
+        # Flat tables, with one extra entry for points off the grid
+        self.region = np.append(
+            np.array(ds.variables[region_varname][:], dtype=np.uint8).ravel(),
+            np.uint8(fill_value))
+        self.surface = np.append(
+            np.array(ds.variables[surface_varname][:], dtype=np.uint8).ravel(),
+            np.uint8(fill_value))
+        ds.close()
+
+    @classmethod
+    def from_gridid(cls, gridid, variant=None, nc_dir='.',
+                    product_version='v1.0'):
+        """Return the RegionIndex of a gridid, eg 'psn25', from nc_dir"""
+        from create_seaice_region_netcdfs import get_nc_fn
+
+        nc_fn = os.path.join(
+            nc_dir, os.path.basename(get_nc_fn(gridid, product_version)))
+
+        return cls(nc_fn, variant)
+
+    def flat_index(self, lat, lon):
+        """Return the flat grid index of each point; off-grid is the fill"""
+        lat = np.ravel(lat)
+        lon = np.ravel(lon)
+        idx = np.empty(lat.shape, dtype=np.intp)
+        # Small chunks keep the temporary arrays in the CPU cache
+        for i in range(0, len(lat), cache_chunksize):
+            x, y = forward_project(
+                self.epsgcode,
+                lat[i:i + cache_chunksize], lon[i:i + cache_chunksize])
+            col = np.floor((x - self.x_left) / self.res)
+            row = np.floor((self.y_top - y) / self.res)
+            is_on_grid = (col >= 0) & (col < self.xdim) & \
+                (row >= 0) & (row < self.ydim)
+            idx[i:i + cache_chunksize] = np.where(
+                is_on_grid, row * self.xdim + col, self.xdim * self.ydim)
+
+        return idx
+
+    def lookup(self, lat, lon):
+        """Return the region and surface mask values of each lat, lon"""
+        shape = np.shape(lat)
+        idx = self.flat_index(lat, lon)
+
+        return (self.region[idx].reshape(shape),
+                self.surface[idx].reshape(shape))
+
+    def region_names(self, region):
+        """Return the flag_meanings label of each region value"""
+        labels = np.full(256, '', dtype=object)
+        labels[self.region_flag_values] = self.region_flag_meanings
+        labels[fill_value] = 'off_grid'
+
+        return labels[region]
+
+    def classify_chunks(self, chunks, lat_col='lat', lon_col='lon'):
+        """Yield each DataFrame chunk with 'region' and 'surface' added"""
+        for df in chunks:
+            region, surface = self.lookup(
+                df[lat_col].to_numpy(), df[lon_col].to_numpy())
+            yield df.assign(region=region, surface=surface)
+
+    def classify_file(self, ifn, ofn, lat_col='lat', lon_col='lon',
+                      chunksize=default_chunksize):
+        """Classify the points of a .csv or .parquet file, in chunks"""
+        chunks = read_chunks(ifn, chunksize)
+
+        return write_chunks(
+            self.classify_chunks(chunks, lat_col, lon_col), ofn)
+
+
+def read_chunks(ifn, chunksize=default_chunksize):
+    """Yield the rows of a .csv or .parquet file as DataFrames"""
+    if ifn.endswith('.parquet'):
+        return read_parquet_chunks(ifn, chunksize)
+
+    import pandas as pd
+    return pd.read_csv(ifn, chunksize=chunksize)
+
+
+def write_chunks(chunks, ofn):
+    """Write DataFrame chunks to a .csv or .parquet file; return the rows"""
+    n_points = 0
+    writer = None
+    for df in chunks:
+        if ofn.endswith('.parquet'):
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(ofn, table.schema)
+            writer.write_table(table)
+        else:
+            df.to_csv(ofn, mode='w' if n_points == 0 else 'a',
+                      header=(n_points == 0), index=False)
+        n_points += len(df)
+
+    if writer is not None:
+        writer.close()
+    print(f'Wrote {n_points} classified points to: {ofn}')
+
+    return n_points
+
+
+def read_parquet_chunks(ifn, chunksize=default_chunksize):
+    """Yield the rows of a parquet file as DataFrames of chunksize rows"""
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        xwm('pyarrow is needed to read parquet files')
+
+    for batch in pq.ParquetFile(ifn).iter_batches(batch_size=chunksize):
+        yield batch.to_pandas()
+
+
+if __name__ == '__main__':
+    try:
+        nc_fn = sys.argv[1]
+        variant = sys.argv[2]
+        ifn = sys.argv[3]
+        ofn = sys.argv[4]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        lat_col = sys.argv[5]
+        lon_col = sys.argv[6]
+    except IndexError:
+        lat_col = 'lat'
+        lon_col = 'lon'
+
+    region_index = RegionIndex(nc_fn, variant)
+    region_index.classify_file(ifn, ofn, lat_col, lon_col)
@@ -0,0 +1,207 @@
+"""
+region_pipeline.py
+
+In-memory version of the region mask pipeline
+
+The steps of gen_regionsmask.sh and create_regions_nc are chained with
+DataFrames, GeoDataFrames and arrays passed between them, instead of the
+.txt, .shp, latlon .nc, quadrant .nc and .dat files:
+
+    vertices      csv_to_inittxt.csv_to_vertices
+    polygons      gen_shapefile.build_regions_gdf
+    region grid   rasterize_regions (rasterized directly onto the grid,
+                  in place of gdal_rasterize, gdalwarp and stitch_quads)
+    withland      add_landmask.add_landmask_array
+    netCDF        create_regions_ds / write_regions_nc
+
+Only the files that are asked for (shp_fn, dat_fn, withland_fn, nc_fn,
+and for the RH regions of the southern grids shp_fn_RH, dat_fn_RH,
+withland_fn_RH) are written.
+
+Usage:
+    python region_pipeline.py [--landmask-fn FN] [--landmask-flavour NAME]
+                              <grid_name> <vertices_fn> [<vertices_RH_fn>]
+  eg
+    python region_pipeline.py psn25 seaice_regions_nh.txt
+    python region_pipeline.py pss12.5 intermed/seaice_regions_sh_orig.txt intermed/seaice_regions_sh_RH.txt  # noqa
+
+  vertices_fn is the .csv file of the regions or the .txt file made from
+  it by csv_to_inittxt.py.  The southern grids also need the RH regions.
+  The netCDF file is written to the current directory, using the land
+  mask --landmask-fn, or else that of add_landmask.get_landmask_fn, whose
+  values are re-encoded by --landmask-flavour, or else by the flavour
+  named in its filename.
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+from add_landmask import (
+    add_landmask_array, get_landmask_flavour, get_landmask_fn)
+from csv_to_inittxt import csv_to_vertices
+from gen_shapefile import build_regions_gdf
+from grid_defs import get_grid_def
+from rasterize_regions import project_polygons, rasterize_polygons
+from stitch_quads import determine_num_regions
+
+sys.path.insert(0, os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), 'seaice_region_netcdfs'))
+from create_seaice_region_netcdfs import (  # noqa: E402
+    create_regions_ds, default_nc_layout, write_regions_nc)
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def load_vertices(vertices):
+    """Return the vertex table of the .txt files
+
+    vertices is a DataFrame or the name of a file, of either the .csv
+    (Region, Lat, Lon, RegionNo, VertexNo) or the .txt format
+    """
+    if isinstance(vertices, str):
+        if vertices.endswith('.csv'):
+            vertices = pd.read_csv(vertices)
+        else:
+            vertices = pd.read_csv(vertices, sep=r'\s+')
+
+    if 'RegionNo' in vertices.columns:
+        vertices = csv_to_vertices(vertices, verbose=False)
+
+    return vertices
+
+
+def load_landmask(grid_name, landmask, landmask_flavour=None):
+    """Return the land mask array and its flavour
+
+    landmask is an array -- in which case landmask_flavour is needed --
+    or the name of a land mask file
+    """
+    if isinstance(landmask, str):
+        landmask_flavour = get_landmask_flavour(landmask, landmask_flavour)
+        grid_def = get_grid_def(grid_name)
+        landmask = np.fromfile(landmask, dtype=np.uint8).reshape(
+            grid_def['ydim'], grid_def['xdim'])
+    elif landmask_flavour is None:
+        xwm('A landmask_flavour is needed with a land mask array')
+
+    return landmask, landmask_flavour
+
+
+def build_region_grid(
+        vertices, grid_name, landmask=None, landmask_flavour=None,
+        attrname='Sea_ID', max_step_deg=0.01,
+        shp_fn=None, dat_fn=None, withland_fn=None):
+    """Return the region grid of grid_name and, with a landmask, withland
+
+    withland is None if no landmask is given (see load_landmask)
+    """
+    grid_def = get_grid_def(grid_name)
+    is_nh = grid_def['hem'] == 'nh'
+
+    gdf = build_regions_gdf(load_vertices(vertices), is_nh, not is_nh)
+    if shp_fn is not None:
+        gdf.to_file(shp_fn)
+        print(f'Wrote: {shp_fn}')
+
+    projected = project_polygons(
+        gdf, grid_def, attrname=attrname, max_step_deg=max_step_deg)
+    region = rasterize_polygons(
+        projected, grid_def,
+        n_regions=determine_num_regions(None, grid_name))
+    if dat_fn is not None:
+        region.tofile(dat_fn)
+        print(f'Wrote: {dat_fn}')
+
+    withland = None
+    if landmask is not None:
+        landmask, landmask_flavour = load_landmask(
+            grid_name, landmask, landmask_flavour)
+        withland = add_landmask_array(region, landmask, landmask_flavour)
+        if withland_fn is not None:
+            withland.tofile(withland_fn)
+            print(f'Wrote: {withland_fn}')
+
+    return region, withland
+
+
+def build_region_dataset(
+        vertices, grid_name, vertices_RH=None, landmask=None,
+        landmask_flavour=None, product_version='v1.0', nc_fn=None,
+        cell_area_dir=None, with_cell_area=False, layout=default_nc_layout,
+        attrname='Sea_ID', max_step_deg=0.01,
+        shp_fn=None, dat_fn=None, withland_fn=None,
+        shp_fn_RH=None, dat_fn_RH=None, withland_fn_RH=None):
+    """Return the xarray Dataset of the netCDF file of grid_name
+
+    The southern grids need the RH regions as vertices_RH, whose files are
+    written to the *_RH filenames.  landmask defaults to the land mask
+    file of add_landmask.get_landmask_fn.  The netCDF file is written only
+    if nc_fn is given
+    """
+    for fn, fn_RH in ((shp_fn, shp_fn_RH), (dat_fn, dat_fn_RH),
+                      (withland_fn, withland_fn_RH)):
+        if fn is not None and fn_RH is not None and \
+                os.path.abspath(fn) == os.path.abspath(fn_RH):
+            xwm(f'The NASA and RH regions would both be written to: {fn}')
+
+    if landmask is None:
+        landmask = get_landmask_fn(grid_name)
+    landmask, landmask_flavour = load_landmask(
+        grid_name, landmask, landmask_flavour)
+
+    fields = build_region_grid(
+        vertices, grid_name, landmask, landmask_flavour, attrname,
+        max_step_deg, shp_fn, dat_fn, withland_fn)
+    if get_grid_def(grid_name)['hem'] == 'sh':
+        if vertices_RH is None:
+            xwm(f'The RH region vertices are needed for {grid_name}')
+        fields += build_region_grid(
+            vertices_RH, grid_name, landmask, landmask_flavour, attrname,
+            max_step_deg, shp_fn_RH, dat_fn_RH, withland_fn_RH)
+
+    ds = create_regions_ds(
+        grid_name, product_version, *fields,
+        cell_area_dir=cell_area_dir, with_cell_area=with_cell_area)
+    if nc_fn is not None:
+        write_regions_nc(ds, nc_fn, layout=layout)
+
+    return ds
+
+
+if __name__ == '__main__':
+    from create_seaice_region_netcdfs import get_nc_fn
+
+    args = sys.argv[1:]
+    landmask_fn = None
+    if '--landmask-fn' in args:
+        idx = args.index('--landmask-fn')
+        landmask_fn = args[idx + 1]
+        del args[idx:idx + 2]
+
+    landmask_flavour = None
+    if '--landmask-flavour' in args:
+        idx = args.index('--landmask-flavour')
+        landmask_flavour = args[idx + 1]
+        del args[idx:idx + 2]
+
+    try:
+        grid_name = args[0]
+        vertices_fn = args[1]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        vertices_RH_fn = args[2]
+    except IndexError:
+        vertices_RH_fn = None
+
+    product_version = 'v1.0'
+    nc_fn = os.path.basename(get_nc_fn(grid_name, product_version))
+    build_region_dataset(
+        vertices_fn, grid_name, vertices_RH=vertices_RH_fn,
+        landmask=landmask_fn, landmask_flavour=landmask_flavour,
+        product_version=product_version, nc_fn=nc_fn)
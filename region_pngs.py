@@ -0,0 +1,290 @@
+"""
+region_pngs.py
+
+Render the region masks as indexed-palette .png preview images
+
+Each region grid -- a .dat or _withland.dat file, or a region variable
+of a netCDF file -- is written as an 8-bit palette PNG whose pixel values
+are the grid values themselves, so the colors come from a single
+256-entry palette lookup and no per-pixel work is done in Python.  Region
+values get colors in turn from region_colors; the surface mask values
+(land, lake, ...) and the fill value have fixed colors.
+
+The legend -- the value, color and name of every value in the image, with
+the names from seaice_region_netcdfs/seaice_regions_flags.txt -- is
+stored in the .png as a tEXt chunk with keyword 'Legend', and printed
+with --legend.
+
+The images are rendered on a process pool, one file per task.
+
+Usage:
+    python region_pngs.py [--outdir DIR] [--workers N] [--legend] [<fn> ...]
+  eg
+    python region_pngs.py psn_fields/seaice_regions_nh_psn25_withland.dat
+    python region_pngs.py --outdir pngs NSIDC-0780_SeaIceRegions_PS-S12.5km_v1.0.nc  # noqa
+    python region_pngs.py
+
+  fn is a .dat file (whose grid_name and region set are parsed from its
+  name) or a netCDF file (one image per region variable).  With no fn,
+  all of ./*_fields/seaice_regions_*.dat are rendered.  Each image is
+  named after its .dat file, or as <nc basename>_<varname>.png, in outdir
+  (default: next to the input file).
+"""
+
+import os
+import re
+import glob
+import zlib
+import struct
+import argparse
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from grid_defs import get_grid_def
+from downsample_regions import parse_grid_name
+from stage_timer import guess_region_set
+
+this_dir = os.path.dirname(os.path.abspath(__file__))
+default_flags_fn = os.path.join(
+    this_dir, 'seaice_region_netcdfs', 'seaice_regions_flags.txt')
+
+fill_value = 255
+default_complevel = 6
+
+# Region values 1, 2, ... take these colors in turn
+region_colors = (
+    '#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b',
+    '#e377c2', '#bcbd22', '#17becf', '#aec7e8', '#ffbb78', '#98df8a',
+    '#ff9896', '#c5b0d5', '#c49c94', '#f7b6d2', '#dbdb8d', '#9edae5',
+    '#393b79', '#637939',
+)
+fixed_colors = {
+    0: '#08306b',  # ocean, no region
+    30: '#8c8c8c',  # land
+    31: '#525252',  # coast
+    32: '#6baed6',  # lake
+    33: '#ffffff',  # ice on land
+    34: '#c6dbef',  # ice shelf
+    35: '#00001f',  # disconnected ocean
+    40: '#000000',  # off earth
+    fill_value: '#000000',
+}
+
+# Headings of seaice_regions_flags.txt, most specific first
+flag_sections = (
+    ('Southern Hemisphere (RH)', 'sh_RH'),
+    ('Southern Hemisphere', 'sh_orig'),
+    ('Northern Hemisphere', 'nh'),
+    ('added in withland', 'withland'),
+)
+
+# Region set of each region variable of the netCDF files
+varname_region_sets = {
+    'sea_ice_region': 'nh',
+    'sea_ice_region_NASA': 'sh_orig',
+    'sea_ice_region_RH': 'sh_RH',
+}
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def read_flags(flags_fn=default_flags_fn):
+    """Return {section: {value: name}} from seaice_regions_flags.txt
+
+    The sections are the region sets and 'withland', the surface values
+    """
+    flags = {}
+    section = None
+    with open(flags_fn) as f:
+        for line in f:
+            for heading, name in flag_sections:
+                if heading in line:
+                    section = flags.setdefault(name, {})
+                    break
+            else:
+                match = re.match(r'\s*(\d+):\s*(\S+)', line)
+                if match and section is not None:
+                    section[int(match.group(1))] = match.group(2)
+
+    return flags
+
+
+def get_labels(flags, region_set, withland=False):
+    """Return {value: name} of a region set, with the surface values"""
+    labels = dict(flags.get(region_set, {}))
+    if withland:
+        labels.update(flags.get('withland', {}))
+    labels[fill_value] = 'Fill'
+
+    return labels
+
+
+def hex_to_rgb(color):
+    return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+
+
+def build_palette():
+    """Return the (256, 3) uint8 color of every value"""
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    values = np.arange(1, 256)
+    palette[values] = np.array(
+        [hex_to_rgb(color) for color in region_colors], dtype=np.uint8
+    )[(values - 1) % len(region_colors)]
+    for value, color in fixed_colors.items():
+        palette[value] = hex_to_rgb(color)
+
+    return palette
+
+
+def legend_lines(data, labels, palette):
+    """Return a 'value #rrggbb name' line for each value in data"""
+    present = np.flatnonzero(np.bincount(data.ravel(), minlength=256))
+
+    return [
+        f'{value:3d} #{bytes(palette[value]).hex()} {labels.get(value, "")}'
+        for value in present]
+
+
+def png_chunk(chunk_type, body):
+    return struct.pack('>I', len(body)) + chunk_type + body + struct.pack(
+        '>I', zlib.crc32(chunk_type + body) & 0xffffffff)
+
+
+def write_png(data, ofn, palette, text=None, complevel=default_complevel):
+    """Write a 2D uint8 array as an 8-bit palette .png"""
+    ydim, xdim = data.shape
+    # Each row is prefixed with filter type 0 (none)
+    rows = np.zeros((ydim, xdim + 1), dtype=np.uint8)
+    rows[:, 1:] = data
+
+    chunks = [
+        png_chunk(b'IHDR', struct.pack('>IIBBBBB', xdim, ydim, 8, 3, 0, 0, 0)),
+        png_chunk(b'PLTE', palette.tobytes()),
+    ]
+    for keyword, value in (text or {}).items():
+        chunks.append(png_chunk(
+            b'tEXt', keyword.encode('latin-1') + b'\0' +
+            value.encode('latin-1')))
+    chunks.append(png_chunk(b'IDAT', zlib.compress(rows.tobytes(), complevel)))
+    chunks.append(png_chunk(b'IEND', b''))
+
+    with open(ofn, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n' + b''.join(chunks))
+
+    return ofn
+
+
+def render(data, ofn, labels, title=''):
+    """Write the .png of a region grid, with its legend; return the legend"""
+    palette = build_palette()
+    legend = legend_lines(data, labels, palette)
+    write_png(data, ofn, palette,
+              text={'Title': title, 'Legend': '\n'.join(legend)})
+
+    return legend
+
+
+def get_png_fn(fn, outdir=None, varname=None):
+    basename = os.path.splitext(os.path.basename(fn))[0]
+    if varname is not None:
+        basename = f'{basename}_{varname}'
+    if outdir is None:
+        outdir = os.path.dirname(fn)
+
+    return os.path.join(outdir, f'{basename}.png')
+
+
+def render_dat(dat_fn, outdir=None, flags_fn=default_flags_fn):
+    """Render a .dat or _withland.dat file; return [(png_fn, legend)]"""
+    grid_name = parse_grid_name(dat_fn)
+    grid_def = get_grid_def(grid_name)
+    data = np.fromfile(dat_fn, dtype=np.uint8).reshape(
+        grid_def['ydim'], grid_def['xdim'])
+    labels = get_labels(
+        read_flags(flags_fn), guess_region_set(dat_fn),
+        withland='_withland' in os.path.basename(dat_fn))
+
+    ofn = get_png_fn(dat_fn, outdir)
+    legend = render(data, ofn, labels, title=os.path.basename(dat_fn))
+
+    return [(ofn, legend)]
+
+
+def render_nc(nc_fn, outdir=None, flags_fn=default_flags_fn):
+    """Render each region variable of a netCDF file; as render_dat"""
+    from netCDF4 import Dataset
+
+    flags = read_flags(flags_fn)
+    rendered = []
+    with Dataset(nc_fn, 'r') as ds:
+        ds.set_auto_maskandscale(False)
+        for varname, var in ds.variables.items():
+            region_varname = varname.replace('_surface_mask', '')
+            if region_varname not in varname_region_sets:
+                continue
+            labels = get_labels(
+                flags, varname_region_sets[region_varname],
+                withland=varname != region_varname)
+
+            ofn = get_png_fn(nc_fn, outdir, varname)
+            legend = render(
+                np.asarray(var[:], dtype=np.uint8), ofn, labels,
+                title=f'{os.path.basename(nc_fn)} {varname}')
+            rendered.append((ofn, legend))
+
+    return rendered
+
+
+def render_file(fn, outdir=None, flags_fn=default_flags_fn):
+    if fn.endswith('.nc'):
+        return render_nc(fn, outdir, flags_fn)
+
+    return render_dat(fn, outdir, flags_fn)
+
+
+def render_all(fns, outdir=None, max_workers=None,
+               flags_fn=default_flags_fn, print_legend=False):
+    """Render every file on a process pool; return the .png names"""
+    if outdir is not None:
+        os.makedirs(outdir, exist_ok=True)
+
+    ofns = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(render_file, fn, outdir, flags_fn)
+                   for fn in fns]
+        for future in futures:
+            for ofn, legend in future.result():
+                print(f'Wrote: {ofn}')
+                if print_legend:
+                    print('\n'.join(f'  {line}' for line in legend))
+                ofns.append(ofn)
+
+    return ofns
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Render the region masks as palette .png images')
+    parser.add_argument(
+        'fns', nargs='*',
+        help='.dat or .nc files (default: ./*_fields/seaice_regions_*.dat)')
+    parser.add_argument(
+        '--outdir', default=None,
+        help='output directory (default: next to each input file)')
+    parser.add_argument(
+        '--workers', type=int, default=os.cpu_count(),
+        help='number of worker processes (default: all cores)')
+    parser.add_argument(
+        '--flags', default=default_flags_fn,
+        help='flag values file, for the legend')
+    parser.add_argument(
+        '--legend', action='store_true', help='print the legend of each image')
+    args = parser.parse_args()
+
+    fns = args.fns or sorted(glob.glob('./*_fields/seaice_regions_*.dat'))
+    if not fns:
+        xwm('No .dat or .nc files to render')
+
+    render_all(fns, args.outdir, args.workers, args.flags, args.legend)
@@ -0,0 +1,212 @@
+"""
+region_polygons.py
+
+Exact lookup of sea ice regions from the region polygons
+
+The region grids assign each point the region of its grid cell, which is
+not exact along region boundaries.  A PolygonIndex instead tests points
+against the lat/lon polygons of a region shapefile (as written by
+gen_shapefile.py).  The polygons are held in a shapely STRtree over their
+bounding boxes, and each polygon is prepared, so that a point or box is
+tested exactly only against the polygons whose bounding box it falls in.
+
+As in rasterize_regions.py, a point in more than one polygon is given the
+value of the later polygon, and points in no polygon are given 0.  Points
+on a polygon's boundary are in the polygon.
+
+The index is saved as <layername>_index.npz next to the shapefile --
+gen_shapefile.py writes it -- with the polygons as WKB, and is reloaded
+with PolygonIndex.load() without reading the shapefile.
+
+Usage:
+    python region_polygons.py build <shp_fn> [<index_fn>]
+    python region_polygons.py classify <index_fn|shp_fn> <ifn> <ofn> [<lat_col> <lon_col>]  # noqa
+  eg
+    python region_polygons.py build seaice_regions_nh.shp
+    python region_polygons.py classify seaice_regions_nh_index.npz swath.parquet swath_regions.parquet  # noqa
+
+  classify reads .csv or .parquet files in chunks, and the output has the
+  input columns plus 'region'
+"""
+
+import os
+import sys
+import numpy as np
+import shapely
+
+from region_lookup import default_chunksize, read_chunks, write_chunks
+
+# Points are tested this many at a time
+cache_chunksize = 1 << 16
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_index_fn(shp_fn):
+    """Return the name of the index file of a shapefile"""
+    return f'{os.path.splitext(shp_fn)[0]}_index.npz'
+
+
+def wrap_lon(lon):
+    """Return longitudes in [-180, 180], leaving those in range unchanged"""
+    lon = np.asarray(lon, dtype=np.float64)
+    is_out = (lon < -180) | (lon > 180)
+    if not np.any(is_out):
+        return lon
+
+    return np.where(is_out, (lon + 180) % 360 - 180, lon)
+
+
+class PolygonIndex:
+    """Spatial index over the lat/lon polygons of one region set"""
+
+    def __init__(self, geoms, values, names=None):
+        self.geoms = np.asarray(geoms, dtype=object)
+        self.values = np.asarray(values, dtype=np.uint8)
+        if names is None:
+            names = [''] * len(self.geoms)
+        self.names = np.asarray(names, dtype=str)
+
+        shapely.prepare(self.geoms)
+        self.tree = shapely.STRtree(self.geoms)
+
+    @classmethod
+    def from_gdf(cls, gdf, attrname='Sea_ID'):
+        """Return the PolygonIndex of a GeoDataFrame of region polygons"""
+        return cls(gdf.geometry.to_numpy(), gdf[attrname].to_numpy(),
+                   gdf['Region'].to_numpy() if 'Region' in gdf else None)
+
+    @classmethod
+    def from_shapefile(cls, shp_fn, attrname='Sea_ID'):
+        import geopandas as gpd
+
+        return cls.from_gdf(gpd.read_file(shp_fn), attrname)
+
+    @classmethod
+    def load(cls, fn):
+        """Return the PolygonIndex saved in fn, or built from a shapefile"""
+        if fn.endswith('.shp'):
+            return cls.from_shapefile(fn)
+
+        with np.load(fn) as npz:
+            geoms = shapely.from_wkb(npz['wkb'])
+            values = npz['values']
+            names = npz['names']
+
+        return cls(geoms, values, names)
+
+    def save(self, ofn):
+        """Write the polygons, values and names to a .npz file"""
+        # Through a file object, so that no .npz is appended to ofn
+        with open(ofn, 'wb') as f:
+            np.savez_compressed(
+                f, wkb=shapely.to_wkb(self.geoms, hex=True).astype(str),
+                values=self.values, names=self.names)
+
+    def lookup(self, lat, lon):
+        """Return the region value of each lat, lon; 0 if in no region"""
+        shape = np.shape(lat)
+        lat = np.ravel(np.asarray(lat, dtype=np.float64))
+        lon = np.ravel(wrap_lon(lon))
+        region = np.zeros(lat.shape, dtype=np.uint8)
+        for i in range(0, len(lat), cache_chunksize):
+            region[i:i + cache_chunksize] = self._lookup_chunk(
+                lat[i:i + cache_chunksize], lon[i:i + cache_chunksize])
+
+        return region.reshape(shape)
+
+    def _lookup_chunk(self, lat, lon):
+        region = np.zeros(lat.shape, dtype=np.uint8)
+        # Candidate (point, polygon) pairs: the point is in the bounding box
+        point_idx, poly_idx = self.tree.query(shapely.points(lon, lat))
+        order = np.argsort(poly_idx, kind='stable')
+        point_idx = point_idx[order]
+        poly_idx = poly_idx[order]
+
+        # Polygons in order, so that later polygons overwrite earlier ones
+        polys, starts = np.unique(poly_idx, return_index=True)
+        for poly, idx in zip(polys, np.split(point_idx, starts[1:])):
+            is_inside = shapely.intersects_xy(
+                self.geoms[poly], lon[idx], lat[idx])
+            region[idx[is_inside]] = self.values[poly]
+
+        return region
+
+    def query_bbox(self, lon_min, lat_min, lon_max, lat_max):
+        """Return the sorted region values of the polygons meeting a box"""
+        poly_idx = self.tree.query(
+            shapely.box(lon_min, lat_min, lon_max, lat_max),
+            predicate='intersects')
+
+        return np.unique(self.values[poly_idx])
+
+    def region_names(self, region):
+        """Return the name of the first polygon of each region value"""
+        labels = np.full(256, '', dtype=object)
+        labels[self.values[::-1]] = self.names[::-1]
+
+        return labels[region]
+
+    def classify_chunks(self, chunks, lat_col='lat', lon_col='lon'):
+        """Yield each DataFrame chunk with 'region' added"""
+        for df in chunks:
+            region = self.lookup(
+                df[lat_col].to_numpy(), df[lon_col].to_numpy())
+            yield df.assign(region=region)
+
+    def classify_file(self, ifn, ofn, lat_col='lat', lon_col='lon',
+                      chunksize=default_chunksize):
+        """Classify the points of a .csv or .parquet file, in chunks"""
+        chunks = read_chunks(ifn, chunksize)
+
+        return write_chunks(
+            self.classify_chunks(chunks, lat_col, lon_col), ofn)
+
+
+def build_index(shp_fn, ofn=None, gdf=None):
+    """Write the index of a shapefile, or of its GeoDataFrame if given"""
+    if ofn is None:
+        ofn = get_index_fn(shp_fn)
+    if gdf is None:
+        polygon_index = PolygonIndex.from_shapefile(shp_fn)
+    else:
+        polygon_index = PolygonIndex.from_gdf(gdf)
+
+    polygon_index.save(ofn)
+    print(f'Wrote index of {len(polygon_index.geoms)} polygons to: {ofn}')
+
+    return ofn
+
+
+if __name__ == '__main__':
+    try:
+        command = sys.argv[1]
+        fn = sys.argv[2]
+    except IndexError:
+        xwm(__doc__)
+
+    if command == 'build':
+        try:
+            ofn = sys.argv[3]
+        except IndexError:
+            ofn = None
+        build_index(fn, ofn)
+    elif command == 'classify':
+        try:
+            ifn = sys.argv[3]
+            ofn = sys.argv[4]
+        except IndexError:
+            xwm(__doc__)
+
+        try:
+            lat_col = sys.argv[5]
+            lon_col = sys.argv[6]
+        except IndexError:
+            lat_col = 'lat'
+            lon_col = 'lon'
+
+        PolygonIndex.load(fn).classify_file(ifn, ofn, lat_col, lon_col)
+    else:
+        xwm(f'Unknown command: {command}  (options: build, classify)')
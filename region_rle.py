@@ -0,0 +1,175 @@
+"""
+region_rle.py
+
+Run-length-encoded (row-span) storage of the region mask .dat files
+
+The region grids -- the .dat files of stitch_quads.py / rasterize_regions.py
+and the _withland.dat files of add_landmask.py -- are mostly long runs of
+one value, so they are stored as the runs of each row:
+
+    grid_name     grid of the data, eg 'e2n3.125'
+    shape         (ydim, xdim)
+    row_offsets   (ydim + 1) index of the first run of each row
+    values        value of each run (uint8)
+    lengths       number of cells in each run
+
+Runs never cross a row boundary, so any window of rows is decoded from
+its own runs alone, with np.repeat.  The arrays are written compressed
+to a .npz file, named <dat basename>.rle.npz.
+
+Usage:
+    python region_rle.py encode <grid_name> <dat_fn> [<rle_fn>]
+    python region_rle.py decode <rle_fn> [<dat_fn>]
+  eg
+    python region_rle.py encode e2n3.125 seaice_regions_nh_e2n3.125_withland.dat  # noqa
+    python region_rle.py decode seaice_regions_nh_e2n3.125_withland.rle.npz
+
+  rle_fn defaults to the .dat name with .dat replaced by .rle.npz, and
+  dat_fn to the reverse
+"""
+
+import os
+import sys
+import numpy as np
+
+from grid_defs import get_grid_def
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_rle_fn(dat_fn):
+    return f'{os.path.splitext(dat_fn)[0]}.rle.npz'
+
+
+def get_dat_fn(rle_fn):
+    return f'{rle_fn[:-len(".rle.npz")]}.dat'
+
+
+def encode_rle(data):
+    """Return the row_offsets, values and lengths of the runs of a 2D array"""
+    ydim, xdim = data.shape
+    flat = np.ascontiguousarray(data).ravel()
+
+    # A run starts where the value changes, and at the start of every row
+    is_start = np.empty(flat.shape, dtype=bool)
+    is_start[0] = True
+    np.not_equal(flat[1:], flat[:-1], out=is_start[1:])
+    is_start[::xdim] = True
+    starts = np.flatnonzero(is_start)
+
+    lengths = np.diff(np.append(starts, flat.size))
+    length_dtype = np.uint16 if xdim < 2**16 else np.uint32
+    row_offsets = np.searchsorted(starts, np.arange(ydim + 1) * xdim)
+
+    return row_offsets, flat[starts], lengths.astype(length_dtype)
+
+
+def save_rle(ofn, grid_name, data):
+    """Write the runs of a 2D array, with its grid, to a .npz file"""
+    row_offsets, values, lengths = encode_rle(data)
+    # Through a file object, so that no .npz is appended to ofn
+    with open(ofn, 'wb') as f:
+        np.savez_compressed(
+            f, grid_name=grid_name, shape=np.array(data.shape),
+            row_offsets=row_offsets, values=values, lengths=lengths)
+
+
+def load_rle(fn):
+    """Return a dict of the arrays of a .rle.npz file"""
+    with np.load(fn) as npz:
+        rle = {key: npz[key] for key in npz.files}
+    rle['grid_name'] = str(rle['grid_name'])
+    rle['shape'] = tuple(int(dim) for dim in rle['shape'])
+
+    return rle
+
+
+def decode_rle(rle, row0=0, row1=None):
+    """Return rows row0:row1 (default: all) of the array of the runs"""
+    ydim, xdim = rle['shape']
+    if row1 is None:
+        row1 = ydim
+    run0, run1 = rle['row_offsets'][[row0, row1]]
+
+    return np.repeat(
+        rle['values'][run0:run1], rle['lengths'][run0:run1]
+    ).reshape(row1 - row0, xdim)
+
+
+def region_spans(rle, value):
+    """Return the row, col_start and col_end of each run of a value
+
+    The run covers columns col_start..col_end-1 of the row
+    """
+    xdim = rle['shape'][1]
+    lengths = rle['lengths'].astype(np.int64)
+    run_starts = np.cumsum(lengths) - lengths
+    is_value = rle['values'] == value
+    rows, col_start = np.divmod(run_starts[is_value], xdim)
+
+    return rows, col_start, col_start + lengths[is_value]
+
+
+def encode_dat(grid_name, dat_fn, ofn=None):
+    """Write the .rle.npz file of a .dat file of a grid"""
+    if ofn is None:
+        ofn = get_rle_fn(dat_fn)
+
+    grid_def = get_grid_def(grid_name)
+    shape = (grid_def['ydim'], grid_def['xdim'])
+    data = np.fromfile(dat_fn, dtype=np.uint8)
+    if data.size != shape[0] * shape[1]:
+        xwm(f'{dat_fn} has {data.size} bytes, not the {shape} of {grid_name}')
+
+    save_rle(ofn, grid_name, data.reshape(shape))
+    print(f'Wrote run-length-encoded {dat_fn} to: {ofn}')
+
+    return ofn
+
+
+def decode_dat(rle_fn, ofn=None):
+    """Write the .dat file of a .rle.npz file"""
+    if ofn is None:
+        ofn = get_dat_fn(rle_fn)
+
+    decode_rle(load_rle(rle_fn)).tofile(ofn)
+    print(f'Wrote decoded {rle_fn} to: {ofn}')
+
+    return ofn
+
+
+if __name__ == '__main__':
+    try:
+        command = sys.argv[1]
+    except IndexError:
+        xwm(__doc__)
+
+    if command == 'encode':
+        try:
+            grid_name = sys.argv[2]
+            dat_fn = sys.argv[3]
+        except IndexError:
+            xwm(__doc__)
+
+        try:
+            ofn = sys.argv[4]
+        except IndexError:
+            ofn = None
+
+        encode_dat(grid_name, dat_fn, ofn)
+    elif command == 'decode':
+        try:
+            rle_fn = sys.argv[2]
+        except IndexError:
+            xwm(__doc__)
+
+        try:
+            ofn = sys.argv[3]
+        except IndexError:
+            ofn = None
+
+        decode_dat(rle_fn, ofn)
+    else:
+        xwm(f'Unknown command: {command}  (options: encode, decode)')
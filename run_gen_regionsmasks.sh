@@ -4,11 +4,13 @@ set -e  # Quit upon any script errors
 # run_gen_regionsmasks.sh
 
 suffix=$1
+method=${2:-gdal}  # see gen_regionsmask.sh
 if [ -z $suffix ]; then
-  echo "Usage: ./$0 <suffix>"
+  echo "Usage: ./$0 <suffix> [<method>]"
   echo "  Eg:  ./$0 nh"
   echo "  or:  ./$0 sh_orig"
   echo "  or:  ./$0 sh_RH"
+  echo "  or:  ./$0 nh direct"
   exit 1
 fi
 
@@ -18,12 +20,19 @@ elif [[ "$suffix" == *"sh"* ]]; then
   h=s
 fi
 
+# Each stage of the run is recorded in a JSON-lines run report
+# (see stage_timer.py); set SEAICE_REGIONS_REPORT to choose its name
+export SEAICE_REGIONS_RUN_ID=${SEAICE_REGIONS_RUN_ID:-${suffix}_$(date +%Y%m%dT%H%M%S)}
+export SEAICE_REGIONS_REPORT=${SEAICE_REGIONS_REPORT:-run_report_${SEAICE_REGIONS_RUN_ID}.jsonl}
+
 for projid in ps${h} e2${h}; do
   for res in 25 12.5 6.25 3.125; do
-    ./gen_regionsmask.sh seaice_regions_${suffix}.shp ${projid}${res}
+    python stage_timer.py run --stage gen_regionsmask --grid-id ${projid}${res} --region-set ${suffix} -- \
+      ./gen_regionsmask.sh seaice_regions_${suffix}.shp ${projid}${res} ${method}
   done
 done
 
+python stage_timer.py summary ${SEAICE_REGIONS_REPORT} ${SEAICE_REGIONS_REPORT%.jsonl}.json
 echo "Finished $0"
 
 <<SKIP_NH
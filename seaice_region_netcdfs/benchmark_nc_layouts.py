@@ -0,0 +1,141 @@
+"""
+benchmark_nc_layouts.py
+
+Measure the netCDF storage layouts of create_regions_nc on each grid
+
+For each grid and layout, the netCDF file is written to a scratch
+directory and the following are measured:
+    size:     file size (MB)
+    write:    time to write the file (s)
+    full:     time to read every region variable in full (ms)
+    window:   mean time to read a window_size x window_size window of
+              one region variable, at random positions (ms)
+
+The reads are from the page cache, so they measure the cost of
+decompression and chunk selection rather than of the disk.
+
+Usage:
+    python benchmark_nc_layouts.py [--dat-root DIR] [--layouts L [L ...]]
+                                   [--gridids G [G ...]] [--csv FN]
+  eg
+    python benchmark_nc_layouts.py --dat-root ../build --layouts zlib chunked contiguous  # noqa
+
+  The .dat files of each grid are read from <dat_root>/<projid>_fields/
+"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+from netCDF4 import Dataset
+
+from create_seaice_region_netcdfs import create_regions_nc, nc_layouts
+from grid_defs import grid_names
+
+gridids = grid_names
+n_windows = 50
+window_size = 64
+n_full_reads = 3
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def time_full_read(nc_fn):
+    """Return the best time (s) to read every region variable in full"""
+    best = np.inf
+    for _ in range(n_full_reads):
+        start = time.perf_counter()
+        with Dataset(nc_fn, 'r') as ds:
+            ds.set_auto_maskandscale(False)
+            for varname, var in ds.variables.items():
+                if var.dimensions == ('y', 'x'):
+                    var[:]
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def time_window_reads(nc_fn, seed=0):
+    """Return the mean time (s) to read a window of a region variable"""
+    rng = np.random.default_rng(seed)
+    with Dataset(nc_fn, 'r') as ds:
+        ds.set_auto_maskandscale(False)
+        varname = [name for name, var in ds.variables.items()
+                   if var.dimensions == ('y', 'x')][0]
+        var = ds.variables[varname]
+        ydim, xdim = var.shape
+        size = min(window_size, ydim, xdim)
+        rows = rng.integers(0, ydim - size + 1, n_windows)
+        cols = rng.integers(0, xdim - size + 1, n_windows)
+
+        start = time.perf_counter()
+        for row, col in zip(rows, cols):
+            var[row:row + size, col:col + size]
+        elapsed = time.perf_counter() - start
+
+    return elapsed / n_windows
+
+
+def benchmark_layout(gridid, layout, dat_dir, scratch_dir):
+    """Return a dict of the measurements of one grid and layout"""
+    nc_fn = os.path.join(scratch_dir, f'{gridid}_{layout}.nc')
+    start = time.perf_counter()
+    create_regions_nc(
+        gridid, nc_fn, 'v1.0', dat_dir=dat_dir,
+        cell_area_dir=os.path.join(scratch_dir, 'cell_areas'), layout=layout)
+    write_time = time.perf_counter() - start
+
+    result = {
+        'gridid': gridid,
+        'layout': layout,
+        'size_mb': os.path.getsize(nc_fn) / 1e6,
+        'write_s': write_time,
+        'full_ms': time_full_read(nc_fn) * 1e3,
+        'window_ms': time_window_reads(nc_fn) * 1e3,
+    }
+    os.remove(nc_fn)
+
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Benchmark the netCDF layouts of the region files')
+    parser.add_argument('--dat-root', default='.')
+    parser.add_argument(
+        '--layouts', nargs='+', default=list(nc_layouts),
+        choices=list(nc_layouts))
+    parser.add_argument('--gridids', nargs='+', default=gridids)
+    parser.add_argument('--csv', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        for gridid in args.gridids:
+            dat_dir = os.path.join(args.dat_root, f'{gridid[:3]}_fields')
+            if not os.path.isdir(dat_dir):
+                print(f'Skipping {gridid}: no {dat_dir}', file=sys.stderr)
+                continue
+            for layout in args.layouts:
+                results.append(
+                    benchmark_layout(gridid, layout, dat_dir, scratch_dir))
+
+    if not results:
+        xwm('No grids were benchmarked')
+
+    header = f'{"gridid":>9s} {"layout":>11s} {"size_mb":>9s} {"write_s":>8s} {"full_ms":>9s} {"window_ms":>10s}'  # noqa
+    lines = [header]
+    for r in results:
+        lines.append(f'{r["gridid"]:>9s} {r["layout"]:>11s} {r["size_mb"]:9.3f} {r["write_s"]:8.2f} {r["full_ms"]:9.2f} {r["window_ms"]:10.3f}')  # noqa
+    print('\n'.join(lines))
+
+    if args.csv:
+        with open(args.csv, 'w') as f:
+            f.write(','.join(results[0]) + '\n')
+            for r in results:
+                f.write(','.join(str(v) for v in r.values()) + '\n')
+        print(f'Wrote: {args.csv}')
@@ -0,0 +1,145 @@
+"""
+cell_area.py
+
+True (ellipsoidal) area of every grid cell
+
+The polar stereographic grids are conformal, not equal-area: a cell of
+res x res projected meters covers res**2 / k**2 square meters of the
+ellipsoid, where k is the map scale factor at the cell.  k is computed
+at each cell center from the projection parameters -- ellipsoid and
+standard parallel -- of the grid's EPSG code in grid_defs.projections
+(Hughes 1980 for EPSG 3411/3412), following Snyder (1987), Map
+Projections: A Working Manual, eqns 21-33 to 21-39 (polar aspect of the
+ellipsoidal stereographic) and 7-9 (inverse latitude).
+
+The EASE-Grid 2.0 grids are equal-area, so every cell is res**2.
+
+Areas are in square meters, float32, and are cached as .npy files in
+cell_area_dir, from which they are read as memory maps; with no
+cell_area_dir, they are computed in memory and not cached.
+
+Usage:
+    python cell_area.py [<gridid> [<cell_area_dir>]]
+  eg
+    python cell_area.py psn12.5
+
+  With no gridid, the areas of all 16 grids are computed and cached
+"""
+
+import os
+import sys
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from grid_defs import (  # noqa: E402
+    get_grid_def, get_xy, grid_names, projections, stere_t_params)
+
+default_cell_area_dir = './cell_areas'
+# Part of the cache filenames; bumped whenever the computed areas change
+cache_version = 2
+gridids = grid_names
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def polar_stereo_scale(rho, epsgcode):
+    """Return the scale factor k at distances rho (m) from the pole"""
+    params = projections[epsgcode]
+    a, e = params['ellps']
+    t_c, m_c = stere_t_params(e, params['lat_ts'])
+
+    # Invert rho = a m_c t / t_c for the latitude phi
+    t = rho * t_c / (a * m_c)
+    phi = np.pi / 2 - 2 * np.arctan(t)
+    for _ in range(8):
+        esinphi = e * np.sin(phi)
+        phi = np.pi / 2 - 2 * np.arctan(
+            t * ((1 - esinphi) / (1 + esinphi)) ** (e / 2))
+
+    esinphi = e * np.sin(phi)
+    m = np.cos(phi) / np.sqrt(1 - esinphi ** 2)
+    # k is rho / (a m), with its limit at the pole itself
+    k_pole = m_c / (2 * t_c) * np.sqrt(
+        (1 + e) ** (1 + e) * (1 - e) ** (1 - e))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        k = np.where(rho > 0, rho / (a * m), k_pole)
+
+    return k
+
+
+def compute_cell_area(gridid):
+    """Return the (ydim, xdim) area (m^2) of each cell of a gridid"""
+    grid_def = get_grid_def(gridid)
+    res = grid_def['res']
+    xdim = grid_def['xdim']
+    ydim = grid_def['ydim']
+    epsgcode = grid_def['epsgcode']
+
+    if projections[epsgcode]['proj'] == 'laea':
+        return np.full((ydim, xdim), res * res, dtype=np.float32)
+    elif projections[epsgcode]['proj'] != 'stere':
+        xwm(f'No cell area for projection: {projections[epsgcode]["proj"]}')  # noqa
+
+    x, y = get_xy(gridid)
+    cell_area = np.empty((ydim, xdim), dtype=np.float32)
+    # A row at a time keeps the float64 temporaries small
+    for row in range(ydim):
+        rho = np.hypot(x, y[row])
+        cell_area[row, :] = res * res / polar_stereo_scale(rho, epsgcode) ** 2
+
+    return cell_area
+
+
+def cell_area_fn(gridid, cell_area_dir=default_cell_area_dir):
+    return os.path.join(
+        cell_area_dir, f'cell_area_{gridid}_v{cache_version}.npy')
+
+
+def get_cell_area(gridid, cell_area_dir=default_cell_area_dir):
+    """Return the cell areas of a gridid, from the cache if available
+
+    The array is a read-only memory map of the cached .npy file.  If
+    cell_area_dir is None, the areas are computed and nothing is cached
+    """
+    if cell_area_dir is None:
+        return compute_cell_area(gridid)
+
+    fn = cell_area_fn(gridid, cell_area_dir)
+    if not os.path.isfile(fn):
+        os.makedirs(cell_area_dir, exist_ok=True)
+        tmp_fn = f'{fn}.{os.getpid()}.tmp.npy'
+        np.save(tmp_fn, compute_cell_area(gridid))
+        os.replace(tmp_fn, fn)
+        print(f'  Cached cell areas of {gridid} in: {fn}')
+
+    return np.load(fn, mmap_mode='r')
+
+
+def region_ocean_area(surface_mask, cell_area, region_values):
+    """Return the total ocean area of each region value (m^2)
+
+    Ocean cells are those of surface_mask that hold a region value
+    rather than a surface code
+    """
+    area = np.bincount(
+        surface_mask.ravel(), weights=np.ravel(cell_area), minlength=256)
+
+    return area[np.asarray(region_values, dtype=np.intp)]
+
+
+if __name__ == '__main__':
+    try:
+        gridid_list = [sys.argv[1]]
+    except IndexError:
+        gridid_list = gridids
+
+    try:
+        cell_area_dir = sys.argv[2]
+    except IndexError:
+        cell_area_dir = default_cell_area_dir
+
+    for gridid in gridid_list:
+        cell_area = get_cell_area(gridid, cell_area_dir)
+        print(f'{gridid}: {cell_area.shape}  min {cell_area.min() / 1e6:.3f} km^2  max {cell_area.max() / 1e6:.3f} km^2  total {cell_area.sum(dtype=np.float64) / 1e6:.6g} km^2')  # noqa
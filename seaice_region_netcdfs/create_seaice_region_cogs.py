@@ -0,0 +1,495 @@
+"""
+create_seaice_region_cogs.py
+
+Write the region masks of a grid as Cloud-Optimized GeoTIFFs
+
+One GeoTIFF is written per region variable of the netCDF file (eg
+sea_ice_region, sea_ice_region_surface_mask), straight from the arrays
+of the region Dataset, so neither gdal nor a temporary file is needed.
+Each file is a COG:
+    - 256 x 256 tiles, deflate-compressed
+    - internal overviews, each half the size of the one before, down to
+      a single tile; a cell of an overview is the most common value
+      (mode) of its 2 x 2 cells, with ties broken as in
+      downsample_regions.py
+    - all the image directories (IFDs) at the start of the file, and the
+      tiles after them, the smallest overview first
+    - the CRS (an EPSG code) and geotransform of the gridid from
+      get_gridid_info, and the fill value as the nodata value
+    - the flag_values and flag_meanings of the variable as GDAL metadata
+
+so that a reader can fetch any window of any overview level with a few
+range requests.
+
+With --check, each file is then read back by GDAL, as an independent
+reader of the TIFF and GeoKey encoding: gdalinfo must report the size,
+EPSG code, geotransform, PixelIsArea, nodata value, overviews and flag
+metadata of the grid, and GDAL's validate_cloud_optimized_geotiff.py
+(found on the PATH, or as $GDAL_COG_VALIDATOR) must pass it as a COG.
+A missing gdalinfo or validator is reported, and the check skipped.
+
+Usage:
+    python create_seaice_region_cogs.py [--check] <gridid> [<cog_dir> [<nc_fn>]]  # noqa
+  eg
+    python create_seaice_region_cogs.py psn25
+    python create_seaice_region_cogs.py e2s3.125 ../build/cogs ../build/NSIDC-0780_SeaIceRegions_EASE2-S3.125km_v1.0.nc  # noqa
+
+  cog_dir defaults to .; nc_fn to the get_nc_fn() name of the gridid
+  The files are named <nc basename>_<varname>.tif
+"""
+
+import os
+import re
+import sys
+import json
+import zlib
+import shutil
+import struct
+import subprocess
+from xml.sax.saxutils import escape
+import numpy as np
+import xarray as xr
+
+from create_seaice_region_netcdfs import (
+    fill_value, get_geospatial_info, get_gridid_info, get_gridres,
+    get_hem_sets, get_nc_fn)
+# create_seaice_region_netcdfs has put the pipeline directory on sys.path
+from downsample_regions import value_order
+from add_landmask import land_precedence
+
+default_tile_size = 256
+default_complevel = 6
+
+# The (y, x) region variables of the netCDF file of each hemisphere
+cog_varnames = {
+    'north': ('sea_ice_region', 'sea_ice_region_surface_mask'),
+    'south': ('sea_ice_region_NASA', 'sea_ice_region_NASA_surface_mask',
+              'sea_ice_region_RH', 'sea_ice_region_RH_surface_mask'),
+}
+
+# TIFF field types
+tiff_ascii = 2
+tiff_short = 3
+tiff_long = 4
+tiff_double = 12
+tiff_type_formats = {
+    tiff_ascii: 's', tiff_short: 'H', tiff_long: 'I', tiff_double: 'd'}
+
+cog_validator_envvar = 'GDAL_COG_VALIDATOR'
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_epsgcode(gridid):
+    _, geospatial_info = get_geospatial_info(gridid)
+
+    return int(geospatial_info['geospatial_bounds_crs'].split(':')[-1])
+
+
+def get_geotransform(gridid):
+    """Return the GDAL geotransform of a gridid"""
+    xleft, _, yup, _, _, _ = get_gridid_info(gridid)
+    res, _ = get_gridres(gridid)
+
+    return (xleft, res, 0, yup, 0, -res)
+
+
+def get_cog_fn(gridid, varname, cog_dir='.', product_version='v1.0'):
+    nc_basename = os.path.basename(get_nc_fn(gridid, product_version))
+
+    return os.path.join(
+        cog_dir, f'{os.path.splitext(nc_basename)[0]}_{varname}.tif')
+
+
+def mode_downsample2(data, precedence=()):
+    """Return the 2 x 2 block mode of data, as majority_downsample(data, 2)
+
+    Each block's four values are compared with each other directly,
+    rather than counted into a table of every value present
+    """
+    # The tie order of all 256 values orders the present ones the same
+    rank = np.zeros(256, dtype=np.int16)
+    rank[value_order(range(256), precedence)] = np.arange(256)
+
+    cells = [np.ascontiguousarray(data[i::2, j::2])
+             for i in (0, 1) for j in (0, 1)]
+    best = cells[0]
+    best_key = None
+    for cell in cells:
+        count = np.zeros(cell.shape, dtype=np.int16)
+        for other in cells:
+            count += cell == other
+        # The most common value; ties to the value of highest precedence
+        count <<= 8
+        key = count - rank[cell]
+        if best_key is None:
+            best_key = key
+        else:
+            is_better = key > best_key
+            best = np.where(is_better, cell, best)
+            best_key = np.where(is_better, key, best_key)
+
+    return best
+
+
+def get_cog_fns(gridid, cog_dir='.', product_version='v1.0'):
+    """Return the names of the COGs of a gridid"""
+    hem, _ = get_hem_sets(gridid)
+
+    return [get_cog_fn(gridid, varname, cog_dir, product_version)
+            for varname in cog_varnames[hem]]
+
+
+def build_overviews(data, tile_size=default_tile_size, nodata=fill_value,
+                    precedence=()):
+    """Return the mode-downsampled overviews of data, down to one tile"""
+    overviews = []
+    while max(data.shape) > tile_size:
+        # An odd row or column is padded with nodata
+        ydim, xdim = data.shape
+        if ydim % 2 or xdim % 2:
+            data = np.pad(data, ((0, ydim % 2), (0, xdim % 2)),
+                          constant_values=nodata)
+        data = mode_downsample2(data, precedence)
+        overviews.append(data)
+
+    return overviews
+
+
+def encode_tiles(data, tile_size=default_tile_size, nodata=fill_value,
+                 complevel=default_complevel):
+    """Return the deflated tiles of data, row by row of tiles"""
+    ydim, xdim = data.shape
+    n_rows = -(-ydim // tile_size)
+    n_cols = -(-xdim // tile_size)
+    # Edge tiles are full size, padded with nodata
+    padded = np.full(
+        (n_rows * tile_size, n_cols * tile_size), nodata, dtype=np.uint8)
+    padded[:ydim, :xdim] = data
+
+    tiles = []
+    for row in range(n_rows):
+        for col in range(n_cols):
+            tile = padded[row * tile_size:(row + 1) * tile_size,
+                          col * tile_size:(col + 1) * tile_size]
+            tiles.append(zlib.compress(tile.tobytes(), complevel))
+
+    return tiles
+
+
+def gdal_metadata_xml(metadata):
+    items = ''.join(
+        f'<Item name="{name}">{escape(str(value))}</Item>'
+        for name, value in metadata.items())
+
+    return f'<GDALMetadata>{items}</GDALMetadata>'
+
+
+def pack_ifd(tags, ifd_pos, next_ifd_pos):
+    """Return the bytes of an IFD and of the tag values that follow it
+
+    tags is a list of (tag, type, values); values too long for the
+    4-byte value field are written after the IFD, word-aligned
+    """
+    tags = sorted(tags)
+    extra_pos = ifd_pos + 2 + 12 * len(tags) + 4
+    entries = [struct.pack('<H', len(tags))]
+    extra = b''
+    for tag, tiff_type, values in tags:
+        if tiff_type == tiff_ascii:
+            value_bytes = values.encode('ascii') + b'\0'
+            count = len(value_bytes)
+        else:
+            count = len(values)
+            value_bytes = struct.pack(
+                f'<{count}{tiff_type_formats[tiff_type]}', *values)
+
+        if len(value_bytes) <= 4:
+            entries.append(struct.pack('<HHI', tag, tiff_type, count))
+            entries.append(value_bytes.ljust(4, b'\0'))
+        else:
+            entries.append(struct.pack(
+                '<HHII', tag, tiff_type, count, extra_pos + len(extra)))
+            extra += value_bytes
+            if len(extra) % 2:
+                extra += b'\0'
+    entries.append(struct.pack('<I', next_ifd_pos))
+
+    return b''.join(entries) + extra
+
+
+def image_tags(shape, tile_size, is_overview, nodata, tile_offsets,
+               tile_byte_counts):
+    ydim, xdim = shape
+
+    return [
+        (254, tiff_long, [1 if is_overview else 0]),  # NewSubfileType
+        (256, tiff_long, [xdim]),  # ImageWidth
+        (257, tiff_long, [ydim]),  # ImageLength
+        (258, tiff_short, [8]),  # BitsPerSample
+        (259, tiff_short, [8]),  # Compression: deflate
+        (262, tiff_short, [1]),  # PhotometricInterpretation: BlackIsZero
+        (277, tiff_short, [1]),  # SamplesPerPixel
+        (284, tiff_short, [1]),  # PlanarConfiguration: contiguous
+        (322, tiff_long, [tile_size]),  # TileWidth
+        (323, tiff_long, [tile_size]),  # TileLength
+        (324, tiff_long, tile_offsets),  # TileOffsets
+        (325, tiff_long, tile_byte_counts),  # TileByteCounts
+        (339, tiff_short, [1]),  # SampleFormat: unsigned integer
+        (42113, tiff_ascii, str(nodata)),  # GDAL_NODATA
+    ]
+
+
+def geo_tags(gridid):
+    xleft, res, _, yup, _, _ = get_geotransform(gridid)
+    geokeys = [
+        1, 1, 0, 3,  # GeoKeyDirectory version 1.1.0, 3 keys
+        1024, 0, 1, 1,  # GTModelTypeGeoKey: projected
+        1025, 0, 1, 1,  # GTRasterTypeGeoKey: PixelIsArea
+        3072, 0, 1, get_epsgcode(gridid),  # ProjectedCSTypeGeoKey
+    ]
+
+    return [
+        (33550, tiff_double, [res, res, 0.]),  # ModelPixelScale
+        (33922, tiff_double, [0., 0., 0., xleft, yup, 0.]),  # ModelTiepoint
+        (34735, tiff_short, geokeys),  # GeoKeyDirectory
+    ]
+
+
+def write_cog(data, gridid, ofn, nodata=fill_value, precedence=(),
+              metadata=None, tile_size=default_tile_size,
+              complevel=default_complevel):
+    """Write a (ydim, xdim) uint8 array of a gridid as a COG"""
+    data = np.asarray(data, dtype=np.uint8)
+    levels = [data] + build_overviews(data, tile_size, nodata, precedence)
+    level_tiles = [
+        encode_tiles(level, tile_size, nodata, complevel) for level in levels]
+
+    level_tags = []
+    for i, level in enumerate(levels):
+        n_tiles = len(level_tiles[i])
+        # Placeholder offsets, to size the IFDs
+        tags = image_tags(level.shape, tile_size, i > 0, nodata,
+                          [0] * n_tiles, [0] * n_tiles)
+        if i == 0:
+            tags += geo_tags(gridid)
+            if metadata:
+                tags.append(
+                    (42112, tiff_ascii, gdal_metadata_xml(metadata)))
+        level_tags.append(tags)
+
+    # The IFDs come first, then the tiles, from the smallest overview
+    # to the full resolution
+    ifd_sizes = [len(pack_ifd(tags, 0, 0)) for tags in level_tags]
+    ifd_positions = list(8 + np.cumsum([0] + ifd_sizes[:-1]))
+    tile_pos = 8 + sum(ifd_sizes)
+    tile_offsets = [None] * len(levels)
+    for i in reversed(range(len(levels))):
+        sizes = [len(tile) for tile in level_tiles[i]]
+        tile_offsets[i] = list(tile_pos + np.cumsum([0] + sizes[:-1]))
+        tile_pos += sum(sizes)
+    if tile_pos >= 2**32:
+        xwm(f'{ofn} would need BigTIFF; try a higher complevel')
+
+    with open(ofn, 'wb') as f:
+        f.write(b'II' + struct.pack('<HI', 42, ifd_positions[0]))
+        for i, tags in enumerate(level_tags):
+            tags = [tag for tag in tags if tag[0] not in (324, 325)] + [
+                (324, tiff_long, [int(pos) for pos in tile_offsets[i]]),
+                (325, tiff_long, [len(tile) for tile in level_tiles[i]])]
+            next_ifd_pos = \
+                int(ifd_positions[i + 1]) if i + 1 < len(levels) else 0
+            f.write(pack_ifd(tags, int(ifd_positions[i]), next_ifd_pos))
+        for tiles in reversed(level_tiles):
+            f.write(b''.join(tiles))
+
+    return ofn
+
+
+def read_cog(fn, level=0):
+    """Return the array of one level (0: full resolution) of a COG"""
+    with open(fn, 'rb') as f:
+        buf = f.read()
+    if buf[:4] != b'II*\0':
+        xwm(f'Not a little-endian TIFF: {fn}')
+
+    ifd_pos = struct.unpack_from('<I', buf, 4)[0]
+    for _ in range(level):
+        n_tags = struct.unpack_from('<H', buf, ifd_pos)[0]
+        ifd_pos = struct.unpack_from('<I', buf, ifd_pos + 2 + 12 * n_tags)[0]
+        if ifd_pos == 0:
+            xwm(f'No overview level {level} in: {fn}')
+
+    tags = {}
+    n_tags = struct.unpack_from('<H', buf, ifd_pos)[0]
+    for i in range(n_tags):
+        tag, tiff_type, count = struct.unpack_from(
+            '<HHI', buf, ifd_pos + 2 + 12 * i)
+        if tiff_type not in (tiff_short, tiff_long):
+            continue
+        fmt = f'<{count}{tiff_type_formats[tiff_type]}'
+        value_pos = ifd_pos + 2 + 12 * i + 8
+        if struct.calcsize(fmt) > 4:
+            value_pos = struct.unpack_from('<I', buf, value_pos)[0]
+        tags[tag] = struct.unpack_from(fmt, buf, value_pos)
+
+    xdim, ydim, tile_size = tags[256][0], tags[257][0], tags[322][0]
+    n_cols = -(-xdim // tile_size)
+    n_rows = -(-ydim // tile_size)
+    data = np.empty((n_rows * tile_size, n_cols * tile_size), dtype=np.uint8)
+    for i, (pos, size) in enumerate(zip(tags[324], tags[325])):
+        row, col = divmod(i, n_cols)
+        data[row * tile_size:(row + 1) * tile_size,
+             col * tile_size:(col + 1) * tile_size] = np.frombuffer(
+                 zlib.decompress(buf[pos:pos + size]), dtype=np.uint8
+             ).reshape(tile_size, tile_size)
+
+    return data[:ydim, :xdim]
+
+
+def gdalinfo_epsgcode(info):
+    """Return the EPSG code of the CRS of gdalinfo -json output"""
+    if 'proj:epsg' in info.get('stac', {}):
+        return info['stac']['proj:epsg']
+
+    # The last ID (WKT2) or AUTHORITY (WKT1) is that of the whole CRS
+    ids = re.findall(r'(?:ID|AUTHORITY)\["EPSG",\s*"?(\d+)"?\]',
+                     info['coordinateSystem']['wkt'])
+
+    return int(ids[-1]) if ids else None
+
+
+def overview_shapes(shape, tile_size=default_tile_size):
+    """Return the (ydim, xdim) of each overview of build_overviews"""
+    shapes = []
+    while max(shape) > tile_size:
+        shape = tuple(-(-dim // 2) for dim in shape)
+        shapes.append(shape)
+
+    return shapes
+
+
+def check_cog_with_gdal(fn, gridid, shape, metadata=None,
+                        nodata=fill_value, tile_size=default_tile_size):
+    """Check a (ydim, xdim) COG of gridid with gdalinfo and the validator
+
+    Exit with a message listing the differences, if any.  Return whether
+    the check could be done
+    """
+    if shutil.which('gdalinfo') is None:
+        print(f'gdalinfo not found; {fn} not checked with GDAL')
+        return False
+
+    info = json.loads(subprocess.run(
+        ['gdalinfo', '-json', fn], check=True, capture_output=True,
+        text=True).stdout)
+    band = info['bands'][0]
+    ydim, xdim = shape
+
+    expected = {
+        'size': [xdim, ydim],
+        'EPSG code': get_epsgcode(gridid),
+        'geotransform': list(get_geotransform(gridid)),
+        'AREA_OR_POINT': 'Area',
+        'nodata value': nodata,
+        'block': [tile_size, tile_size],
+        'overview sizes': [[ov_xdim, ov_ydim] for ov_ydim, ov_xdim in
+                           overview_shapes(shape, tile_size)],
+    }
+    found = {
+        'size': info['size'],
+        'EPSG code': gdalinfo_epsgcode(info),
+        'geotransform': info['geoTransform'],
+        'AREA_OR_POINT': info['metadata'].get('', {}).get('AREA_OR_POINT'),
+        'nodata value': band.get('noDataValue'),
+        'block': band['block'],
+        'overview sizes': [ov['size'] for ov in band.get('overviews', [])],
+    }
+    for name, value in (metadata or {}).items():
+        expected[name] = str(value)
+        found[name] = info['metadata'].get('', {}).get(name)
+
+    errors = [f'{name}: {found[name]}, not {value}'
+              for name, value in expected.items()
+              if found[name] != value and not (
+                  name == 'geotransform' and np.allclose(found[name], value))]
+
+    validator = os.environ.get(cog_validator_envvar) or \
+        shutil.which('validate_cloud_optimized_geotiff.py')
+    if validator is None:
+        print(f'validate_cloud_optimized_geotiff.py not found (set {cog_validator_envvar}); {fn} not validated as a COG')  # noqa
+    else:
+        result = subprocess.run(
+            [sys.executable, validator, fn], capture_output=True, text=True)
+        if result.returncode != 0:
+            errors.append(result.stdout.strip() + result.stderr.strip())
+
+    if errors:
+        xwm(f'GDAL reads {fn} differently:\n  ' + '\n  '.join(errors))
+    print(f'Checked with GDAL: {fn}')
+
+    return True
+
+
+def write_dataset_cogs(ds, gridid, cog_dir='.', product_version='v1.0',
+                       check=False):
+    """Write a COG of each region variable of a region Dataset
+
+    With check, each COG is then checked with check_cog_with_gdal
+    """
+    os.makedirs(cog_dir, exist_ok=True)
+    hem, _ = get_hem_sets(gridid)
+    cog_fns = []
+    for varname in cog_varnames[hem]:
+        var = ds[varname]
+
+        precedence = land_precedence if 'surface_mask' in varname else ()
+        metadata = {
+            name: var.attrs[name] for name in ('flag_values', 'flag_meanings')
+            if name in var.attrs}
+        if 'flag_values' in metadata:
+            metadata['flag_values'] = ' '.join(
+                str(value) for value in np.ravel(metadata['flag_values']))
+
+        cog_fn = get_cog_fn(gridid, varname, cog_dir, product_version)
+        write_cog(
+            var.values, gridid, cog_fn, nodata=fill_value,
+            precedence=precedence, metadata=metadata)
+        print(f'Wrote: {cog_fn}')
+        if check:
+            check_cog_with_gdal(
+                cog_fn, gridid, var.shape, metadata, nodata=fill_value)
+        cog_fns.append(cog_fn)
+
+    return cog_fns
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    check = '--check' in args
+    if check:
+        args.remove('--check')
+
+    try:
+        gridid = args[0]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        cog_dir = args[1]
+    except IndexError:
+        cog_dir = '.'
+
+    product_version = 'v1.0'
+    try:
+        nc_fn = args[2]
+    except IndexError:
+        nc_fn = get_nc_fn(gridid, product_version)
+
+    if not os.path.isfile(nc_fn):
+        xwm(f'No such netCDF file: {nc_fn}')
+
+    with xr.open_dataset(nc_fn, mask_and_scale=False) as ds:
+        write_dataset_cogs(ds, gridid, cog_dir, product_version, check)
@@ -5,6 +5,11 @@ Create netCDF versions of the region masks
 One file per grid which includes:
     - rasterized region mask
     - rasterized region mask with surface mask
+    - optionally (--cell-area), the area of each grid cell
+    - optionally (--latlon), the lat and lon of each grid cell center
+Optionally (--cog-dir), each region mask is also written as a
+Cloud-Optimized GeoTIFF (see create_seaice_region_cogs.py)
+The region masks have the ocean area of each region as an attribute.
 Note: Southern hemisphere has four versions, including original and RH
 
     python create_nisev6_valid_anc.py [<hem> [<maskdir>]]
@@ -20,107 +25,163 @@ Sample usage:
 """
 
 import os
+import sys
 import numpy as np
 import xarray as xr
 import datetime as dt
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from grid_defs import (  # noqa: E402
+    default_geoloc_dir, get_grid_def, get_latlon, grid_resolutions)
+from stage_timer import stage_timer, timed_stage  # noqa: E402
+
+
+# Storage layouts of the (y, x) variables, as netCDF4 encoding settings
+nc_layouts = {
+    'zlib': {'zlib': True},
+    'shuffle': {'zlib': True, 'complevel': 4, 'shuffle': True},
+    'chunked': {
+        'zlib': True, 'complevel': 4, 'shuffle': True,
+        'chunksizes': (256, 256)},
+    'contiguous': {'contiguous': True},
+}
+default_nc_layout = 'zlib'
+
+fill_value = 255
+
+# Labels of the region values, indexed by value
+region_flag_labels = {
+    'north': (
+        'ocean_no_region_specified',
+        'central_arctic',
+        'beaufort_sea',
+        'chukchi_sea',
+        'east_siberian_sea',
+        'laptev_sea',
+        'kara_sea',
+        'barents_sea',
+        'east_greenland_sea',
+        'baffin_bay_and_labrador_seas',
+        'gulf_of_st_lawrence',
+        'hudson_bay',
+        'canadian_archipelago',
+        'bering_sea',
+        'sea_of_okhotsk',
+        'sea_of_japan',
+        'bohai_and_yellow_seas',
+        'baltic_sea',
+        'gulf_of_alaska',
+    ),
+    'NASA': (
+        'ocean_no_region_specified',
+        'weddell_sea',
+        'indian_ocean',
+        'south_pacific_ocean',
+        'ross_sea',
+        'amundsen_and_bellingshausen_seas',
+    ),
+    'RH': (
+        'ocean_no_region_specified',
+        'weddell_sea',
+        'kinghaakonVII_sea',
+        'east_antarctica',
+        'ross_and_amundsen_seas',
+        'amundsen_and_bellingshausen_seas',
+    ),
+}
+
+# Labels of the surface mask values added by add_landmask
+surface_flag_labels = {
+    30: 'land',
+    31: 'coast',
+    32: 'fresh_free_water',
+    33: 'ice_on_land',
+    34: 'floating_ice_shelf',
+    35: 'ocean_disconnected',
+    40: 'off_earth',
+}
+
 
 def xwm(m='exiting in xwm()'):
     raise SystemExit(m)
 
 
+def get_encoding(layout, shape):
+    # Return the to_netcdf encoding of a variable for a layout, which is
+    # either a name in nc_layouts or a dict of encoding settings, eg
+    #   {'zlib': True, 'complevel': 6, 'shuffle': True,
+    #    'chunksizes': (128, 128)}
+    # Chunk sizes are clipped to the shape of the variable
+    if isinstance(layout, str):
+        try:
+            layout = nc_layouts[layout]
+        except KeyError:
+            xwm(f'Unknown layout: {layout}  (options: {list(nc_layouts)})')
+
+    encoding = dict(layout)
+    if encoding.get('contiguous') and \
+            (encoding.get('zlib') or 'chunksizes' in encoding):
+        xwm(f'A contiguous layout cannot be compressed or chunked: {layout}')
+    if 'chunksizes' in encoding:
+        encoding['chunksizes'] = tuple(
+            min(chunk, dim)
+            for chunk, dim in zip(encoding['chunksizes'], shape))
+
+    return encoding
+
+
+def get_flag_label_table(hem, varname):
+    # Return a 256-entry array with the flag label of each value,
+    # '' for values that have no label
+    if hem == 'north':
+        region_set = 'north'
+    elif hem == 'south' and 'NASA' in varname:
+        region_set = 'NASA'
+    elif hem == 'south' and 'RH' in varname:
+        region_set = 'RH'
+    else:
+        xwm(f'Could not parse varname: {varname}')
+
+    table = np.full(256, '', dtype=object)
+    table[:len(region_flag_labels[region_set])] = \
+        region_flag_labels[region_set]
+    for val, label in surface_flag_labels.items():
+        table[val] = label
+
+    return table
+
+
 def get_flag_labels(hem, varname, vals_arr):
     # Given a list of values, return a string
     # with a label for each value in the array
-    flag_str = "ocean_no_region_specified"
-
-    for val in vals_arr:
-        if hem == 'north':
-            if val == 1:
-                flag_str += ' central_arctic'
-            elif val == 2:
-                flag_str += ' beaufort_sea'
-            elif val == 3:
-                flag_str += ' chukchi_sea'
-            elif val == 4:
-                flag_str += ' east_siberian_sea'
-            elif val == 5:
-                flag_str += ' laptev_sea'
-            elif val == 6:
-                flag_str += ' kara_sea'
-            elif val == 7:
-                flag_str += ' barents_sea'
-            elif val == 8:
-                flag_str += ' east_greenland_sea'
-            elif val == 9:
-                flag_str += ' baffin_bay_and_labrador_seas'
-            elif val == 10:
-                flag_str += ' gulf_of_st_lawrence'
-            elif val == 11:
-                flag_str += ' hudson_bay'
-            elif val == 12:
-                flag_str += ' canadian_archipelago'
-            elif val == 13:
-                flag_str += ' bering_sea'
-            elif val == 14:
-                flag_str += ' sea_of_okhotsk'
-            elif val == 15:
-                flag_str += ' sea_of_japan'
-            elif val == 16:
-                flag_str += ' bohai_and_yellow_seas'
-            elif val == 17:
-                flag_str += ' baltic_sea'
-            elif val == 18:
-                flag_str += ' gulf_of_alaska'
-        elif hem == 'south' and 'NASA' in varname:
-            if val == 1:
-                flag_str += ' weddell_sea'
-            elif val == 2:
-                flag_str += ' indian_ocean'
-            elif val == 3:
-                flag_str += ' south_pacific_ocean'
-            elif val == 4:
-                flag_str += ' ross_sea'
-            elif val == 5:
-                flag_str += ' amundsen_and_bellingshausen_seas'
-        elif hem == 'south' and 'RH' in varname:
-            if val == 1:
-                flag_str += ' weddell_sea'
-            elif val == 2:
-                flag_str += ' kinghaakonVII_sea'
-            elif val == 3:
-                flag_str += ' east_antarctica'
-            elif val == 4:
-                flag_str += ' ross_and_amundsen_seas'
-            elif val == 5:
-                flag_str += ' amundsen_and_bellingshausen_seas'
-        else:
-            xwm(f'Could not parse varname: {varname}')
-
-        if val == 30:
-            flag_str += ' land'
-        elif val == 32:
-            flag_str += ' fresh_free_water'
-        elif val == 33:
-            flag_str += ' ice_on_land'
-        elif val == 34:
-            flag_str += ' floating_ice_shelf'
-        elif val == 35:
-            flag_str += ' ocean_disconnected'
-        elif val == 40:
-            flag_str += ' off_earth'
-
-    return flag_str
+    labels = get_flag_label_table(hem, varname)[
+        np.asarray(vals_arr, dtype=np.intp)]
+    if not all(labels):
+        xwm(f'No flag label for values {np.asarray(vals_arr)[labels == ""]} of {varname}')  # noqa
+
+    return ' '.join(labels)
+
+
+def get_flag_attrs(hem, varname, data):
+    # Return the valid_range, flag_values, flag_meanings and
+    # flag_pixel_counts attributes of a region variable, from a single
+    # histogram of its values
+    counts = np.bincount(data.ravel(), minlength=256)
+    counts[fill_value] = 0
+    flag_values = np.flatnonzero(counts).astype(np.uint8)
+
+    return {
+        'valid_range': np.array((0, flag_values.max()), dtype=np.uint8),
+        'flag_values': flag_values,
+        'flag_meanings': get_flag_labels(hem, varname, flag_values),
+        'flag_pixel_counts': counts[flag_values].astype(np.int32),
+    }
 
 
 def get_gridid_info(gridid):
     # Return the crs for this gridid
     if gridid[:3] == 'psn':
         grid_str = 'NSIDC Polar Stereo Northern Hemisphere'
-        xleft = -3850000
-        xright = 3750000
-        yup = 5850000
-        ydown = -5350000
         crs_dict = {
             'grid_mapping_name': "polar_stereographic",
             'straight_vertical_longitude_from_pole': -45.,
@@ -137,10 +198,6 @@ def get_gridid_info(gridid):
         }
     elif gridid[:3] == 'pss':
         grid_str = 'NSIDC Polar Stereo Southern Hemisphere'
-        xleft = -3950000
-        xright = 3950000
-        yup = 4350000
-        ydown = -3950000
         crs_dict = {
             'grid_mapping_name': "polar_stereographic",
             'straight_vertical_longitude_from_pole': 0.,
@@ -157,10 +214,6 @@ def get_gridid_info(gridid):
         }
     elif gridid[:3] == 'e2n':
         grid_str = 'EASE 2.0 Northern Hemisphere'
-        xleft = -9000000
-        xright = 9000000
-        yup = 9000000
-        ydown = -9000000
         crs_dict = {
             'grid_mapping_name': 'lambert_azimuthal_equal_area',
             'false_easting': 0.,
@@ -176,10 +229,6 @@ def get_gridid_info(gridid):
         }
     elif gridid[:3] == 'e2s':
         grid_str = 'EASE 2.0 Southern Hemisphere'
-        xleft = -9000000
-        xright = 9000000
-        yup = 9000000
-        ydown = -9000000
         crs_dict = {
             'grid_mapping_name': 'lambert_azimuthal_equal_area',
             'false_easting': 0.,
@@ -196,38 +245,87 @@ def get_gridid_info(gridid):
     else:
         xwm(f'Cannon get crs_dict from gridid: {gridid}')
 
+    # The extents are those of the grid registry, grid_defs
+    grid_def = get_grid_def(gridid)
+    xleft = grid_def['xleft']
+    xright = grid_def['xright']
+    yup = grid_def['yup']
+    ydown = grid_def['ydown']
+
     return xleft, xright, yup, ydown, crs_dict, grid_str
 
 
 def get_gridres(gridid):
     # Determine the grid resolution from the gridid
-    if '3.125' in gridid:
-        res = 3125
-        res_str = '3.125km'
-    elif '6.25' in gridid:
-        res = 6250
-        res_str = '6.25km'
-    elif '12.5' in gridid:
-        res = 12500
-        res_str = '12.5km'
-    elif '25' in gridid:
-        res = 25000
-        res_str = '25km'
-    else:
+    gridres = gridid[3:]
+    try:
+        res = grid_resolutions[gridres]
+    except KeyError:
         xwm(f'Could not determine res from gridid {gridid}')
+    res_str = f'{gridres}km'
 
     return res, res_str
 
 
-def create_regions_nc(gridid, nc_fn, product_version):
-    # Create a netCDF file from geotiffs with valid snow and seaice
-    #    nc_fn='./NSIDC-XXXX_{gridid.upper()}-SeaIceRegions-v1.0.nc'):
+def get_geospatial_info(gridid):
+    # Return the projection abbreviation and the geospatial_* global attrs
+    if 'psn' in gridid:
+        proj = 'PS'
+        geospatial_info = {
+            'geospatial_bounds_crs': 'EPSG:3411',
+            'geospatial_bounds': 'POLYGON ((-3850000 5850000, 3750000 5850000, 3750000 -5350000, -3850000 -5350000, -3850000 5850000))',  # noqa
+            'geospatial_lat_min': 30.98,
+            'geospatial_lat_max': 90.,
+            'geospatial_lon_min': -180.,
+            'geospatial_lon_max': 180.,
+        }
+    elif 'pss' in gridid:
+        proj = 'PS'
+        geospatial_info = {
+            'geospatial_bounds_crs': 'EPSG:3412',
+            'geospatial_bounds': 'POLYGON ((-3950000 4350000, 3950000 4350000, 3950000 -3950000, -3950000 -3950000, -3950000 4350000))',  # noqa
+            'geospatial_lat_min': -90.,
+            'geospatial_lat_max': -39.23,
+            'geospatial_lon_min': -180.,
+            'geospatial_lon_max': 180.,
+        }
+    elif 'e2n' in gridid:
+        proj = 'EASE2'
+        geospatial_info = {
+            'geospatial_bounds_crs': 'EPSG:6931',
+            'geospatial_bounds': 'POLYGON ((-9000000 9000000, 9000000 9000000, 9000000 -9000000, -9000000 -9000000, -9000000 9000000))',  # noqa
+            'geospatial_lat_min': 0.,
+            'geospatial_lat_max': 90.,
+            'geospatial_lon_min': -180.,
+            'geospatial_lon_max': 180.,
+        }
+    elif 'e2s' in gridid:
+        proj = 'EASE2'
+        geospatial_info = {
+            'geospatial_bounds_crs': 'EPSG:6932',
+            'geospatial_bounds': 'POLYGON ((-9000000 9000000, 9000000 9000000, 9000000 -9000000, -9000000 -9000000, -9000000 9000000))',  # noqa
+            'geospatial_lat_min': -90.,
+            'geospatial_lat_max': 0.,
+            'geospatial_lon_min': -180.,
+            'geospatial_lon_max': 180.,
+        }
+    else:
+        xwm(f'Could not determine geospatial info from gridid {gridid}')
 
-    xleft, xright, yup, ydown, crs_dict, grid_str = get_gridid_info(gridid)
-    res, res_str = get_gridres(gridid)
-    xdim = (xright - xleft) // res
-    ydim = (yup - ydown) // res
+    return proj, geospatial_info
 
+
+def get_nc_fn(gridid, product_version):
+    # Return the name of the distributed netCDF file for this gridid
+    proj, _ = get_geospatial_info(gridid)
+    H = gridid[2].upper()
+    res = gridid[3:]
+
+    return f'./NSIDC-0780_SeaIceRegions_{proj}-{H}{res}km_{product_version}.nc'
+
+
+def get_hem_sets(gridid):
+    # Return the hemisphere of a gridid and the region sets of its file
     if 'psn' in gridid or 'e2n' in gridid:
         hem = 'north'
         fn_sets = ('nh', )
@@ -237,48 +335,36 @@ def create_regions_nc(gridid, nc_fn, product_version):
     else:
         xwm(f'Could not determine hem from gridid {gridid}')
 
-    x = np.linspace(xleft + res // 2, xright - res // 2, num=xdim, dtype=np.float32)  # noqa
-    y = np.linspace(yup - res // 2, ydown + res // 2, num=ydim, dtype=np.float32)  # noqa
+    return hem, fn_sets
 
-    # Create output netCDF file via xarray
-    first_mask_str = f'{fn_sets[0]}'
 
-    fn_dat = f'./{gridid[:3]}_fields/seaice_regions_{first_mask_str}_{gridid}.dat'  # noqa
-    try:
-        assert os.path.isfile(fn_dat)
-    except AssertionError:
-        xwm(f'No such .dat file: {fn_dat}')
-    # print(f'  Reading region raster only from: {fn_dat}')
+def create_regions_ds(gridid, product_version, seaice_region,
+                      seaice_landmask, seaice_region_RH=None,
+                      seaice_landmask_RH=None, cell_area_dir=None,
+                      with_cell_area=False, with_latlon=False,
+                      geoloc_dir=default_geoloc_dir):
+    # Return the xarray Dataset of the region masks of a gridid
+    # The _RH fields are needed for the southern hemisphere
+    # Cell areas are cached in cell_area_dir (see cell_area.py), or with
+    # no cell_area_dir computed in memory; with with_cell_area, they are
+    # also written as the cell_area variable
+    # With with_latlon, the cell-center lat, lon (cached in geoloc_dir,
+    # see grid_defs.get_latlon) are added as auxiliary coordinates
+    from cell_area import get_cell_area, region_ocean_area
 
-    fn_land = f'./{gridid[:3]}_fields/seaice_regions_{first_mask_str}_{gridid}_withland.dat'  # noqa
-    try:
-        assert os.path.isfile(fn_land)
-    except AssertionError:
-        xwm(f'No such withland file: {fn_land}')
-    # print(f'  Reading land/region raster from: {fn_land}')
-
-    seaice_region = np.fromfile(fn_dat, dtype=np.uint8).reshape(ydim, xdim)
-    seaice_landmask = np.fromfile(fn_land, dtype=np.uint8).reshape(ydim, xdim)
-
-    if hem == 'south':
-        # Read in for RH
-        fn_dat_rh = f'./{gridid[:3]}_fields/seaice_regions_{fn_sets[1]}_{gridid}.dat'  # noqa
+    xleft, xright, yup, ydown, crs_dict, grid_str = get_gridid_info(gridid)
+    _, geospatial_info = get_geospatial_info(gridid)
+    res, res_str = get_gridres(gridid)
+    xdim = (xright - xleft) // res
+    ydim = (yup - ydown) // res
 
-        try:
-            assert os.path.isfile(fn_dat_rh)
-        except AssertionError:
-            xwm(f'No such .dat file: {fn_dat_rh}')
-        # print(f'  Reading region raster only from: {fn_dat_rh}')
-        seaice_region_RH = np.fromfile(fn_dat_rh, dtype=np.uint8).reshape(ydim, xdim)  # noqa
+    hem, _ = get_hem_sets(gridid)
+    if hem == 'south' and \
+            (seaice_region_RH is None or seaice_landmask_RH is None):
+        xwm(f'The RH region fields are needed for {gridid}')
 
-        fn_land_rh = f'./{gridid[:3]}_fields/seaice_regions_{fn_sets[1]}_{gridid}_withland.dat'  # noqa
-        try:
-            assert os.path.isfile(fn_land_rh)
-        except AssertionError:
-            xwm(f'No such withland file: {fn_land_rh}')
-        # print(f'  Reading land/region raster from: {fn_land_rh}')
-
-        seaice_landmask_RH = np.fromfile(fn_land_rh, dtype=np.uint8).reshape(ydim, xdim)  # noqa
+    x = np.linspace(xleft + res // 2, xright - res // 2, num=xdim, dtype=np.float32)  # noqa
+    y = np.linspace(yup - res // 2, ydown + res // 2, num=ydim, dtype=np.float32)  # noqa
 
     # Separate dataset creations for NH and SH, latter has RH fields
     if hem == 'north':
@@ -288,22 +374,18 @@ def create_regions_nc(gridid, nc_fn, product_version):
                     'standard_name': 'region',
                     'long_name': 'sea ice region mask',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_region.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_region),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_region', np.unique(seaice_region)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_region', seaice_region),
                     'coverage_content_type': 'image',
                 }),
                 sea_ice_region_surface_mask=(['y', 'x'], seaice_landmask, {
                     'standard_name': 'region',
                     'long_name': 'sea ice region mask with surface mask',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_landmask.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_landmask),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_landmask', np.unique(seaice_landmask)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_landmask', seaice_landmask),
                     'coverage_content_type': 'image',
                 }),
                 crs=([], '', crs_dict),
@@ -344,13 +426,13 @@ def create_regions_nc(gridid, nc_fn, product_version):
                 publisher_institution='National Snow and Ice Data Center, Cooperative Institute for Research in Environmental Sciences, University of Colorado at Boulder, Boulder, CO',  #noqa
                 publisher_url='https://nsidc.org/daac',
                 publisher_email='nsidc@nsidc.org',
-                geospatial_bounds_crs=geospatial_bounds_crs_str,
-                geospatial_bounds=geospatial_bounds_str,
-                geospatial_lat_min=geospatial_lat_min_str,
-                geospatial_lat_max=geospatial_lat_max_str,
+                geospatial_bounds_crs=geospatial_info['geospatial_bounds_crs'],
+                geospatial_bounds=geospatial_info['geospatial_bounds'],
+                geospatial_lat_min=geospatial_info['geospatial_lat_min'],
+                geospatial_lat_max=geospatial_info['geospatial_lat_max'],
                 geospatial_lat_units='degrees_north',
-                geospatial_lon_min=geospatial_lon_min_str,
-                geospatial_lon_max=geospatial_lon_max_str,
+                geospatial_lon_min=geospatial_info['geospatial_lon_min'],
+                geospatial_lon_max=geospatial_info['geospatial_lon_max'],
                 geospatial_lon_units='degrees_east',
             )
         )
@@ -361,44 +443,36 @@ def create_regions_nc(gridid, nc_fn, product_version):
                     'standard_name': 'region',
                     'long_name': 'seaice region mask',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_region.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_region),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_region_NASA', np.unique(seaice_region)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_region_NASA', seaice_region),
                     'coverage_content_type': 'image',
                 }),
                 sea_ice_region_NASA_surface_mask=(['y', 'x'], seaice_landmask, {
                     'standard_name': 'region',
                     'long_name': 'seaice region mask (NASA) with surface mask',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_landmask.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_landmask),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_region_NASA_landmask', np.unique(seaice_landmask)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_region_NASA_landmask', seaice_landmask),  # noqa
                     'coverage_content_type': 'image',
                 }),
                 sea_ice_region_RH=(['y', 'x'], seaice_region_RH, {
                     'standard_name': 'region',
                     'long_name': 'seaice region mask (RH)',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_region_RH.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_region_RH),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_region_RH', np.unique(seaice_region_RH)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_region_RH', seaice_region_RH),  # noqa
                     'coverage_content_type': 'image',
                 }),
                 sea_ice_region_RH_surface_mask=(['y', 'x'], seaice_landmask_RH, {
                     'standard_name': 'region',
                     'long_name': 'seaice region mask (RH) with surface mask',
                     'grid_mapping': 'crs',
-                    'valid_range': np.array((0, seaice_landmask_RH.max()), dtype=np.uint8),  # noqa
                     '_Unsigned': 'true',
-                    '_FillValue': np.array((255), dtype=np.uint8),
-                    'flag_values': np.unique(seaice_landmask_RH),
-                    'flag_meanings': get_flag_labels(hem, 'seaice_landmask_RH', np.unique(seaice_landmask_RH)),  # noqa
+                    '_FillValue': np.array((fill_value), dtype=np.uint8),
+                    **get_flag_attrs(hem, 'seaice_landmask_RH', seaice_landmask_RH),  # noqa
                     'coverage_content_type': 'image',
                 }),
                 crs=([], '', crs_dict),
@@ -439,87 +513,203 @@ def create_regions_nc(gridid, nc_fn, product_version):
                 publisher_institution='National Snow and Ice Data Center, Cooperative Institute for Research in Environmental Sciences, University of Colorado at Boulder, Boulder, CO',  #noqa
                 publisher_url='https://nsidc.org/daac',
                 publisher_email='nsidc@nsidc.org',
-                geospatial_bounds_crs=geospatial_bounds_crs_str,
-                geospatial_bounds=geospatial_bounds_str,
-                geospatial_lat_min=geospatial_lat_min_str,
-                geospatial_lat_max=geospatial_lat_max_str,
+                geospatial_bounds_crs=geospatial_info['geospatial_bounds_crs'],
+                geospatial_bounds=geospatial_info['geospatial_bounds'],
+                geospatial_lat_min=geospatial_info['geospatial_lat_min'],
+                geospatial_lat_max=geospatial_info['geospatial_lat_max'],
                 geospatial_lat_units='degrees_north',
-                geospatial_lon_min=geospatial_lon_min_str,
-                geospatial_lon_max=geospatial_lon_max_str,
+                geospatial_lon_min=geospatial_info['geospatial_lon_min'],
+                geospatial_lon_max=geospatial_info['geospatial_lon_max'],
                 geospatial_lon_units='degrees_east',
             )
         )
 
-    # ofn = f'seaice_regions_{gridid}.nc'
-    ofn = nc_fn
-
+    # Total ocean area of each region, from the matching surface mask
+    cell_area = get_cell_area(gridid, cell_area_dir)
     if hem == 'north':
-        ds.to_netcdf(
-            ofn,
-            encoding={
-                'sea_ice_region': {'zlib': True},
-                'sea_ice_region_surface_mask': {'zlib': True},
-            },
-        )
+        region_vars = (
+            ('sea_ice_region', 'sea_ice_region_surface_mask'),)
     elif hem == 'south':
-        ds.to_netcdf(
-            ofn,
-            encoding={
-                'sea_ice_region_NASA': {'zlib': True},
-                'sea_ice_region_NASA_surface_mask': {'zlib': True},
-                'sea_ice_region_RH': {'zlib': True},
-                'sea_ice_region_RH_surface_mask': {'zlib': True},
-            },
+        region_vars = (
+            ('sea_ice_region_NASA', 'sea_ice_region_NASA_surface_mask'),
+            ('sea_ice_region_RH', 'sea_ice_region_RH_surface_mask'),)
+    for region_var, surface_var in region_vars:
+        ocean_area = region_ocean_area(
+            ds[surface_var].values, cell_area,
+            ds[region_var].attrs['flag_values'])
+        ds[region_var].attrs['ocean_area'] = \
+            (ocean_area / 1e6).astype(np.float64)
+        ds[region_var].attrs['ocean_area_units'] = 'km2'
+
+    if with_cell_area:
+        ds['cell_area'] = (['y', 'x'], np.asarray(cell_area), {
+            'standard_name': 'cell_area',
+            'long_name': 'area of grid cell on the ellipsoid',
+            'units': 'm2',
+            'grid_mapping': 'crs',
+            'coverage_content_type': 'referenceInformation',
+        })
+        for region_var, surface_var in region_vars:
+            ds[region_var].attrs['cell_measures'] = 'area: cell_area'
+            ds[surface_var].attrs['cell_measures'] = 'area: cell_area'
+
+    if with_latlon:
+        lat, lon = get_latlon(gridid, geoloc_dir)
+        ds = ds.assign_coords(
+            lat=(['y', 'x'], np.asarray(lat), {
+                'standard_name': 'latitude',
+                'long_name': 'latitude of grid cell center',
+                'units': 'degrees_north',
+                'coverage_content_type': 'coordinate',
+            }),
+            lon=(['y', 'x'], np.asarray(lon), {
+                'standard_name': 'longitude',
+                'long_name': 'longitude of grid cell center',
+                'units': 'degrees_east',
+                'coverage_content_type': 'coordinate',
+            }),
         )
 
+    return ds
+
+
+def write_regions_nc(ds, nc_fn, layout=default_nc_layout, var_layouts=None):
+    # Write a region Dataset to nc_fn
+    # layout is the storage layout of the variables (see get_encoding),
+    # and var_layouts is an optional {varname: layout} override
+    ofn = nc_fn
+
+    # Each (y, x) variable -- the region masks, cell_area, lat and lon --
+    # gets its own layout
+    encoding = {}
+    for varname, var in ds.variables.items():
+        if var.dims != ('y', 'x'):
+            continue
+        var_layout = (var_layouts or {}).get(varname, layout)
+        encoding[varname] = get_encoding(var_layout, ds[varname].shape)
+    ds.to_netcdf(ofn, encoding=encoding)
+
     print(f'Wrote: {ofn}')
 
 
-if __name__ == '__main__':
-    import sys
+@timed_stage('create_regions_nc', grid_id='gridid', output_fns='nc_fn',
+             region_set=lambda args: ','.join(get_hem_sets(args['gridid'])[1]))  # noqa
+def create_regions_nc(gridid, nc_fn, product_version, dat_dir=None,
+                      cell_area_dir=None, with_cell_area=False,
+                      with_latlon=False, geoloc_dir=default_geoloc_dir,
+                      layout=default_nc_layout, var_layouts=None,
+                      cog_dir=None):
+    # Create a netCDF file from geotiffs with valid snow and seaice
+    #    nc_fn='./NSIDC-XXXX_{gridid.upper()}-SeaIceRegions-v1.0.nc'):
+    # The .dat files are read from dat_dir, by default ./<projid>_fields/
+    # See create_regions_ds and write_regions_nc for the other arguments
+    # With cog_dir, the region masks are also written there as COGs
 
+    if dat_dir is None:
+        dat_dir = f'./{gridid[:3]}_fields'
+
+    xleft, xright, yup, ydown, _, _ = get_gridid_info(gridid)
+    res, _ = get_gridres(gridid)
+    xdim = (xright - xleft) // res
+    ydim = (yup - ydown) // res
+    hem, fn_sets = get_hem_sets(gridid)
+    seaice_region_RH = None
+    seaice_landmask_RH = None
+
+    # Create output netCDF file via xarray
+    first_mask_str = f'{fn_sets[0]}'
+
+    fn_dat = f'{dat_dir}/seaice_regions_{first_mask_str}_{gridid}.dat'  # noqa
     try:
-        gridid = sys.argv[1]
-    except IndexError:
-        gridid = 'psn25'
-        print(f'Using default gridid: {gridid}')
+        assert os.path.isfile(fn_dat)
+    except AssertionError:
+        xwm(f'No such .dat file: {fn_dat}')
+    # print(f'  Reading region raster only from: {fn_dat}')
 
-    product_version = 'v1.0'
+    fn_land = f'{dat_dir}/seaice_regions_{first_mask_str}_{gridid}_withland.dat'  # noqa
+    try:
+        assert os.path.isfile(fn_land)
+    except AssertionError:
+        xwm(f'No such withland file: {fn_land}')
+    # print(f'  Reading land/region raster from: {fn_land}')
 
-    if 'psn' in gridid:
-        proj = 'PS'
-        geospatial_bounds_crs_str = 'EPSG:3411'
-        geospatial_bounds_str = 'POLYGON ((-3850000 5850000, 3750000 5850000, 3750000 -5350000, -3850000 -5350000, -3850000 5850000))'  # noqa
-        geospatial_lat_min_str = 30.98
-        geospatial_lat_max_str = 90.
-        geospatial_lon_min_str = -180.
-        geospatial_lon_max_str = 180.
-    elif 'pss' in gridid:
-        proj = 'PS'
-        geospatial_bounds_crs_str = 'EPSG:3412'
-        geospatial_bounds_str = 'POLYGON ((-3950000 4350000, 3950000 4350000, 3950000 -3950000, -3950000 -3950000, -3950000 4350000))'  # noqa
-        geospatial_lat_min_str = -90.
-        geospatial_lat_max_str = -39.23
-        geospatial_lon_min_str = -180.
-        geospatial_lon_max_str = 180.
-    elif 'e2n' in gridid:
-        proj = 'EASE2'
-        geospatial_bounds_crs_str = 'EPSG:6931'
-        geospatial_bounds_str = 'POLYGON ((-9000000 9000000, 9000000 9000000, 9000000 -9000000, -9000000 -9000000, -9000000 9000000))'  # noqa
-        geospatial_lat_min_str = 0.
-        geospatial_lat_max_str = 90.
-        geospatial_lon_min_str = -180.
-        geospatial_lon_max_str = 180.
-    elif 'e2s' in gridid:
-        proj = 'EASE2'
-        geospatial_bounds_crs_str = 'EPSG:6932'
-        geospatial_bounds_str = 'POLYGON ((-9000000 9000000, 9000000 9000000, 9000000 -9000000, -9000000 -9000000, -9000000 9000000))'  # noqa
-        geospatial_lat_min_str = -90.
-        geospatial_lat_max_str = 0.
-        geospatial_lon_min_str = -180.
-        geospatial_lon_max_str = 180.
+    seaice_region = np.fromfile(fn_dat, dtype=np.uint8).reshape(ydim, xdim)
+    seaice_landmask = np.fromfile(fn_land, dtype=np.uint8).reshape(ydim, xdim)
 
-    H = gridid[2].upper()
-    res = gridid[3:]
-    nc_fn = f'./NSIDC-0780_SeaIceRegions_{proj}-{H}{res}km_{product_version}.nc'
-    create_regions_nc(gridid, nc_fn, product_version)
+    if hem == 'south':
+        # Read in for RH
+        fn_dat_rh = f'{dat_dir}/seaice_regions_{fn_sets[1]}_{gridid}.dat'  # noqa
+
+        try:
+            assert os.path.isfile(fn_dat_rh)
+        except AssertionError:
+            xwm(f'No such .dat file: {fn_dat_rh}')
+        # print(f'  Reading region raster only from: {fn_dat_rh}')
+        seaice_region_RH = np.fromfile(fn_dat_rh, dtype=np.uint8).reshape(ydim, xdim)  # noqa
+
+        fn_land_rh = f'{dat_dir}/seaice_regions_{fn_sets[1]}_{gridid}_withland.dat'  # noqa
+        try:
+            assert os.path.isfile(fn_land_rh)
+        except AssertionError:
+            xwm(f'No such withland file: {fn_land_rh}')
+        # print(f'  Reading land/region raster from: {fn_land_rh}')
+
+        seaice_landmask_RH = np.fromfile(fn_land_rh, dtype=np.uint8).reshape(ydim, xdim)  # noqa
+
+    ds = create_regions_ds(
+        gridid, product_version, seaice_region, seaice_landmask,
+        seaice_region_RH, seaice_landmask_RH,
+        cell_area_dir=cell_area_dir, with_cell_area=with_cell_area,
+        with_latlon=with_latlon, geoloc_dir=geoloc_dir)
+    write_regions_nc(ds, nc_fn, layout=layout, var_layouts=var_layouts)
+
+    if cog_dir is not None:
+        from create_seaice_region_cogs import write_dataset_cogs
+
+        with stage_timer('create_regions_cogs', gridid,
+                         ','.join(get_hem_sets(gridid)[1])):
+            write_dataset_cogs(ds, gridid, cog_dir, product_version)
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description='Create the netCDF file of the region masks of a grid')
+    parser.add_argument('gridid', nargs='?', default='psn25')
+    parser.add_argument(
+        '--cell-area', action='store_true',
+        help='also write the area of each cell as cell_area')
+    parser.add_argument(
+        '--latlon', action='store_true',
+        help='also write the lat, lon of each cell as auxiliary coordinates')
+    parser.add_argument(
+        '--layout', default=default_nc_layout, choices=list(nc_layouts),
+        help='storage layout of the variables')
+    parser.add_argument(
+        '--chunks', help='chunk shape, eg 256x256 (overrides the layout)')
+    parser.add_argument(
+        '--complevel', type=int, help='zlib compression level (1-9)')
+    parser.add_argument(
+        '--no-shuffle', action='store_true', help='disable the shuffle filter')
+    parser.add_argument(
+        '--cog-dir',
+        help='also write the region masks as COGs in this directory')
+    args = parser.parse_args()
+
+    layout = dict(nc_layouts[args.layout])
+    if args.chunks:
+        layout['chunksizes'] = tuple(int(n) for n in args.chunks.split('x'))
+    if args.complevel is not None:
+        layout['zlib'] = True
+        layout['complevel'] = args.complevel
+    if args.no_shuffle:
+        layout['shuffle'] = False
+
+    product_version = 'v1.0'
+
+    nc_fn = get_nc_fn(args.gridid, product_version)
+    create_regions_nc(
+        args.gridid, nc_fn, product_version,
+        with_cell_area=args.cell_area, with_latlon=args.latlon,
+        layout=layout, cog_dir=args.cog_dir)
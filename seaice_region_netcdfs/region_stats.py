@@ -0,0 +1,198 @@
+"""
+region_stats.py
+
+Per-region sea ice extent, area and mean concentration
+
+Statistics for all regions -- and for every time step of a (T, Y, X)
+stack -- are computed together with np.bincount over a combined
+(time, region) index, instead of one boolean mask per region.  The
+stack is counted a block at a time, so the temporaries stay small even
+for a year of daily fields on the 3.125 km grids.
+
+Concentrations are in percent (0-100); other values (eg flags or NaN)
+are not valid and are not counted.  Pixels whose region value is a
+surface mask code (land, lake, ice on land, ice shelf, disconnected
+ocean, off earth; >= 30) are not counted either.
+
+    extent:     total area of valid pixels with conc >= extent_threshold
+    area:       total area of valid pixels weighted by conc / 100
+    mean_conc:  mean concentration of valid pixels
+    n_valid:    number of valid pixels
+
+Areas are in the units of cell_area, which is either a (Y, X) array or
+a constant; it defaults to 1, ie areas in pixels.
+
+Usage:
+    python region_stats.py <nc_fn> <varname> <conc_fn.npy> [<extent_threshold>]
+  eg
+    python region_stats.py NSIDC-0780_SeaIceRegions_PS-N25km_v1.0.nc sea_ice_region_surface_mask conc_20211003.npy  # noqa
+"""
+
+import os
+import sys
+import numpy as np
+from netCDF4 import Dataset
+
+from create_seaice_region_netcdfs import get_flag_labels, get_nc_fn
+
+# Region values at or above this are surface mask codes, not regions
+min_surface_value = 30
+default_extent_threshold = 15.
+default_max_block_bytes = 64 * 2**20
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_region_labels(hem, varname, region_values):
+    """Return the flag_meanings label of each region value"""
+    return get_flag_labels(hem, varname, region_values).split()
+
+
+def regional_stats(
+        conc, regions, hem, varname, cell_area=1.,
+        extent_threshold=default_extent_threshold,
+        max_block_bytes=default_max_block_bytes):
+    """Return a dict of per-region statistics of conc
+
+    conc is (Y, X) or (T, Y, X), and may be a masked array, whose masked
+    pixels are not valid; the statistics are (n_regions, ) or
+    (T, n_regions), in the order of 'region_values'.  The stack is
+    counted in blocks of time steps (or, on large grids, of pixels of one
+    time step) of about max_block_bytes of temporaries each
+    """
+    conc = np.asanyarray(conc)
+    is_stack = conc.ndim == 3
+    if not is_stack:
+        conc = conc[np.newaxis]
+    n_times = conc.shape[0]
+    assert conc.shape[1:] == regions.shape
+
+    region_values = np.flatnonzero(
+        np.bincount(regions.ravel(), minlength=256)[:min_surface_value])
+    n_regions = len(region_values)
+    key_dtype = np.int32 if n_times * n_regions < 2**31 else np.int64
+    region_column = np.full(256, -1, dtype=key_dtype)
+    region_column[region_values] = np.arange(n_regions)
+
+    # Only the pixels of regions are counted; these are computed once
+    pixel_column = region_column[regions].ravel()
+    region_pixels = np.flatnonzero(pixel_column >= 0)
+    region_column = pixel_column[region_pixels]
+    region_area = np.broadcast_to(
+        cell_area, regions.shape).ravel()[region_pixels]
+    n_pixels = len(region_pixels)
+
+    # Temporaries per counted pixel: conc, area and weights as float64,
+    # the key and the validity mask
+    max_block_pixels = max(max_block_bytes // 48, 1)
+    block_times = max(min(max_block_pixels // max(n_pixels, 1), n_times), 1)
+    block_pixels = max(min(max_block_pixels, n_pixels), 1)
+
+    n_valid = np.zeros((n_times, n_regions), dtype=np.int64)
+    conc_sum = np.zeros((n_times, n_regions))
+    area = np.zeros((n_times, n_regions))
+    extent = np.zeros((n_times, n_regions))
+    conc = conc.reshape(n_times, -1)
+    for t0 in range(0, n_times, block_times):
+        t1 = min(t0 + block_times, n_times)
+        n_bins = (t1 - t0) * n_regions
+        time_column = (np.arange(t1 - t0, dtype=key_dtype)
+                       * n_regions)[:, np.newaxis]
+        for p0 in range(0, n_pixels, block_pixels):
+            pixels = region_pixels[p0:p0 + block_pixels]
+            block_conc = np.ma.filled(
+                conc[t0:t1, pixels].astype(np.float64), np.nan)
+            with np.errstate(invalid='ignore'):
+                is_valid = (block_conc >= 0) & (block_conc <= 100)
+            key = (time_column
+                   + region_column[p0:p0 + block_pixels])[is_valid]
+            valid_conc = block_conc[is_valid]
+            valid_area = np.broadcast_to(
+                region_area[p0:p0 + block_pixels],
+                block_conc.shape)[is_valid]
+            del block_conc, is_valid
+
+            n_valid[t0:t1] += np.bincount(
+                key, minlength=n_bins).reshape(-1, n_regions)
+            conc_sum[t0:t1] += np.bincount(
+                key, weights=valid_conc,
+                minlength=n_bins).reshape(-1, n_regions)
+            area[t0:t1] += np.bincount(
+                key, weights=valid_area * valid_conc / 100.,
+                minlength=n_bins).reshape(-1, n_regions)
+            extent[t0:t1] += np.bincount(
+                key, weights=valid_area * (valid_conc >= extent_threshold),
+                minlength=n_bins).reshape(-1, n_regions)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean_conc = conc_sum / n_valid
+
+    stats = {
+        'region_values': region_values,
+        'region_labels': get_region_labels(hem, varname, region_values),
+        'n_valid': n_valid,
+        'extent': extent,
+        'area': area,
+        'mean_conc': mean_conc,
+    }
+    if not is_stack:
+        for name in ('n_valid', 'extent', 'area', 'mean_conc'):
+            stats[name] = stats[name][0]
+
+    return stats
+
+
+def regional_stats_from_nc(
+        conc, nc_fn, varname, cell_area=1.,
+        extent_threshold=default_extent_threshold):
+    """Return regional_stats() using a region variable of a netCDF file"""
+    ds = Dataset(nc_fn, 'r')
+    ds.set_auto_maskandscale(False)
+    regions = np.array(ds.variables[varname][:], dtype=np.uint8)
+    hem = 'north' if float(ds.geospatial_lat_max) > 0 else 'south'
+    ds.close()
+
+    return regional_stats(
+        conc, regions, hem, varname, cell_area=cell_area,
+        extent_threshold=extent_threshold)
+
+
+def regional_stats_for_gridid(
+        conc, gridid, varname, nc_dir='.', product_version='v1.0',
+        cell_area=1., extent_threshold=default_extent_threshold):
+    """Return regional_stats() for a gridid, eg 'psn25', from nc_dir"""
+    nc_fn = os.path.join(
+        nc_dir, os.path.basename(get_nc_fn(gridid, product_version)))
+
+    return regional_stats_from_nc(
+        conc, nc_fn, varname, cell_area=cell_area,
+        extent_threshold=extent_threshold)
+
+
+if __name__ == '__main__':
+    try:
+        nc_fn = sys.argv[1]
+        varname = sys.argv[2]
+        conc_fn = sys.argv[3]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        extent_threshold = float(sys.argv[4])
+    except IndexError:
+        extent_threshold = default_extent_threshold
+
+    conc = np.load(conc_fn)
+    stats = regional_stats_from_nc(
+        conc, nc_fn, varname, extent_threshold=extent_threshold)
+
+    if conc.ndim == 2:
+        print(f'{"region":>40s} {"n_valid":>10s} {"extent":>12s} {"area":>12s} {"mean_conc":>10s}')  # noqa
+        for i, label in enumerate(stats['region_labels']):
+            print(f'{label:>40s} {stats["n_valid"][i]:10d} {stats["extent"][i]:12.1f} {stats["area"][i]:12.1f} {stats["mean_conc"][i]:10.2f}')  # noqa
+    else:
+        for name in ('extent', 'area', 'mean_conc'):
+            print(f'{name}:')
+            for i, label in enumerate(stats['region_labels']):
+                print(f'  {label}: {stats[name][:, i]}')
@@ -0,0 +1,305 @@
+"""
+stage_timer.py
+
+Per-stage timing and memory instrumentation, written as a JSON run report
+
+The pipeline stages are wrapped in stage_timer(), or decorated with
+timed_stage(), which -- if the environment variable SEAICE_REGIONS_REPORT
+names a report file -- appends one JSON line per stage to that file:
+
+    {"run_id": ..., "stage": "add_landmask", "grid_id": "psn25",
+     "region_set": "nh", "seconds": 0.41, "peak_mb": 212.3,
+     "peak_traced_mb": null, "bytes_written": 136192, "status": "ok",
+     "pid": 1234, "start": "2024-05-01T12:00:00.123456"}
+
+peak_mb is the peak resident set size of the process while the stage ran,
+sampled every rss_sample_interval seconds.  With SEAICE_REGIONS_TRACEMALLOC=1,
+peak_traced_mb is the peak of the memory allocated by Python and numpy
+within the stage, from tracemalloc (which slows allocation down).
+run_id is $SEAICE_REGIONS_RUN_ID, which the shell drivers set.
+
+Lines are appended with one write each, so the processes of a run -- the
+shell drivers' commands or build_regions.py's workers -- share one report.
+Without SEAICE_REGIONS_REPORT, stage_timer() does nothing.
+
+Usage:
+    python stage_timer.py run --stage S [--grid-id G] [--region-set R]
+                              [--output FN ...] -- <command> [<arg> ...]
+    python stage_timer.py summary <report_fn> [<json_fn>]
+  eg
+    SEAICE_REGIONS_REPORT=run.jsonl python stage_timer.py run --stage gdalwarp_UL --grid-id psn25 --output q_UL.nc -- gdalwarp ...  # noqa
+    python stage_timer.py summary run.jsonl run_report.json
+
+  run times a command -- eg gdalwarp -- and records it, with the peak RSS
+  of its process tree, as one stage.  summary prints the total time of
+  each stage and optionally writes the report as a single JSON document.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import inspect
+import argparse
+import functools
+import resource
+import threading
+import subprocess
+import tracemalloc
+import datetime as dt
+from contextlib import contextmanager
+
+report_envvar = 'SEAICE_REGIONS_REPORT'
+run_id_envvar = 'SEAICE_REGIONS_RUN_ID'
+tracemalloc_envvar = 'SEAICE_REGIONS_TRACEMALLOC'
+
+region_sets = ('nh', 'sh_orig', 'sh_RH')
+rss_sample_interval = 0.01  # seconds
+
+_page_size = os.sysconf('SC_PAGE_SIZE')
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def get_report_fn():
+    """Return the name of the report file, or None if not reporting"""
+    return os.environ.get(report_envvar) or None
+
+
+def guess_region_set(fn):
+    """Return the region set named in a filename, eg 'sh_RH', or None"""
+    if fn is None:
+        return None
+    match = re.search(
+        r'(?:^|_)(' + '|'.join(region_sets) + r')(?=_|\.|$)',
+        os.path.basename(fn))
+
+    return match.group(1) if match else None
+
+
+def current_rss():
+    """Return the resident set size of this process (bytes)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _page_size
+    except OSError:
+        # No /proc: the peak so far is the best available
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RssSampler(threading.Thread):
+    """Track the peak RSS of this process until stop() is called"""
+
+    def __init__(self, interval=rss_sample_interval):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss())
+
+        return self.peak
+
+
+def write_record(record, report_fn=None):
+    """Append one stage record to the report file"""
+    if report_fn is None:
+        report_fn = get_report_fn()
+    line = json.dumps(record) + '\n'
+    with open(report_fn, 'a') as f:
+        f.write(line)
+
+
+def make_record(stage, grid_id, region_set, start, seconds, peak_mb,
+                peak_traced_mb, output_fns, status):
+    return {
+        'run_id': os.environ.get(run_id_envvar),
+        'stage': stage,
+        'grid_id': grid_id,
+        'region_set': region_set,
+        'seconds': round(seconds, 6),
+        'peak_mb': None if peak_mb is None else round(peak_mb, 3),
+        'peak_traced_mb':
+            None if peak_traced_mb is None else round(peak_traced_mb, 3),
+        'bytes_written': sum(
+            os.path.getsize(fn) for fn in output_fns if os.path.isfile(fn)),
+        'status': status,
+        'pid': os.getpid(),
+        'start': start.isoformat(),
+    }
+
+
+@contextmanager
+def stage_timer(stage, grid_id=None, region_set=None, output_fns=()):
+    """Time the enclosed block as one stage of the run report
+
+    output_fns are the files the stage writes; their sizes at the end of
+    the stage are reported as bytes_written.  Nothing is measured unless
+    SEAICE_REGIONS_REPORT is set
+    """
+    report_fn = get_report_fn()
+    if report_fn is None:
+        yield
+        return
+
+    # Only the outermost of nested stages traces, as tracemalloc has
+    # a single peak
+    use_tracemalloc = os.environ.get(tracemalloc_envvar) == '1' and \
+        not tracemalloc.is_tracing()
+    if use_tracemalloc:
+        tracemalloc.start()
+
+    sampler = RssSampler()
+    sampler.start()
+    start = dt.datetime.now()
+    start_time = time.perf_counter()
+    status = 'error'
+    try:
+        yield
+        status = 'ok'
+    finally:
+        seconds = time.perf_counter() - start_time
+        peak_mb = sampler.stop() / 2**20
+        peak_traced_mb = None
+        if use_tracemalloc:
+            peak_traced_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+        write_record(
+            make_record(stage, grid_id, region_set, start, seconds, peak_mb,
+                        peak_traced_mb, output_fns, status),
+            report_fn)
+
+
+def timed_stage(stage, grid_id=None, output_fns=None, region_set=None):
+    """Decorate a function so that each call is timed as one stage
+
+    grid_id, output_fns and region_set are each the name of an argument of
+    the function, or a function of its arguments (a dict, with the
+    defaults filled in).  output_fns may give one filename or a list;
+    region_set defaults to the one named in the first output filename
+    """
+    def get_value(spec, arguments):
+        if spec is None:
+            return None
+        if callable(spec):
+            return spec(arguments)
+
+        return arguments[spec]
+
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if get_report_fn() is None:
+                return func(*args, **kwargs)
+
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            fns = get_value(output_fns, bound.arguments) or []
+            if isinstance(fns, str):
+                fns = [fns]
+            if region_set is None:
+                stage_region_set = guess_region_set(fns[0] if fns else None)
+            else:
+                stage_region_set = get_value(region_set, bound.arguments)
+
+            with stage_timer(stage, get_value(grid_id, bound.arguments),
+                             stage_region_set, fns):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def run_command(cmd, stage, grid_id=None, region_set=None, output_fns=()):
+    """Run cmd as a subprocess, recording it as a stage; return its status
+
+    peak_mb is the largest peak RSS of cmd and its descendants
+    """
+    start = dt.datetime.now()
+    start_time = time.perf_counter()
+    returncode = subprocess.call(cmd)
+    seconds = time.perf_counter() - start_time
+    peak_mb = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+
+    if get_report_fn() is not None:
+        write_record(make_record(
+            stage, grid_id, region_set, start, seconds, peak_mb, None,
+            output_fns, 'ok' if returncode == 0 else f'exit {returncode}'))
+
+    return returncode
+
+
+def read_report(report_fn):
+    """Return the list of stage records of a report file"""
+    with open(report_fn) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    """Return the totals of the records of each stage"""
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {
+            'count': 0, 'seconds': 0., 'peak_mb': 0., 'bytes_written': 0})
+        total['count'] += 1
+        total['seconds'] += record['seconds']
+        total['peak_mb'] = max(total['peak_mb'], record['peak_mb'] or 0.)
+        total['bytes_written'] += record['bytes_written']
+
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Record and summarize per-stage run reports')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser(
+        'run', help='run and record a command as one stage')
+    run_parser.add_argument('--stage', required=True)
+    run_parser.add_argument('--grid-id')
+    run_parser.add_argument('--region-set')
+    run_parser.add_argument(
+        '--output', nargs='*', default=[], help='files written by the command')
+    run_parser.add_argument('cmd', nargs=argparse.REMAINDER)
+
+    summary_parser = subparsers.add_parser(
+        'summary', help='print the totals of each stage of a report')
+    summary_parser.add_argument('report_fn')
+    summary_parser.add_argument(
+        'json_fn', nargs='?', help='also write the report as one JSON file')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+        if not cmd:
+            xwm('No command given to run')
+        sys.exit(run_command(
+            cmd, args.stage, args.grid_id, args.region_set, args.output))
+
+    records = read_report(args.report_fn)
+    totals = summarize(records)
+    print(f'{"stage":>20s} {"count":>6s} {"seconds":>10s} {"peak_mb":>9s} {"bytes_written":>14s}')  # noqa
+    for stage, total in sorted(
+            totals.items(), key=lambda item: -item[1]['seconds']):
+        print(f'{stage:>20s} {total["count"]:6d} {total["seconds"]:10.2f} {total["peak_mb"]:9.1f} {total["bytes_written"]:14d}')  # noqa
+
+    if args.json_fn:
+        with open(args.json_fn, 'w') as f:
+            json.dump({'report_fn': args.report_fn,
+                       'records': records,
+                       'totals': totals}, f, indent=1)
+        print(f'Wrote: {args.json_fn}')
@@ -11,6 +11,9 @@ import sys
 import numpy as np
 from netCDF4 import Dataset
 
+from grid_defs import get_grid_def, grid_names
+from stage_timer import guess_region_set, timed_stage
+
 usage_string = """
 
     Usage:
@@ -20,110 +23,31 @@ usage_string = """
 """
 
 
+def get_grid_info(grid_name):
+    # Return the size, in cells, of each quadrant about the pole
+    grid_def = get_grid_def(grid_name)
+    res = grid_def['res']
+
+    return {
+        'grid_name': grid_name,
+        'xleft': -grid_def['xleft'] // res,
+        'xright': grid_def['xright'] // res,
+        'yupper': grid_def['yup'] // res,
+        'ylower': -grid_def['ydown'] // res, }
+
+
 grid_info_dict = {
-    'psn25': {
-        'grid_name': 'psn25',
-        'xleft': 154,
-        'xright': 150,
-        'yupper': 234,
-        'ylower': 214, },
-    'psn12.5': {
-        'grid_name': 'psn12.5',
-        'xleft': 308,
-        'xright': 300,
-        'yupper': 468,
-        'ylower': 428, },
-    'psn6.25': {
-        'grid_name': 'psn6.25',
-        'xleft': 616,
-        'xright': 600,
-        'yupper': 936,
-        'ylower': 856, },
-    'psn3.125': {
-        'grid_name': 'psn3.125',
-        'xleft': 1232,
-        'xright': 1200,
-        'yupper': 1872,
-        'ylower': 1712, },
-    'pss25': {
-        'grid_name': 'pss25',
-        'xleft': 158,
-        'xright': 158,
-        'yupper': 174,
-        'ylower': 158, },
-    'pss12.5': {
-        'grid_name': 'pss12.5',
-        'xleft': 316,
-        'xright': 316,
-        'yupper': 348,
-        'ylower': 316, },
-    'pss6.25': {
-        'grid_name': 'pss6.25',
-        'xleft': 632,
-        'xright': 632,
-        'yupper': 696,
-        'ylower': 632, },
-    'pss3.125': {
-        'grid_name': 'pss3.125',
-        'xleft': 1264,
-        'xright': 1264,
-        'yupper': 1392,
-        'ylower': 1264, },
-    'e2n25': {
-        'grid_name': 'e2n25',
-        'xleft': 360,
-        'xright': 360,
-        'yupper': 360,
-        'ylower': 360, },
-    'e2n12.5': {
-        'grid_name': 'e2n12.5',
-        'xleft': 720,
-        'xright': 720,
-        'yupper': 720,
-        'ylower': 720, },
-    'e2n6.25': {
-        'grid_name': 'e2n6.25',
-        'xleft': 1440,
-        'xright': 1440,
-        'yupper': 1440,
-        'ylower': 1440, },
-    'e2n3.125': {
-        'grid_name': 'e2n3.125',
-        'xleft': 2880,
-        'xright': 2880,
-        'yupper': 2880,
-        'ylower': 2880, },
-    'e2s25': {
-        'grid_name': 'e2s25',
-        'xleft': 360,
-        'xright': 360,
-        'yupper': 360,
-        'ylower': 360, },
-    'e2s12.5': {
-        'grid_name': 'e2s12.5',
-        'xleft': 720,
-        'xright': 720,
-        'yupper': 720,
-        'ylower': 720, },
-    'e2s6.25': {
-        'grid_name': 'e2s6.25',
-        'xleft': 1440,
-        'xright': 1440,
-        'yupper': 1440,
-        'ylower': 1440, },
-    'e2s3.125': {
-        'grid_name': 'e2s3.125',
-        'xleft': 2880,
-        'xright': 2880,
-        'yupper': 2880,
-        'ylower': 2880, },
-}
+    grid_name: get_grid_info(grid_name) for grid_name in grid_names}
 
 
 def xwm(m='exiting in xwm()'):
     raise SystemExit(m)
 
 
+@timed_stage('stitch_quads',
+             grid_id=lambda args: args['grid_info']['grid_name'],
+             output_fns=lambda args: f'{args["bfn"]}.dat',
+             region_set=lambda args: guess_region_set(args['bfn']))
 def stitch_quads(bfn, grid_info, n_regions, overwrite=True):
     # ofn = bfn + '.nc'
     # ofn = bfn + '.dat'
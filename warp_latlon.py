@@ -0,0 +1,138 @@
+"""
+warp_latlon.py
+
+Warp the rasterized latlon region map onto a polar grid in a single pass
+
+Every target cell center is inverse-projected to lat/lon in one vectorized
+call, and the latlon raster is sampled at the nearest latlon cell by index
+arithmetic.  This is the same nearest-neighbour sampling as
+'gdalwarp -r near', but without the four quadrants (and their .nc files)
+and without stitch_quads.py.  The stitched .dat file is written directly.
+
+Usage:
+    python warp_latlon.py <nc_latlon_fn> <grid_name> [<ofn>]
+  eg
+    python warp_latlon.py seaice_regions_nh.nc psn25
+
+  ofn defaults to <layername>_<grid_name>.dat, the name of the stitched
+  .dat file that gen_regionsmask.sh would have produced
+"""
+
+import os
+import sys
+import numpy as np
+from netCDF4 import Dataset
+from pyproj import Transformer
+
+from grid_defs import get_grid_def
+from stitch_quads import determine_num_regions
+
+
+def xwm(m='exiting in xwm()'):
+    raise SystemExit(m)
+
+
+def read_latlon_raster(nc_latlon_fn, varname='Band1'):
+    """Return the latlon raster and the lats and lons of its cell centers"""
+    ds = Dataset(nc_latlon_fn, 'r')
+    ds.set_auto_maskandscale(False)
+    latlon_data = np.array(ds.variables[varname][:], dtype=np.uint8)
+    lats = np.array(ds.variables['lat'][:], dtype=np.float64)
+    lons = np.array(ds.variables['lon'][:], dtype=np.float64)
+    ds.close()
+
+    assert latlon_data.shape == (len(lats), len(lons))
+
+    return latlon_data, lats, lons
+
+
+def latlon_indexes(coords, values):
+    """Return the index of the (regular) cell containing each value
+
+    Values outside of the coordinate range are given an index of -1
+    """
+    delta = (coords[-1] - coords[0]) / (len(coords) - 1)
+    edge = coords[0] - delta / 2
+    with np.errstate(invalid='ignore'):
+        idx = np.floor((values - edge) / delta)
+    idx[~np.isfinite(idx) | (idx < 0) | (idx >= len(coords))] = -1
+
+    return idx.astype(np.int64)
+
+
+def warp_latlon_to_grid(
+        latlon_data, lats, lons, grid_def, n_regions=None, block_rows=256):
+    """Return the (ydim, xdim) grid sampled from the latlon raster
+
+    Row 0 is the top (max-y) row of the grid, as in the stitched .dat files
+    """
+    res = grid_def['res']
+    xdim = grid_def['xdim']
+    ydim = grid_def['ydim']
+
+    transformer = Transformer.from_crs(
+        f'EPSG:{grid_def["epsgcode"]}', 'EPSG:4326', always_xy=True)
+
+    x = grid_def['xleft'] + (np.arange(xdim) + 0.5) * res
+    y = grid_def['yup'] - (np.arange(ydim) + 0.5) * res
+
+    # Longitudes wrap around; latitudes do not
+    n_lons = len(lons)
+    lon_edge = lons[0] - (lons[-1] - lons[0]) / (n_lons - 1) / 2
+
+    data = np.zeros((ydim, xdim), dtype=np.uint8)
+    # Process in blocks of rows to bound the size of the float arrays
+    for row0 in range(0, ydim, block_rows):
+        row1 = min(row0 + block_rows, ydim)
+        xx, yy = np.meshgrid(x, y[row0:row1])
+        cell_lons, cell_lats = transformer.transform(xx, yy)
+
+        lat_idx = latlon_indexes(lats, cell_lats)
+        lon_idx = latlon_indexes(
+            lons, (cell_lons - lon_edge) % 360. + lon_edge)
+        is_valid = (lat_idx >= 0) & (lon_idx >= 0)
+
+        block = np.zeros(xx.shape, dtype=np.uint8)
+        block[is_valid] = latlon_data[lat_idx[is_valid], lon_idx[is_valid]]
+        data[row0:row1, :] = block
+
+    if n_regions is not None:
+        # Limit to number of regions, as stitch_quads does
+        data[data > n_regions] = 0
+
+    return data
+
+
+def warp_latlon(nc_latlon_fn, grid_name, ofn=None, varname='Band1'):
+    """Warp a latlon raster .nc file onto grid_name and write a .dat file"""
+    layername = os.path.splitext(nc_latlon_fn)[0]
+    if ofn is None:
+        ofn = f'{layername}_{grid_name}.dat'
+
+    grid_def = get_grid_def(grid_name)
+    n_regions = determine_num_regions(layername, grid_name)
+
+    latlon_data, lats, lons = read_latlon_raster(nc_latlon_fn, varname)
+    data = warp_latlon_to_grid(
+        latlon_data, lats, lons, grid_def, n_regions=n_regions)
+
+    data.tofile(ofn)
+    print(f'  Wrote data to: {ofn}')
+    print(f'    of shape: ({grid_def["xdim"]}, {grid_def["ydim"]})')
+
+    return ofn
+
+
+if __name__ == '__main__':
+    try:
+        nc_latlon_fn = sys.argv[1]
+        grid_name = sys.argv[2]
+    except IndexError:
+        xwm(__doc__)
+
+    try:
+        ofn = sys.argv[3]
+    except IndexError:
+        ofn = None
+
+    warp_latlon(nc_latlon_fn, grid_name, ofn)